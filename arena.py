@@ -0,0 +1,356 @@
+import random
+from array import array
+from collections import deque
+
+import engine
+from engine import CLASSIC, MODERN, SNAKE_BLOCK
+from spawn import spawn_region
+
+DIRECTIONS = [engine.LEFT, engine.RIGHT, engine.UP, engine.DOWN]
+
+# --- Events returned by Arena.step() ---
+EAT = engine.EAT
+BONUS = engine.BONUS
+BORDER = engine.BORDER
+CRASH = engine.CRASH
+
+# --- Items ---
+FOOD = 0
+BONUS_ITEM = 1
+
+# --- Rules ---
+FOOD_PER_SNAKE = 0.5
+BONUS_PER_FOOD = 0.2
+RESPAWN_TICKS = 20
+SPAWN_ATTEMPTS = 64
+
+NO_OWNER = -1
+
+
+class ArenaSnake:
+    # One snake of an arena. Its segments are kept as a deque of cells from tail to head, which cells
+    # are occupied is known from the shared grid of the arena only.
+    def __init__(self, index, player=False):
+        self.index = index
+        self.player = player
+        self.body = deque()
+        self.head_seq = 0
+        self.tail_seq = 0
+        self.x = 0
+        self.y = 0
+        self.dx = 0
+        self.dy = 0
+        self.length = 1
+        self.growth_step = 1
+        self.score = 0
+        self.hearts = engine.MAX_HEARTS
+        self.border_counter = 0
+        self.alive = False
+        self.active = True
+        self.respawn_tick = 0
+        self.target = None
+
+    def __len__(self):
+        return len(self.body)
+
+
+class Arena:
+    # Many snakes on one board with the rules of engine.step, sharing the food and the bonuses.
+    #
+    # All bodies are stamped into one padded occupancy grid: a cell remembers the snake that entered
+    # it last and the sequence number of that segment, so it is occupied while the segment has not
+    # left the tail of its snake. Collisions with any body are one grid lookup, heads meeting in the
+    # same cell are found with a dict of this tick's heads, and a dead snake frees all its cells by
+    # moving its tail sequence up to its head. A tick costs the same per snake whatever the lengths.
+    #
+    # With record_changes the cells whose picture changed are collected in changes as (x, y, owner or
+    # NO_OWNER) and the items placed and taken in item_changes as (kind, x, y, present), for the
+    # renderer or the network server, which have to empty the lists.
+    def __init__(self, mode, width, height, snakes, players=0, seed=None, respawn=True, record_changes=True,
+                 foods=None):
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.cols = width // SNAKE_BLOCK
+        self.rows = height // SNAKE_BLOCK
+        self.grid_width = self.cols + 2
+        self.rng = random.Random(seed)
+        self.respawn = respawn
+        self.record_changes = record_changes
+
+        grid_size = self.grid_width * (self.rows + 2)
+        self.owner = array("l", [NO_OWNER]) * grid_size
+        self.stamps = array("q", [-1]) * grid_size
+        self.region = spawn_region(width, height, SNAKE_BLOCK, engine.FOOD_MARGIN)
+
+        self.snakes = [ArenaSnake(index, index < players) for index in range(snakes)]
+        self.tails = [0] * snakes
+        self.foods = set()
+        self.bonuses = set()
+        self.changes = []
+        self.item_changes = []
+        self.ticks = 0
+        self.deaths = 0
+
+        if foods is None:
+            foods = max(1, round(snakes * FOOD_PER_SNAKE))
+
+        self.max_bonuses = round(foods * BONUS_PER_FOOD)
+
+        for snake in self.snakes:
+            self._spawn_snake(snake)
+
+        for _ in range(foods):
+            self._place(FOOD)
+
+    def occupied(self, x, y):
+        cell = (y + 1) * self.grid_width + x + 1
+        owner = self.owner[cell]
+        return owner != NO_OWNER and self.stamps[cell] >= self.tails[owner]
+
+    def _outside(self, x, y):
+        return x < 0 or x >= self.cols or y < 0 or y >= self.rows
+
+    def _free_cell(self):
+        left, top, right, bottom = self.region
+
+        for _ in range(SPAWN_ATTEMPTS):
+            x = self.rng.randint(left, right)
+            y = self.rng.randint(top, bottom)
+
+            if not self.occupied(x, y) and (x, y) not in self.foods and (x, y) not in self.bonuses:
+                return x, y
+
+        return None
+
+    def _place(self, kind):
+        position = self._free_cell()
+
+        if position is not None:
+            (self.foods if kind == FOOD else self.bonuses).add(position)
+
+            if self.record_changes:
+                self.item_changes.append((kind, position[0], position[1], True))
+
+    def _take(self, kind, position):
+        (self.foods if kind == FOOD else self.bonuses).remove(position)
+
+        if self.record_changes:
+            self.item_changes.append((kind, position[0], position[1], False))
+
+    def add_snake(self, player=True):
+        # A snake joining a running arena takes the slot of one that left, if there is one
+        snake = next((snake for snake in self.snakes if not snake.active), None)
+
+        if snake is None:
+            snake = ArenaSnake(len(self.snakes), player)
+            self.snakes.append(snake)
+            self.tails.append(0)
+
+        snake.player = player
+        snake.active = True
+        self._spawn_snake(snake)
+        return snake
+
+    def remove_snake(self, snake):
+        if snake.alive:
+            self._kill(snake)
+
+        snake.active = False
+
+    def _spawn_snake(self, snake):
+        position = self._free_cell()
+
+        if position is None:
+            snake.respawn_tick = self.ticks + RESPAWN_TICKS
+            return
+
+        snake.x, snake.y = position
+        snake.dx, snake.dy = (0, 0) if snake.player else self.rng.choice(DIRECTIONS)
+        snake.length = 1
+        snake.growth_step = 1
+        snake.score = 0
+        snake.hearts = engine.MAX_HEARTS
+        snake.border_counter = 0
+        snake.target = None
+        snake.alive = True
+        self._push_head(snake, snake.x, snake.y)
+
+    def _push_head(self, snake, x, y):
+        cell = (y + 1) * self.grid_width + x + 1
+        self.owner[cell] = snake.index
+        self.stamps[cell] = snake.head_seq
+        snake.body.append(cell)
+        snake.head_seq += 1
+
+        if self.record_changes:
+            self.changes.append((x, y, snake.index))
+
+    def _pop_tail(self, snake):
+        cell = snake.body.popleft()
+        snake.tail_seq += 1
+        self.tails[snake.index] = snake.tail_seq
+
+        if self.record_changes and self.owner[cell] == snake.index:
+            self._changed(cell, NO_OWNER)
+
+    def _changed(self, cell, owner):
+        y, x = divmod(cell, self.grid_width)
+        self.changes.append((x - 1, y - 1, owner))
+
+    def _kill(self, snake):
+        # The whole body is freed at once, only the renderer needs its cells
+        snake.alive = False
+        snake.respawn_tick = self.ticks + RESPAWN_TICKS
+        snake.tail_seq = snake.head_seq
+        self.tails[snake.index] = snake.tail_seq
+        self.deaths += 1
+
+        if self.record_changes:
+            for cell in snake.body:
+                if self.owner[cell] == snake.index:
+                    self._changed(cell, NO_OWNER)
+
+        snake.body.clear()
+
+    def _steer(self, snake):
+        # Computer snakes head for a food item of their own choosing and take the first free cell
+        # that brings them closer, without turning back or leaving the board
+        if self._outside(snake.x, snake.y):
+            return
+
+        if snake.target not in self.foods:
+            snake.target = self.rng.choice(tuple(self.foods)) if self.foods else None
+
+        target_x, target_y = snake.target if snake.target is not None else (snake.x, snake.y)
+        best = None
+        best_distance = 0
+
+        for dx, dy in DIRECTIONS:
+            if dx == -snake.dx and dy == -snake.dy:
+                continue
+
+            x = snake.x + dx
+            y = snake.y + dy
+
+            if self._outside(x, y) or self.occupied(x, y):
+                continue
+
+            distance = abs(x - target_x) + abs(y - target_y)
+
+            if best is None or distance < best_distance:
+                best = dx, dy
+                best_distance = distance
+
+        if best is not None:
+            snake.dx, snake.dy = best
+
+    def step(self):
+        # Returns the events of every snake as (snake, event) pairs
+        self.ticks += 1
+        events = []
+        moving = []
+        cols = self.cols
+        rows = self.rows
+
+        for snake in self.snakes:
+            if not snake.alive:
+                if self.respawn and snake.active and self.ticks >= snake.respawn_tick:
+                    self._spawn_snake(snake)
+
+                continue
+
+            if not snake.player:
+                self._steer(snake)
+
+            # The head wraps around only after it has been outside the field for one tick
+            x = 0 if snake.x >= cols else cols - 1 if snake.x < 0 else snake.x
+            y = 0 if snake.y >= rows else rows - 1 if snake.y < 0 else snake.y
+            snake.x = x = x + snake.dx
+            snake.y = y = y + snake.dy
+            crashed = False
+
+            if x >= cols or x < 0 or y >= rows or y < 0:
+                if self.mode == CLASSIC:
+                    snake.border_counter += 1
+                    snake.hearts -= 1
+                    events.append((snake, BORDER))
+                    crashed = snake.hearts <= 0 or snake.border_counter >= engine.MAX_BORDER_CROSSINGS
+                else:
+                    crashed = True
+
+            moving.append((snake, crashed))
+
+        # Every tail leaves its cell before any head enters, as in engine.step
+        for snake, _ in moving:
+            if len(snake.body) >= snake.length:
+                self._pop_tail(snake)
+
+        heads = {}
+        dead = []
+
+        for snake, crashed in moving:
+            position = (snake.x, snake.y)
+            other = heads.get(position)
+
+            if other is not None:
+                # Heads meeting in one cell kill both snakes
+                dead.append(other)
+                crashed = True
+            else:
+                heads[position] = snake
+
+            if crashed or self.occupied(snake.x, snake.y):
+                dead.append(snake)
+
+        for snake in dead:
+            if snake.alive:
+                self._kill(snake)
+                events.append((snake, CRASH))
+
+        for snake, _ in moving:
+            if snake.alive:
+                self._push_head(snake, snake.x, snake.y)
+                self._collect(snake, events)
+
+        return events
+
+    def _collect(self, snake, events):
+        position = (snake.x, snake.y)
+
+        if position in self.foods:
+            self._take(FOOD, position)
+            self._place(FOOD)
+            snake.length += snake.growth_step
+            snake.score += snake.growth_step
+            events.append((snake, EAT))
+
+            if self.mode == MODERN:
+                snake.growth_step += engine.GROWTH_INCREMENT_MH
+
+            if len(self.bonuses) < self.max_bonuses and self.rng.random() < 1 / engine.BONUS_THRESHOLD:
+                self._place(BONUS_ITEM)
+
+        # Only the few cells a bonus can be hit from are looked up, not every bonus on the board
+        for dx, dy in engine.BONUS_HIT_OFFSETS:
+            bonus = (snake.x - dx, snake.y - dy)
+
+            if bonus in self.bonuses:
+                self._take(BONUS_ITEM, bonus)
+                events.append((snake, BONUS))
+
+                if self.mode == CLASSIC:
+                    reduction = engine.BONUS_REDUCTION_CE
+                    snake.length = max(1, snake.length - reduction)
+                else:
+                    new_length = max(1, snake.length // 2)
+                    reduction = snake.length - new_length
+                    snake.length = new_length
+
+                for _ in range(min(reduction, len(snake.body))):
+                    self._pop_tail(snake)
+
+                break
+
+    def total_length(self):
+        return sum(len(snake.body) for snake in self.snakes)
@@ -0,0 +1,150 @@
+import json
+import os
+from collections import OrderedDict
+
+import pygame
+
+# Target sizes for images: None keeps the native size, "screen" fits the logical screen size
+SCREEN_SIZE = "screen"
+
+FONT_CACHE = "saves/fonts.json"
+
+
+class AssetCache:
+    def __init__(self, specs, screen_size):
+        self.specs = specs
+        self.screen_size = screen_size
+        self.surfaces = {}
+        self.sources = {}
+        self.hits = 0
+        self.misses = 0
+        self.decodes = 0
+
+    def get(self, name):
+        surface = self.surfaces.get(name)
+
+        if surface is None:
+            self.misses += 1
+            surface = self._build(name)
+            self.surfaces[name] = surface
+        else:
+            self.hits += 1
+
+        return surface
+
+    def preload(self):
+        for name in self.specs:
+            self.get(name)
+
+    def rebuild(self, screen_size):
+        # Only images that were already loaded are built again, the rest stay deferred
+        loaded = list(self.surfaces)
+        self.screen_size = screen_size
+        self.surfaces.clear()
+
+        for name in loaded:
+            self.get(name)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "decodes": self.decodes, "cached": len(self.surfaces)}
+
+    def _decode(self, path, keep):
+        image = self.sources.get(path)
+
+        if image is None:
+            self.decodes += 1
+            image = pygame.image.load(path)
+
+            # Only sources that are re-cut on every resolution change stay in memory
+            if keep:
+                self.sources[path] = image
+
+        return image
+
+    def _build(self, name):
+        path, alpha, size = self.specs[name]
+        image = self._decode(path, size == SCREEN_SIZE)
+
+        if size == SCREEN_SIZE:
+            # Backgrounds were always blitted at the top-left corner, so cut the visible part
+            # instead of stretching the picture
+            width = min(self.screen_size[0], image.get_width())
+            height = min(self.screen_size[1], image.get_height())
+            image = image.subsurface((0, 0, width, height))
+        elif size is not None:
+            image = pygame.transform.scale(image, size)
+
+        return image.convert_alpha() if alpha else image.convert()
+
+
+class TextCache:
+    # Least recently used cache of rendered text surfaces shared by the HUD, menus and buttons
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, antialias, color):
+        key = (font, text, color, antialias)
+        surface = self.surfaces.get(key)
+
+        if surface is None:
+            self.misses += 1
+            surface = self._store(key)
+        else:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+
+        return surface
+
+    def prewarm(self, font, texts, antialias, color):
+        for text in texts:
+            key = (font, text, color, antialias)
+
+            if key not in self.surfaces:
+                self._store(key)
+
+    def clear(self):
+        self.surfaces.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": hit_rate, "cached": len(self.surfaces)}
+
+    def _store(self, key):
+        font, text, color, antialias = key
+        surface = font.render(text, antialias, color)
+        self.surfaces[key] = surface
+
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+
+        return surface
+
+
+def resolve_font(name, cache_path=FONT_CACHE):
+    # pygame.font.SysFont scans every installed font on each call. The path found for a name (or None
+    # when the font is missing and pygame's default font is used) is remembered on disk instead,
+    # delete the file to look again.
+    try:
+        with open(cache_path, encoding="utf-8") as file:
+            paths = json.load(file)
+    except (FileNotFoundError, ValueError):
+        paths = {}
+
+    if name in paths and (paths[name] is None or os.path.exists(paths[name])):
+        return paths[name]
+
+    paths[name] = pygame.font.match_font(name)
+
+    try:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+
+        with open(cache_path, "w", encoding="utf-8") as file:
+            json.dump(paths, file)
+    except OSError:
+        pass
+
+    return paths[name]
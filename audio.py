@@ -0,0 +1,134 @@
+import queue
+import threading
+import time
+
+import pygame
+
+# A small mixer buffer keeps the delay between an event and its sound short. 256 samples at
+# 44.1 kHz are under 6 ms, pygame's default of 512 is twice that.
+FREQUENCY = 44100
+BUFFER_SIZE = 256
+MUSIC_VOLUME = 0.5
+
+
+def pre_init_mixer():
+    # Has to run before pygame.init()
+    pygame.mixer.pre_init(FREQUENCY, -16, 2, BUFFER_SIZE)
+
+
+class AudioManager:
+    # Sound effects are decoded on a background thread, so no window waits for them, and a sound that
+    # is not decoded yet is silently skipped. Every group of effects plays on its own reserved
+    # channels: when they are all busy the oldest voice is cut off, instead of rapid-fire sounds
+    # taking channels from other effects. Music commands go through the same thread, in order,
+    # so loading a music stream never blocks the game loop.
+    #
+    # effects: name -> (path, group), voices: group -> number of channels
+    def __init__(self, effects, voices):
+        self.effects = effects
+        self.voices = voices
+        self.sounds = {}
+        self.pools = {}
+        self.commands = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        if not pygame.mixer.get_init():
+            return
+
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), sum(self.voices.values()) + 2))
+        pygame.mixer.set_reserved(sum(self.voices.values()))
+        first = 0
+
+        for group, count in self.voices.items():
+            self.pools[group] = [[pygame.mixer.Channel(first + index), 0.0] for index in range(count)]
+            first += count
+
+        self.thread = threading.Thread(target=self._run, name="audio", daemon=True)
+        self.thread.start()
+
+    def play(self, name):
+        sound = self.sounds.get(name)
+
+        if sound is None:
+            return
+
+        pool = self.pools[self.effects[name][1]]
+        voice = next((voice for voice in pool if not voice[0].get_busy()), None)
+
+        if voice is None:
+            voice = min(pool, key=lambda voice: voice[1])
+
+        voice[0].play(sound)
+        voice[1] = time.perf_counter()
+
+    def play_music(self, path, volume=MUSIC_VOLUME):
+        self._send(("play", path, volume))
+
+    def stop_music(self):
+        self._send(("stop",))
+
+    def pause_music(self):
+        self._send(("pause",))
+
+    def unpause_music(self):
+        self._send(("unpause",))
+
+    def close(self):
+        if self.thread is not None:
+            self.commands.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _send(self, command):
+        # Without a mixer, or once closed, there is no thread to run the command, so it is dropped
+        # rather than left to pile up in the queue
+        if self.thread is not None:
+            self.commands.put(command)
+
+    def _apply(self, command):
+        try:
+            if command[0] == "play":
+                pygame.mixer.music.load(command[1])
+                pygame.mixer.music.set_volume(command[2])
+                pygame.mixer.music.play(-1)
+            elif command[0] == "stop":
+                pygame.mixer.music.stop()
+            elif command[0] == "pause":
+                pygame.mixer.music.pause()
+            elif command[0] == "unpause":
+                pygame.mixer.music.unpause()
+        except pygame.error:
+            pass
+
+    def _drain(self):
+        # Runs the music commands that are already waiting, returns False once close() was called
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                return True
+
+            if command is None:
+                return False
+
+            self._apply(command)
+
+    def _run(self):
+        # Music commands are not held up behind the effects still being decoded
+        for name, (path, _) in self.effects.items():
+            if not self._drain():
+                return
+
+            try:
+                self.sounds[name] = pygame.mixer.Sound(path)
+            except (pygame.error, FileNotFoundError):
+                pass
+
+        while True:
+            command = self.commands.get()
+
+            if command is None:
+                return
+
+            self._apply(command)
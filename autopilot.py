@@ -0,0 +1,477 @@
+import heapq
+from array import array
+from collections import deque
+
+import engine
+
+DIRECTIONS = [engine.LEFT, engine.RIGHT, engine.UP, engine.DOWN]
+REVERSE = [1, 0, 3, 2]
+NO_MOVE = 255
+
+# From this share of the board on the snake only follows the Hamiltonian cycle
+CYCLE_FILL = 0.5
+# From this share of the board on the bonus, which shortens the snake, is chased before the food
+BONUS_FILL = 0.15
+# After this many board sizes of ticks without eating the snake follows the cycle
+HUNGRY_ROUNDS = 2
+# Ticks spent following the tail before searching again for a target that had no safe path
+RETRY_TICKS = 8
+# A decision may take this share of its tick. Its searches go through about SEARCH_RATE cells per
+# second (on the 1-core machine of benchmarks/autopilot.py) and are budgeted in cells rather than
+# time, so a game plays out the same on every machine. A search that runs out finds nothing.
+TICK_SHARE = 0.5
+SEARCH_RATE = 400000
+# Shares of that budget for the searches for the food, the checks that their paths are safe, the
+# search for the tail and the room counted for the moves without a plan. Counting room costs about
+# a third of a search per cell and is what keeps the snake out of dead ends, so it gets the most.
+PLAN_SHARE = 0.3
+CHECK_SHARE = 0.2
+TAIL_SHARE = 0.2
+ROOM_SHARE = 1.0
+
+BONUS_REACH = max(abs(dx) + abs(dy) for dx, dy in engine.BONUS_HIT_OFFSETS)
+
+
+def hamiltonian_cycle(cols, rows):
+    # Rows are swept left and right over columns 1..cols-1, column 0 leads back to the start.
+    # Needs an even number of rows (or columns, then the sweep is transposed).
+    if rows % 2:
+        if cols % 2:
+            return None
+
+        return [(x, y) for y, x in hamiltonian_cycle(rows, cols)]
+
+    cycle = []
+
+    for y in range(rows):
+        xs = range(1, cols) if y % 2 == 0 else range(cols - 1, 0, -1)
+        cycle.extend((x, y) for x in xs)
+
+    cycle.extend((0, y) for y in range(rows - 1, -1, -1))
+    return cycle
+
+
+class Autopilot:
+    # Chooses the direction for the next tick with the exact movement rules of engine.step: the head
+    # spends a tick outside the field before it wraps, which costs a heart in the classic mode and
+    # kills in the modern one, so paths only cross the border in the classic mode and only when
+    # there is no other way.
+    #
+    # Paths are found with A* on the padded body grid, timed against the body: a segment k cells from
+    # the tail is out of the way after k + 1 ticks (plus the growth still to come), so the snake can
+    # follow its own tail closely. A path is kept and followed tick by tick until the food or bonus
+    # changes, and the search arrays are allocated once and reused through a generation counter,
+    # so most ticks cost a couple of array lookups. The searches of a decision share a budget of
+    # cells that shrinks as the snake speeds up, so even at the 600 ticks per second of the modern
+    # mode a decision fits its tick; a target out of reach is searched for again after RETRY_TICKS.
+    def __init__(self, state):
+        body = state.body
+        self.cols = state.cols
+        self.rows = state.rows
+        self.grid_width = body.grid_width
+        self.board_cells = self.cols * self.rows
+
+        self.visited = array("q", [0]) * body.grid_size
+        self.cost = array("l", [0]) * body.grid_size
+        self.parent = array("l", [-1]) * body.grid_size
+        self.parent_move = bytearray(body.grid_size)
+        self.generation = 0
+
+        self.moves = self._build_moves(body)
+        self.cycle_move = self._build_cycle(body)
+
+        self.plan = deque()
+        self.plan_target = None
+        self.retry_tick = 0
+        self.budget = 0
+        self.check_budget = 0
+        self.tick_budget = 0
+        self.score = state.score
+        self.fed_tick = state.ticks
+        self.decisions = 0
+        self.searches = 0
+
+    def _build_moves(self, body):
+        # For every cell of the padded grid: (direction, next cell, crosses the border) per direction
+        moves = [()] * body.grid_size
+
+        for y in range(-1, self.rows + 1):
+            for x in range(-1, self.cols + 1):
+                wrapped_x = 0 if x >= self.cols else self.cols - 1 if x < 0 else x
+                wrapped_y = 0 if y >= self.rows else self.rows - 1 if y < 0 else y
+                cell_moves = []
+
+                for index, (dx, dy) in enumerate(DIRECTIONS):
+                    next_x = wrapped_x + dx
+                    next_y = wrapped_y + dy
+                    outside = next_x < 0 or next_x >= self.cols or next_y < 0 or next_y >= self.rows
+                    cell_moves.append((index, body.cell(next_x, next_y), outside))
+
+                moves[body.cell(x, y)] = tuple(cell_moves)
+
+        return moves
+
+    def _build_cycle(self, body):
+        cycle_move = bytearray([NO_MOVE]) * body.grid_size
+        cycle = hamiltonian_cycle(self.cols, self.rows)
+
+        if cycle is None:
+            return cycle_move
+
+        for (x, y), (next_x, next_y) in zip(cycle, cycle[1:] + cycle[:1]):
+            cycle_move[body.cell(x, y)] = DIRECTIONS.index((next_x - x, next_y - y))
+
+        return cycle_move
+
+    def _crossings_left(self, state):
+        if state.mode != engine.CLASSIC:
+            return 0
+
+        return max(0, min(state.hearts - 1, engine.MAX_BORDER_CROSSINGS - 1 - state.border_counter))
+
+    def decide(self, state):
+        self.decisions += 1
+
+        if not state.alive:
+            return None
+
+        body = state.body
+        target = (state.food, state.bonus)
+        self.tick_budget = int(SEARCH_RATE * TICK_SHARE / state.speed)
+
+        if state.score != self.score:
+            self.score = state.score
+            self.fed_tick = state.ticks
+
+        if self.plan and self.plan_target == target:
+            index, cell = self.plan.popleft()
+            head = body.cell(state.x, state.y)
+
+            if self.moves[head][index][1] == cell and self._free_at(state, cell, 1):
+                return DIRECTIONS[index]
+
+        self.plan.clear()
+
+        if not self._long(state) and (target != self.plan_target or state.ticks >= self.retry_tick):
+            self.plan_target = target
+            self.budget = int(self.tick_budget * PLAN_SHARE)
+            self.check_budget = int(self.tick_budget * CHECK_SHARE)
+            path = self._plan(state)
+
+            if path:
+                self.plan.extend(path[1:])
+                return DIRECTIONS[path[0][0]]
+
+            self.retry_tick = state.ticks + RETRY_TICKS
+
+        return self._survive(state)
+
+    def _long(self, state):
+        # The length counts the growth still to come and the next food, which in the modern mode
+        # soon outgrows the rest of the board. A snake that has chased its tail around the board
+        # without finding a safe way to the food takes the cycle as well, so its body stops
+        # repeating the same shape.
+        if state.ticks - self.fed_tick > self.board_cells * HUNGRY_ROUNDS:
+            return True
+
+        return max(state.length, len(state.body)) + state.growth_step >= self.board_cells * CYCLE_FILL
+
+    def _free_at(self, state, cell, ticks):
+        # Whether the body is out of cell after the given number of ticks
+        body = state.body
+        stamp = body.stamps[cell]
+
+        if stamp < body.tail_seq:
+            return True
+
+        growth = max(0, state.length - len(body))
+        return stamp - body.tail_seq + 1 + growth <= ticks
+
+    def _plan(self, state):
+        body = state.body
+        fill = len(body) / self.board_cells
+        targets = []
+
+        if state.bonus is not None and fill >= BONUS_FILL:
+            targets.append(self._bonus_goals(state) + (0,))
+
+        targets.append(({body.cell(*state.food)}, state.food, 0, state.growth_step))
+        crossings = self._crossings_left(state)
+
+        for goals, centre, reach, growth in targets:
+            for allow_crossing in ([False, True] if crossings else [False]):
+                path = self._search(state, goals, centre, reach, allow_crossing)
+
+                if path is None:
+                    continue
+
+                if sum(1 for _, cell in path if self._outside(cell)) > crossings:
+                    continue
+
+                if self._safe_after(state, path, growth, allow_crossing):
+                    return path
+
+        return None
+
+    def _bonus_goals(self, state):
+        body = state.body
+        bonus_x, bonus_y = state.bonus
+        goals = set()
+
+        for dx, dy in engine.BONUS_HIT_OFFSETS:
+            x = bonus_x + dx
+            y = bonus_y + dy
+
+            if 0 <= x < self.cols and 0 <= y < self.rows:
+                goals.add(body.cell(x, y))
+
+        return goals, state.bonus, BONUS_REACH
+
+    def _outside(self, cell):
+        y, x = divmod(cell, self.grid_width)
+        return x == 0 or y == 0 or x > self.cols or y > self.rows
+
+    def _search(self, state, goals, centre, reach, allow_crossing):
+        # A* from the head to the nearest goal cell. The distance to the centre of the goals minus
+        # their reach never overestimates, measured around the board when the path may cross the
+        # border, where a cell outside stands for the cell it wraps to. Ties go to the cell furthest
+        # from the head, so on an open board only the cells along the path are taken from the heap.
+        self.searches += 1
+        self.generation += 1
+        generation = self.generation
+        body = state.body
+        stamps = body.stamps
+        tail_seq = body.tail_seq
+        growth = max(0, state.length - len(body))
+        visited = self.visited
+        cost = self.cost
+        parent = self.parent
+        parent_move = self.parent_move
+        moves = self.moves
+        grid_width = self.grid_width
+        cols = self.cols
+        rows = self.rows
+        centre_x = centre[0] + 1
+        centre_y = centre[1] + 1
+
+        budget = self.budget
+
+        start = body.cell(state.x, state.y)
+        blocked_move = DIRECTIONS.index((state.dx, state.dy)) if (state.dx or state.dy) else NO_MOVE
+        blocked_move = REVERSE[blocked_move] if blocked_move != NO_MOVE else NO_MOVE
+
+        visited[start] = generation
+        cost[start] = 0
+        heap = [(0, 0, start)]
+
+        while heap and budget > 0:
+            _, ticks, cell = heapq.heappop(heap)
+            ticks = -ticks
+
+            if ticks > cost[cell]:
+                continue
+
+            budget -= 1
+
+            if cell in goals and cell != start:
+                self.budget = budget
+                return self._path(start, cell)
+
+            ticks += 1
+
+            for index, next_cell, outside in moves[cell]:
+                if outside and not allow_crossing:
+                    continue
+
+                if cell == start and index == blocked_move:
+                    continue
+
+                stamp = stamps[next_cell]
+
+                if stamp >= tail_seq and stamp - tail_seq + 1 + growth > ticks:
+                    continue
+
+                if visited[next_cell] == generation and cost[next_cell] <= ticks:
+                    continue
+
+                visited[next_cell] = generation
+                cost[next_cell] = ticks
+                parent[next_cell] = cell
+                parent_move[next_cell] = index
+
+                y, x = divmod(next_cell, grid_width)
+                dx = abs(x - centre_x)
+                dy = abs(y - centre_y)
+
+                if allow_crossing:
+                    dx = min(dx % cols, cols - dx % cols)
+                    dy = min(dy % rows, rows - dy % rows)
+
+                heapq.heappush(heap, (ticks + max(0, dx + dy - reach), -ticks, next_cell))
+
+        self.budget = budget
+        return None
+
+    def _path(self, start, goal):
+        path = []
+        cell = goal
+
+        while cell != start:
+            path.append((self.parent_move[cell], cell))
+            cell = self.parent[cell]
+
+        path.reverse()
+        return path
+
+    def _safe_after(self, state, path, growth, allow_crossing):
+        # After the path the tail has to stay reachable from the head, or the snake could wall itself
+        # in, and while the snake grows (its tail standing still) the head needs room to move. The
+        # segments still on the board after the path are those from cut_seq on, plus the path itself.
+        body = state.body
+        path_cells = [cell for _, cell in path][-state.length:]
+        kept = max(0, min(len(body), state.length - len(path_cells)))
+        cut_seq = body.head_seq - kept
+        length = kept + len(path_cells)
+        growth += state.length - length
+
+        if length < 2 and not growth:
+            return True
+
+        self.generation += 1
+        generation = self.generation
+        visited = self.visited
+        stamps = body.stamps
+        moves = self.moves
+        grid_width = self.grid_width
+        cols = self.cols
+        rows = self.rows
+        tail = body.ring[cut_seq % body.capacity] if kept else path_cells[0]
+        head = path_cells[-1]
+        tail_y, tail_x = divmod(tail, grid_width)
+        tail_found = length < 2
+        room = 0
+        budget = self.check_budget
+
+        for cell in path_cells:
+            visited[cell] = generation
+
+        # Best first towards the tail, which is found after a few cells even when the way round the
+        # body is long
+        heap = [(0, head)]
+
+        while heap and budget > 0:
+            _, cell = heapq.heappop(heap)
+            budget -= 1
+
+            for _, next_cell, outside in moves[cell]:
+                if next_cell == tail and cell != head:
+                    tail_found = True
+
+                if (outside and not allow_crossing) or visited[next_cell] == generation:
+                    continue
+
+                if stamps[next_cell] >= cut_seq:
+                    continue
+
+                visited[next_cell] = generation
+                y, x = divmod(next_cell, grid_width)
+                dx = abs(x - tail_x)
+                dy = abs(y - tail_y)
+
+                if allow_crossing:
+                    dx = min(dx % cols, cols - dx % cols)
+                    dy = min(dy % rows, rows - dy % rows)
+
+                heapq.heappush(heap, (dx + dy, next_cell))
+                room += 1
+
+            if tail_found and room >= growth:
+                self.check_budget = budget
+                return True
+
+        self.check_budget = budget
+        return False
+
+    def _survive(self, state):
+        # No safe path to the food: a long snake follows the Hamiltonian cycle while it is free, a shorter
+        # one steps towards its own tail, where it is now. Without either the move with the most room
+        # is taken.
+        body = state.body
+        head = body.cell(state.x, state.y)
+        crossing = self._crossings_left(state) > 0
+        reverse = REVERSE[DIRECTIONS.index((state.dx, state.dy))] if (state.dx or state.dy) else NO_MOVE
+        candidates = [(index, next_cell) for index, next_cell, outside in self.moves[head]
+                      if index != reverse and (crossing or not outside) and self._free_at(state, next_cell, 1)]
+
+        if not candidates:
+            return None
+
+        if len(candidates) == 1:
+            return DIRECTIONS[candidates[0][0]]
+
+        if self._long(state):
+            cycle_move = self.cycle_move[head]
+
+            for index, next_cell in candidates:
+                if index == cycle_move:
+                    return DIRECTIONS[index]
+
+        self.budget = int(self.tick_budget * TAIL_SHARE)
+
+        if len(body) > 1:
+            tail_x, tail_y = body.tail()
+
+            for allow_crossing in ([False, True] if crossing else [False]):
+                path = self._search(state, {body.cell(tail_x, tail_y)}, (tail_x, tail_y), 0, allow_crossing)
+
+                if path:
+                    return DIRECTIONS[path[0][0]]
+
+        # Ties go to the move along a wall or the body, which leaves the free space in one piece. The
+        # candidates share the room budget, more room than that counts the same.
+        room_budget = int(self.tick_budget * ROOM_SHARE) // len(candidates)
+        limit = min(max(state.length, len(body)) + state.growth_step, room_budget)
+        best = max(candidates, key=lambda candidate: (self._room(state, candidate[1], limit, crossing),
+                                                      -self._open_sides(state, candidate[1])))
+        return DIRECTIONS[best[0]]
+
+    def _open_sides(self, state, cell):
+        return sum(1 for _, next_cell, outside in self.moves[cell]
+                   if not outside and self._free_at(state, next_cell, 2))
+
+    def _room(self, state, start, limit, allow_crossing):
+        # Cells reachable from start in time, counting stops at limit
+        self.generation += 1
+        generation = self.generation
+        visited = self.visited
+        cost = self.cost
+        moves = self.moves
+        body = state.body
+        stamps = body.stamps
+        tail_seq = body.tail_seq
+        growth = max(0, state.length - len(body))
+        visited[start] = generation
+        cost[start] = 1
+        queue = deque([start])
+        count = 1
+
+        while queue and count < limit:
+            cell = queue.popleft()
+            ticks = cost[cell] + 1
+
+            for _, next_cell, outside in moves[cell]:
+                if (outside and not allow_crossing) or visited[next_cell] == generation:
+                    continue
+
+                # _free_at, inlined
+                stamp = stamps[next_cell]
+
+                if stamp >= tail_seq and stamp - tail_seq + 1 + growth > ticks:
+                    continue
+
+                visited[next_cell] = generation
+                cost[next_cell] = ticks
+                queue.append(next_cell)
+                count += 1
+
+        return count
@@ -0,0 +1,234 @@
+import numpy as np
+
+import engine
+from engine import CLASSIC, MODERN, SNAKE_BLOCK
+
+# --- Actions ---
+NOOP = 0
+LEFT = 1
+RIGHT = 2
+UP = 3
+DOWN = 4
+
+ACTION_DX = np.array([0, -1, 1, 0, 0], dtype=np.int32)
+ACTION_DY = np.array([0, 0, 0, -1, 1], dtype=np.int32)
+
+# Rounds of resampling food and bonus positions that landed on a snake or on each other
+SPAWN_ATTEMPTS = 8
+
+
+def _bonus_hit_table():
+    reach = max(max(abs(dx), abs(dy)) for dx, dy in engine.BONUS_HIT_OFFSETS)
+    table = np.zeros((2 * reach + 1, 2 * reach + 1), dtype=bool)
+
+    for dx, dy in engine.BONUS_HIT_OFFSETS:
+        table[dy + reach, dx + reach] = True
+
+    return reach, table
+
+
+BONUS_REACH, BONUS_HIT_TABLE = _bonus_hit_table()
+
+
+class BatchEnv:
+    # Runs num_games independent games with the rules of engine.step, one array element per game.
+    # Bodies live in per-game ring buffers of cells on a grid padded by one cell on every side,
+    # because in the classic mode the head spends one tick outside the field before wrapping.
+    def __init__(self, num_games, mode, width, height, seed=None):
+        self.num_games = num_games
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.cols = width // SNAKE_BLOCK
+        self.rows = height // SNAKE_BLOCK
+        self.grid_width = self.cols + 2
+        self.capacity = self.grid_width * (self.rows + 2) + 2
+        self.rng = np.random.default_rng(seed)
+
+        cell_type = np.int16 if self.capacity <= np.iinfo(np.int16).max else np.int32
+        self.ring = np.zeros((num_games, self.capacity), dtype=cell_type)
+        self.grid = np.zeros((num_games, self.grid_width * (self.rows + 2)), dtype=np.uint8)
+        self.head_seq = np.zeros(num_games, dtype=np.int64)
+        self.tail_seq = np.zeros(num_games, dtype=np.int64)
+
+        self.x = np.zeros(num_games, dtype=np.int32)
+        self.y = np.zeros(num_games, dtype=np.int32)
+        self.dx = np.zeros(num_games, dtype=np.int32)
+        self.dy = np.zeros(num_games, dtype=np.int32)
+        self.length = np.zeros(num_games, dtype=np.int64)
+        self.growth_step = np.zeros(num_games, dtype=np.int64)
+        self.food_x = np.zeros(num_games, dtype=np.int32)
+        self.food_y = np.zeros(num_games, dtype=np.int32)
+        self.bonus_x = np.zeros(num_games, dtype=np.int32)
+        self.bonus_y = np.zeros(num_games, dtype=np.int32)
+        self.bonus_active = np.zeros(num_games, dtype=bool)
+        self.bonus_counter = np.zeros(num_games, dtype=np.int32)
+        self.score = np.zeros(num_games, dtype=np.int64)
+        self.speed = np.zeros(num_games, dtype=np.float64)
+        self.hearts = np.zeros(num_games, dtype=np.int32)
+        self.border_counter = np.zeros(num_games, dtype=np.int32)
+        self.ticks = np.zeros(num_games, dtype=np.int64)
+
+        # Results of the games that finished on the last step (valid where dones is True)
+        self.final_score = np.zeros(num_games, dtype=np.int64)
+        self.final_length = np.zeros(num_games, dtype=np.int64)
+        self.final_ticks = np.zeros(num_games, dtype=np.int64)
+        self.games_finished = 0
+
+        self.reset(np.arange(num_games))
+
+    def _spawn(self, count, margin):
+        x = np.round(self.rng.integers(margin, self.width - margin, count) / SNAKE_BLOCK)
+        y = np.round(self.rng.integers(margin, self.height - margin, count) / SNAKE_BLOCK)
+        return x.astype(np.int32), y.astype(np.int32)
+
+    def _spawn_free(self, games, margin, other_x, other_y):
+        x, y = self._spawn(len(games), margin)
+
+        for _ in range(SPAWN_ATTEMPTS):
+            blocked = (self.grid[games, (y + 1) * self.grid_width + x + 1] > 0) | ((x == other_x) & (y == other_y))
+            retry = np.flatnonzero(blocked)
+
+            if not len(retry):
+                break
+
+            x[retry], y[retry] = self._spawn(len(retry), margin)
+
+        return x, y
+
+    def reset(self, games):
+        count = len(games)
+
+        if not count:
+            return
+
+        self.grid[games] = 0
+        self.head_seq[games] = 0
+        self.tail_seq[games] = 0
+        self.x[games] = self.width // 2 // SNAKE_BLOCK
+        self.y[games] = self.height // 2 // SNAKE_BLOCK
+        self.dx[games] = 0
+        self.dy[games] = 0
+        self.length[games] = 1
+        self.growth_step[games] = 1
+        self.food_x[games], self.food_y[games] = self._spawn_free(games, engine.FIRST_FOOD_MARGIN,
+                                                                  self.x[games], self.y[games])
+        self.bonus_active[games] = False
+        self.bonus_counter[games] = 0
+        self.score[games] = 0
+        self.speed[games] = engine.INITIAL_SPEED
+        self.hearts[games] = engine.MAX_HEARTS
+        self.border_counter[games] = 0
+        self.ticks[games] = 0
+
+    def _pop_tails(self, games, counts):
+        # Removes counts[i] tail segments of games[i], counts may differ between games
+        total = int(counts.sum())
+
+        if not total:
+            return
+
+        owners = np.repeat(games, counts)
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        seqs = self.tail_seq[owners] + (np.arange(total) - starts)
+        cells = self.ring[owners, seqs % self.capacity]
+
+        np.subtract.at(self.grid, (owners, cells), 1)
+        self.tail_seq[games] += counts
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        all_games = np.arange(self.num_games)
+
+        # A snake cannot reverse into itself, any other turn replaces the current direction
+        turn_dx = ACTION_DX[actions]
+        turn_dy = ACTION_DY[actions]
+        turns = (actions != NOOP) & ~((turn_dx == -self.dx) & (turn_dy == -self.dy))
+        self.dx = np.where(turns, turn_dx, self.dx)
+        self.dy = np.where(turns, turn_dy, self.dy)
+
+        # The head wraps around only after it has been outside the field for one tick
+        x = np.where(self.x >= self.cols, 0, np.where(self.x < 0, self.cols - 1, self.x)) + self.dx
+        y = np.where(self.y >= self.rows, 0, np.where(self.y < 0, self.rows - 1, self.y)) + self.dy
+        self.x = x
+        self.y = y
+        self.ticks += 1
+
+        outside = (x >= self.cols) | (x < 0) | (y >= self.rows) | (y < 0)
+
+        if self.mode == CLASSIC:
+            self.border_counter += outside
+            self.hearts -= outside
+            crashed = outside & ((self.hearts <= 0) | (self.border_counter >= engine.MAX_BORDER_CROSSINGS))
+        else:
+            crashed = outside.copy()
+
+        heads = (y + 1) * self.grid_width + (x + 1)
+        self.ring[all_games, self.head_seq % self.capacity] = heads
+        self.grid[all_games, heads] += 1
+        self.head_seq += 1
+
+        too_long = np.flatnonzero(self.head_seq - self.tail_seq > self.length)
+        self._pop_tails(too_long, np.ones(len(too_long), dtype=np.int64))
+
+        crashed |= self.grid[all_games, heads] > 1
+
+        previous_score = self.score.copy()
+        ate = np.flatnonzero((x == self.food_x) & (y == self.food_y))
+
+        if len(ate):
+            bonus_x = np.where(self.bonus_active[ate], self.bonus_x[ate], -1)
+            bonus_y = np.where(self.bonus_active[ate], self.bonus_y[ate], -1)
+            self.food_x[ate], self.food_y[ate] = self._spawn_free(ate, engine.FOOD_MARGIN, bonus_x, bonus_y)
+            self.length[ate] += self.growth_step[ate]
+            self.score[ate] += self.growth_step[ate]
+            self.bonus_counter[ate] += 1
+
+            spawn = ate[(self.bonus_counter[ate] >= engine.BONUS_THRESHOLD) & ~self.bonus_active[ate]]
+            self.bonus_x[spawn], self.bonus_y[spawn] = self._spawn_free(spawn, engine.FOOD_MARGIN,
+                                                                        self.food_x[spawn], self.food_y[spawn])
+            self.bonus_active[spawn] = True
+            self.bonus_counter[spawn] = 0
+
+            if self.mode == MODERN:
+                self.growth_step[ate] += engine.GROWTH_INCREMENT_MH
+                self.speed[ate] = np.where(self.speed[ate] < engine.MAX_SPEED_MH,
+                                           self.speed[ate] + engine.SPEED_STEP_MH, self.speed[ate])
+            else:
+                self.speed[ate] = np.where(self.speed[ate] < engine.MAX_SPEED_CE,
+                                           self.speed[ate] + engine.SPEED_STEP_CE, self.speed[ate])
+
+        rel_x = x - self.bonus_x + BONUS_REACH
+        rel_y = y - self.bonus_y + BONUS_REACH
+        size = 2 * BONUS_REACH + 1
+        near = self.bonus_active & (rel_x >= 0) & (rel_x < size) & (rel_y >= 0) & (rel_y < size)
+        hit = np.flatnonzero(near)
+        hit = hit[BONUS_HIT_TABLE[rel_y[hit], rel_x[hit]]]
+
+        if len(hit):
+            self.bonus_active[hit] = False
+            length = self.length[hit]
+
+            if self.mode == CLASSIC:
+                new_length = np.maximum(1, length - engine.BONUS_REDUCTION_CE)
+                reduction = np.full(len(hit), engine.BONUS_REDUCTION_CE, dtype=np.int64)
+            else:
+                new_length = np.maximum(1, length // 2)
+                reduction = length - new_length
+
+            self.length[hit] = new_length
+            self._pop_tails(hit, np.minimum(reduction, self.head_seq[hit] - self.tail_seq[hit]))
+
+        rewards = self.score - previous_score
+        dones = crashed
+
+        finished = np.flatnonzero(dones)
+
+        if len(finished):
+            self.final_score[finished] = self.score[finished]
+            self.final_length[finished] = self.length[finished]
+            self.final_ticks[finished] = self.ticks[finished]
+            self.games_finished += len(finished)
+            self.reset(finished)
+
+        return rewards, dones
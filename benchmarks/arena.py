@@ -0,0 +1,78 @@
+import argparse
+import time
+
+from arena import Arena
+
+# Usage: python -m benchmarks.arena [--quick]
+# Arena ticks on a 400x400 board with computer snakes only, by the number of snakes and by the length
+# they are held at, next to the time the collision checks alone would take as scans of every body
+
+SNAKE_COUNTS = [10, 50, 200, 400]
+LENGTHS = [1, 100, 500]
+WIDTH = HEIGHT = 4000
+TICKS = 2000
+
+
+def pairwise_scan(arena):
+    # The one-snake game's way of finding a collision: every head against the segment list of every snake
+    crashed = 0
+
+    for snake in arena.snakes:
+        head = (snake.y + 1) * arena.grid_width + snake.x + 1
+
+        for other in arena.snakes:
+            body = other.body
+
+            if other is snake:
+                crashed += head in list(body)[:-1]
+            else:
+                crashed += head in body
+
+    return crashed
+
+
+def bench(snakes, length, ticks):
+    # length 1 lets the snakes grow by eating, longer ones are held at least at that length
+    arena = Arena("C", WIDTH, HEIGHT, snakes, seed=1, record_changes=False)
+    segments = 0
+    elapsed = 0.0
+
+    for tick in range(ticks):
+        if length > 1:
+            for snake in arena.snakes:
+                snake.length = max(snake.length, length)
+
+        start = time.perf_counter()
+        arena.step()
+        elapsed += time.perf_counter() - start
+        segments += arena.total_length()
+
+    start = time.perf_counter()
+    pairwise_scan(arena)
+    scan = time.perf_counter() - start
+
+    return {
+        "ticks_per_sec": ticks / elapsed,
+        "us_per_snake_tick": elapsed / ticks / snakes * 1e6,
+        "mean_segments": segments / ticks,
+        "deaths": arena.deaths,
+        "pairwise_scan_ms": scan * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arena tick cost against the number and length of snakes")
+    parser.add_argument("--quick", action="store_true", help="run a tenth of the ticks")
+    args = parser.parse_args()
+    ticks = TICKS // 10 if args.quick else TICKS
+
+    for snakes in SNAKE_COUNTS:
+        for length in LENGTHS:
+            result = bench(snakes, length, ticks)
+            values = ", ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                               for key, value in result.items())
+            print(f"arena/{snakes}/len{length}: {values}")
+
+
+if __name__ == "__main__":
+    main()
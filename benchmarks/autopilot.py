@@ -0,0 +1,81 @@
+import argparse
+import statistics
+import time
+
+import engine
+from autopilot import Autopilot, hamiltonian_cycle
+from benchmarks.game import lay_along
+
+# Usage: python -m benchmarks.autopilot [--quick]
+# Autopilot games from bodies laid along the cycle at several lengths, every decision timed and
+# counted in the bucket of the board share the snake covered when it was made. The games run at the
+# top speed of their mode, whose ticks are the shortest a decision has to fit in: 16.7 ms in the
+# classic mode, 1.67 ms in the modern one.
+
+MODES = ["C", "M"]
+TOP_SPEEDS = {"C": engine.MAX_SPEED_CE, "M": engine.MAX_SPEED_MH}
+# The board of the game first
+RESOLUTIONS = [(800, 600), (640, 480)]
+START_FILLS = [0.0, 0.1, 0.25, 0.5, 0.75]
+DECISIONS = 5000
+BUCKET = 0.1
+
+
+def play(mode, width, height, fill, decisions, times):
+    seed = 0
+
+    while decisions > 0:
+        state = engine.GameState(mode, width, height, seed=seed, speed=TOP_SPEEDS[mode])
+        length = int(state.cols * state.rows * fill)
+
+        if length > 1:
+            lay_along(state, hamiltonian_cycle(state.cols, state.rows), length)
+
+        autopilot = Autopilot(state)
+        cells = state.cols * state.rows
+
+        while state.alive and decisions > 0:
+            share = len(state.body) / cells
+            started = time.perf_counter()
+            direction = autopilot.decide(state)
+            times.setdefault(min(int(share / BUCKET), int(1 / BUCKET) - 1), []).append(time.perf_counter() - started)
+
+            if direction is not None:
+                engine.turn(state, direction)
+
+            engine.step(state)
+            decisions -= 1
+
+        seed += 1
+
+
+def report(mode, width, height, times):
+    tick = 1 / TOP_SPEEDS[mode]
+
+    for bucket in sorted(times):
+        values = times[bucket]
+        mean = statistics.fmean(values)
+        over = sum(1 for value in values if value > tick)
+        print(f"{mode} {width}x{height} fill {bucket * BUCKET:.0%}-{(bucket + 1) * BUCKET:.0%}: "
+              f"{len(values)} decisions, {1 / mean:.0f} decisions/s, mean {mean * 1000:.3f} ms, "
+              f"max {max(values) * 1000:.2f} ms, over the {tick * 1000:.2f} ms tick {over / len(values):.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decision time of the autopilot against board fill")
+    parser.add_argument("--quick", action="store_true", help="make a tenth of the decisions")
+    args = parser.parse_args()
+    decisions = DECISIONS // 10 if args.quick else DECISIONS
+
+    for width, height in RESOLUTIONS:
+        for mode in MODES:
+            times = {}
+
+            for fill in START_FILLS:
+                play(mode, width, height, fill, decisions, times)
+
+            report(mode, width, height, times)
+
+
+if __name__ == "__main__":
+    main()
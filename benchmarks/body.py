@@ -0,0 +1,72 @@
+import time
+
+from body import SnakeBody
+
+# Usage: python -m benchmarks.body
+
+GRID = 400
+LENGTHS = [10, 100, 1000, 10000, 50000]
+TICKS = 20000
+LIST_TICKS = 1000
+
+
+def serpentine(cols, rows):
+    # Endless path that visits every cell of the field row by row
+    while True:
+        for y in range(rows):
+            xs = range(cols) if y % 2 == 0 else range(cols - 1, -1, -1)
+
+            for x in xs:
+                yield x, y
+
+
+def bench_ring_buffer(length):
+    body = SnakeBody(GRID, GRID)
+    path = serpentine(GRID, GRID)
+
+    for _ in range(length):
+        body.push_head(*next(path))
+
+    moves = [next(path) for _ in range(TICKS)]
+    start = time.perf_counter()
+
+    for x, y in moves:
+        body.pop_tail()
+
+        if body.occupied(x, y):
+            raise RuntimeError("The benchmark path must not cross itself")
+
+        body.push_head(x, y)
+
+    return (time.perf_counter() - start) / TICKS
+
+
+def bench_list(length):
+    # The previous representation: list of [x, y] lists, del [0] and a scan of snake_list[:-1]
+    path = serpentine(GRID, GRID)
+    snake_list = [list(next(path)) for _ in range(length)]
+    moves = [list(next(path)) for _ in range(LIST_TICKS)]
+    start = time.perf_counter()
+
+    for snake_head in moves:
+        snake_list.append(snake_head)
+        del snake_list[0]
+
+        for segment in snake_list[:-1]:
+            if segment == snake_head:
+                raise RuntimeError("The benchmark path must not cross itself")
+
+    return (time.perf_counter() - start) / LIST_TICKS
+
+
+def main():
+    print(f"{'length':>8} {'ring buffer':>14} {'list':>14}")
+
+    for length in LENGTHS:
+        ring = bench_ring_buffer(length)
+        listed = bench_list(length)
+        print(f"{length:>8} {ring * 1e6:>11.2f} us {listed * 1e6:>11.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import engine  # noqa: E402
+import main  # noqa: E402
+from autopilot import hamiltonian_cycle  # noqa: E402
+
+# Usage: python -m benchmarks.game [--quick] [--save-baseline] [--check]
+
+MODES = ["C", "M"]
+# Window sizes, the game is drawn at the logical size of main and scaled to them
+RESOLUTIONS = [(640, 480), (800, 600), (1280, 720)]
+LENGTHS = [1, 100, 1000]
+LOGIC_TICKS = 20000
+LOGIC_REPEATS = 3
+FRAMES = 300
+MENU_FRAMES = 100
+WORLD_SIZES = [500, engine.WORLD_CELLS]
+WORLD_LOOP = 40
+WORLD_LENGTH = 1000
+IDLE_SECONDS = 3.0
+# Motion events per second of the pointer moved over idle scenes, about what a mouse reports
+POINTER_RATE = 125
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+THRESHOLD = 0.2
+CHECKED = ["ticks_per_sec", "frame_ms_p50", "frame_ms_p95"]
+
+
+class CycleDriver:
+    # Scripted input: steers the snake along the cycle, so it never dies, and keeps it at the
+    # swept length although it eats food and bonuses on the way
+    def __init__(self, cycle, length):
+        self.cycle = cycle
+        self.order = {cell: index for index, cell in enumerate(cycle)}
+        self.length = length
+
+    def steer(self, state):
+        state.length = self.length
+        index = self.order.get((state.x, state.y))
+
+        if index is not None:
+            next_x, next_y = self.cycle[(index + 1) % len(self.cycle)]
+            engine.turn(state, (next_x - state.x, next_y - state.y))
+
+
+def prepare_state(mode, width, height, length):
+    state = engine.GameState(mode, width, height, seed=1)
+    cycle = hamiltonian_cycle(state.cols, state.rows)
+    length = min(length, len(cycle) // 2)
+    lay_along(state, cycle, length)
+    return state, CycleDriver(cycle, length)
+
+
+def lay_along(state, cycle, length):
+    # Replaces the body with the first length cells of the cycle, the head at the last of them
+    state.body, state.free = engine.new_board(state.width, state.height)
+
+    for x, y in cycle[:length]:
+        state.free.remove(state.body.push_head(x, y))
+
+    state.x, state.y = cycle[length - 1]
+    state.length = length
+
+    if state.body.occupied(*state.food):
+        state.food = engine.spawn_cell(state)
+
+    state.free.remove(state.body.cell(*state.food))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def bench_logic(mode, width, height, length, ticks):
+    # The best of a few runs, the slower ones measure other processes rather than the engine
+    elapsed = float("inf")
+
+    for _ in range(LOGIC_REPEATS):
+        state, driver = prepare_state(mode, width, height, length)
+        start = time.perf_counter()
+
+        for _ in range(ticks):
+            driver.steer(state)
+            engine.step(state)
+
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    # Memory over a tenth of the ticks. Retained are the blocks still allocated after them, per tick:
+    # garbage kept alive by the hot path shows up here. The peak is the most a single tick allocated on
+    # top of what was live before it, which also catches the garbage that a tick frees again.
+    state, driver = prepare_state(mode, width, height, length)
+    alloc_ticks = max(1, ticks // 10)
+    peak = 0
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    for _ in range(alloc_ticks):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        driver.steer(state)
+        engine.step(state)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    # The before snapshot itself was allocated while tracing
+    ignored = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(ignored).compare_to(before.filter_traces(ignored), "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+
+    return {"ticks_per_sec": ticks / elapsed, "retained_blocks_per_tick": blocks / alloc_ticks,
+            "peak_tick_alloc_bytes": peak, "alive": state.alive}
+
+
+def bench_render(mode, width, height, length, frames):
+    # The board has the logical size in any window, other window sizes add the scaling pass
+    main.set_window_size(width, height)
+    state, driver = prepare_state(mode, main.SCREEN_WIDTH, main.SCREEN_HEIGHT, length)
+    scene = main.GameScene(mode, "en", state, seed=1)
+    pushed = main.display.stats()
+    text = main.text_cache.stats()
+    images = main.assets.stats()
+    result = frame_stats(time_frames(scene, state, driver, frames))
+    result.update(pushed_pixels(pushed))
+    result.update(text_lookups(text))
+    result.update(image_loads(images))
+    return result
+
+
+def bench_world(mode, cells, length, frames):
+    # The snake circles a small loop in the middle of the world, the camera scrolls on every frame
+    main.set_window_size(main.SCREEN_WIDTH, main.SCREEN_HEIGHT)
+    state = engine.GameState(mode, cells * engine.SNAKE_BLOCK, cells * engine.SNAKE_BLOCK, seed=1)
+    origin = (cells - WORLD_LOOP) // 2
+    cycle = [(x + origin, y + origin) for x, y in hamiltonian_cycle(WORLD_LOOP, WORLD_LOOP)]
+    length = min(length, len(cycle) - 1)
+    lay_along(state, cycle, length)
+    scene = main.GameScene(mode, "en", state, seed=1)
+    pushed = main.display.stats()
+    text = main.text_cache.stats()
+    images = main.assets.stats()
+    result = frame_stats(time_frames(scene, state, CycleDriver(cycle, length), frames))
+    result.update(pushed_pixels(pushed))
+    result.update(text_lookups(text))
+    result.update(image_loads(images))
+    result["built_chunks"] = scene.world_layer.builds
+    result["body_chunks"] = len(state.body.stamps.chunks)
+    return result
+
+
+def time_frames(scene, state, driver, frames):
+    scene.finish = lambda: None
+    times = []
+
+    for _ in range(frames):
+        driver.steer(state)
+
+        # Exactly one logic tick per frame
+        scene.accumulator = 1 / state.speed
+        scene.previous_time = time.perf_counter()
+
+        start = time.perf_counter()
+        scene.update()
+        scene.draw()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def pushed_pixels(before):
+    # Window pixels the display pushed per frame since the before stats, against the whole window
+    after = main.display.stats()
+    frames = after["frames"] - before["frames"]
+    pixels = (after["total_pixels"] - before["total_pixels"]) / frames
+    return {"pushed_px_per_frame": pixels, "pushed_share": pixels / after["window_pixels"]}
+
+
+def text_lookups(before):
+    # Hit rate of the text cache since the before stats. A game misses once for every new score.
+    after = main.text_cache.stats()
+    hits = after["hits"] - before["hits"]
+    misses = after["misses"] - before["misses"]
+    return {"text_hit_rate": hits / (hits + misses) if hits + misses else 1.0, "text_misses": misses}
+
+
+def image_loads(before):
+    # Images built and files decoded since the before stats. The images are loaded before the games
+    # start, so anything here was loaded on the hot path.
+    after = main.assets.stats()
+    return {"image_misses": after["misses"] - before["misses"], "image_decodes": after["decodes"] - before["decodes"]}
+
+
+def bench_menu(width, height, frames):
+    main.set_window_size(width, height)
+    scene = main.main_menu("en")
+    text = main.text_cache.stats()
+    times = []
+
+    for _ in range(frames):
+        start = time.perf_counter()
+        scene.draw()
+        times.append(time.perf_counter() - start)
+
+    result = frame_stats(times)
+    result.update(text_lookups(text))
+    return result
+
+
+def move_pointer(stop, rate):
+    # Sweeps a pointer back and forth across the first menu button. The dummy driver has no mouse,
+    # so the motion events are posted, and like real ones they are dropped while motion is blocked.
+    y = 200 + main.BUTTON_HEIGHT // 2
+    x = 0
+    step = 8
+
+    while not stop.wait(1 / rate):
+        if not 0 <= x + step < main.SCREEN_WIDTH:
+            step = -step
+
+        x += step
+        main.pygame.event.post(main.pygame.event.Event(main.pygame.MOUSEMOTION, pos=(x, y), rel=(step, 0),
+                                                       buttons=(0, 0, 0), touch=False))
+
+
+def bench_idle(scenes, seconds, polled=False, pointer=False):
+    # The scene manager left alone on the last of scenes for a while: the CPU time the process used
+    # against the time that passed, how often the scene was drawn and how often an event woke it up.
+    # polled draws it every frame, as every scene was drawn before idle scenes waited for events.
+    # pointer keeps the mouse moving over it the whole time.
+    manager = main.scene_manager
+    manager.reset(*scenes)
+    manager.wakeups = 0
+    scene = manager.top
+    draw = scene.draw
+    draws = 0
+
+    def counted_draw():
+        nonlocal draws
+        draws += 1
+        draw()
+
+    scene.draw = counted_draw
+
+    if polled:
+        scene.idle = False
+
+    stop = threading.Event()
+    mover = threading.Thread(target=move_pointer, args=(stop, POINTER_RATE))
+    timer = threading.Timer(seconds, manager.quit)
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    timer.start()
+
+    if pointer:
+        mover.start()
+
+    manager.run()
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    stop.set()
+
+    if pointer:
+        mover.join()
+
+    manager.reset()
+
+    # Without a window system (the dummy and offscreen drivers) SDL waits for events by polling every
+    # millisecond, which shows up here as a percent or so of CPU. The wakeups are what a desktop
+    # driver, which blocks in the wait, would spend its CPU on.
+    return {"cpu_percent": cpu / elapsed * 100, "draws_per_sec": draws / elapsed,
+            "wakeups_per_sec": manager.wakeups / elapsed, "video_driver": main.pygame.display.get_driver()}
+
+
+def bench_resolution_click(width, height, seconds):
+    # Clicks the width x height button of the resolution menu, then leaves the menu alone. The new
+    # window starts out black, so the menu has to be drawn again at the new size by itself.
+    main.set_window_size(main.SCREEN_WIDTH, main.SCREEN_HEIGHT)
+    manager = main.scene_manager
+    manager.reset(main.resolution_menu("en"))
+    scene = manager.top
+    button = next(button for button in scene.buttons if button.text == f"{width}x{height}")
+    draw = scene.draw
+    sizes = []
+
+    def counted_draw():
+        sizes.append(main.pygame.display.get_surface().get_size())
+        draw()
+
+    scene.draw = counted_draw
+    # Clicked once the menu was drawn and went idle
+    click = main.pygame.event.Event(main.pygame.MOUSEBUTTONDOWN, pos=button.rect.center, button=1, touch=False)
+    clicker = threading.Timer(seconds / 4, main.pygame.event.post, (click,))
+    timer = threading.Timer(seconds, manager.quit)
+    clicker.start()
+    timer.start()
+    manager.run()
+    manager.reset()
+    main.set_window_size(main.SCREEN_WIDTH, main.SCREEN_HEIGHT)
+    return {"draws": len(sizes), "redrawn": (width, height) in sizes}
+
+
+def frame_stats(times):
+    return {
+        "frame_ms_p50": percentile(times, 0.50) * 1000,
+        "frame_ms_p95": percentile(times, 0.95) * 1000,
+        "frame_ms_p99": percentile(times, 0.99) * 1000,
+    }
+
+
+def run(quick=False):
+    logic_ticks = LOGIC_TICKS // 10 if quick else LOGIC_TICKS
+    frames = FRAMES // 10 if quick else FRAMES
+    menu_frames = MENU_FRAMES // 10 if quick else MENU_FRAMES
+    results = {}
+
+    logic = {(mode, length): bench_logic(mode, main.SCREEN_WIDTH, main.SCREEN_HEIGHT, length, logic_ticks)
+             for mode in MODES for length in LENGTHS}
+
+    # The warm-up the game gets from its first scene, from here on no image may be loaded
+    main.set_window_size(main.SCREEN_WIDTH, main.SCREEN_HEIGHT)
+    main.assets.preload()
+
+    for width, height in RESOLUTIONS:
+        resolution = f"{width}x{height}"
+
+        for mode in MODES:
+            for length in LENGTHS:
+                result = dict(logic[mode, length])
+                result.update(bench_render(mode, width, height, length, frames))
+                results[f"game/{mode}/{resolution}/len{length}"] = result
+
+        results[f"menu/{resolution}"] = bench_menu(width, height, menu_frames)
+
+    for cells in WORLD_SIZES:
+        results[f"world/C/{cells}x{cells}/len{WORLD_LENGTH}"] = bench_world("C", cells, WORLD_LENGTH, frames)
+
+    idle_seconds = IDLE_SECONDS / 3 if quick else IDLE_SECONDS
+    main.set_window_size(main.SCREEN_WIDTH, main.SCREEN_HEIGHT)
+
+    for polled in (False, True):
+        name = "polled" if polled else "idle"
+        results[f"{name}/menu"] = bench_idle([main.main_menu("en")], idle_seconds, polled)
+        results[f"{name}/pause"] = bench_idle([main.GameScene("C", "en", seed=1), main.PauseScene()], idle_seconds,
+                                              polled)
+
+    results["menu/resolution_click"] = bench_resolution_click(1280, 720, idle_seconds)
+
+    # The same with the mouse moving: a menu wakes up for every motion event, the pause never does
+    results["idle/menu/pointer"] = bench_idle([main.main_menu("en")], idle_seconds, pointer=True)
+    results["idle/pause/pointer"] = bench_idle([main.GameScene("C", "en", seed=1), main.PauseScene()],
+                                               idle_seconds, pointer=True)
+
+    return results
+
+
+def report(results):
+    for name, result in results.items():
+        values = ", ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                           for key, value in result.items())
+        print(f"{name}: {values}")
+
+
+def check(results, baseline, threshold):
+    # Fewer ticks per second or slower frames than the baseline by more than threshold is a regression
+    regressions = []
+
+    # A menu that stays black after switching the window is a failure whatever the baseline says
+    if not results.get("menu/resolution_click", {}).get("redrawn", True):
+        regressions.append("menu/resolution_click: the menu was not drawn in the new window")
+
+    # And so is an image loaded while a game runs
+    for name, result in results.items():
+        if result.get("image_misses") or result.get("image_decodes"):
+            regressions.append(f"{name}: {result['image_misses']} images built, {result['image_decodes']} decoded "
+                               "during the frames")
+
+    for name, expected in baseline.items():
+        actual = results.get(name)
+
+        if actual is None:
+            continue
+
+        for key in CHECKED:
+            if key not in expected:
+                continue
+
+            value = expected[key]
+
+            if key == "ticks_per_sec" and actual[key] < value * (1 - threshold):
+                regressions.append(f"{name} {key}: {actual[key]:.2f} < {value:.2f}")
+            elif key != "ticks_per_sec" and actual[key] > value * (1 + threshold):
+                regressions.append(f"{name} {key}: {actual[key]:.2f} > {value:.2f}")
+
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Headless benchmarks of the game and menu loops")
+    parser.add_argument("--quick", action="store_true", help="run a tenth of the ticks and frames")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="fail when results regress against the baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    return parser.parse_args()
+
+
+def main_benchmark():
+    args = parse_args()
+    results = run(args.quick)
+    report(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.check:
+        try:
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            print(f"No baseline at {args.baseline}, run with --save-baseline first")
+            sys.exit(2)
+
+        regressions = check(results, baseline, args.threshold)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main_benchmark()
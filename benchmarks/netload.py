@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import protocol
+import server
+
+# Usage: python -m benchmarks.netload [--clients 400] [--per-room 16] [--duration 10] [--host HOST --port PORT]
+# Simulated players against the multiplayer server: every bot joins a room, turns at random and
+# decodes every frame into its own copy of the room. Without --host a server is started for the run.
+# Reported are the ticks per second of all rooms against the tick rate, the bandwidth per client,
+# the size of the deltas next to full snapshots of the same rooms and the time from sending a turn
+# to the first frame that acknowledges it.
+
+CLIENTS = 400
+PER_ROOM = 16
+DURATION = 10.0
+WARMUP = 2.0
+TURNS_PER_SECOND = 2.0
+MODES = ["C", "M"]
+
+
+class Bot:
+    def __init__(self, room, mode, turns_per_second, rng):
+        self.room = room
+        self.mode = mode
+        self.turns_per_second = turns_per_second
+        self.rng = rng
+        self.mirror = protocol.Mirror()
+        self.welcomed = asyncio.Event()
+        self.sent = {}
+        self.seq = 0
+        self.reset()
+
+    def reset(self):
+        self.bytes = 0
+        self.deltas = 0
+        self.delta_bytes = 0
+        self.full_bytes = 0
+        self.keyframes = 0
+        self.first_tick = None
+        self.last_tick = None
+        self.latencies = []
+
+    async def run(self, host, port, stop):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(protocol.frame(protocol.JOIN, self.mode.encode() + self.room.encode()))
+        receiving = asyncio.ensure_future(self.receive(reader))
+
+        try:
+            await self.welcomed.wait()
+
+            while not stop.is_set():
+                await asyncio.sleep(self.rng.expovariate(self.turns_per_second))
+                self.seq += 1
+                self.sent[self.seq] = time.perf_counter()
+                writer.write(protocol.frame(protocol.TURN, protocol.TURN_BODY.pack(self.seq, self.rng.randrange(4))))
+        finally:
+            receiving.cancel()
+            writer.close()
+
+    async def receive(self, reader):
+        frames = protocol.FrameReader()
+
+        while True:
+            data = await reader.read(65536)
+
+            if not data:
+                return
+
+            self.bytes += len(data)
+
+            for kind, payload in frames.feed(data):
+                if kind == protocol.WELCOME:
+                    self.welcomed.set()
+                    continue
+
+                self.mirror.apply(kind, payload)
+                self.mirror.changes.clear()
+                self.mirror.item_changes.clear()
+                self.acknowledged(self.mirror.acked)
+
+                if self.first_tick is None:
+                    self.first_tick = self.mirror.tick
+
+                self.last_tick = self.mirror.tick
+
+                if kind == protocol.KEYFRAME:
+                    self.keyframes += 1
+                else:
+                    self.deltas += 1
+                    self.delta_bytes += protocol.HEADER.size + len(payload)
+                    self.full_bytes += self.mirror.full_size()
+
+    def acknowledged(self, acked):
+        now = time.perf_counter()
+
+        for seq in [seq for seq in self.sent if seq <= acked]:
+            self.latencies.append(now - self.sent.pop(seq))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def load(host, port, clients, per_room, duration, tick_rate, turns_per_second):
+    rng = random.Random(1)
+    rooms = -(-clients // per_room)
+    bots = [Bot(f"load{index // per_room}", MODES[index // per_room % len(MODES)], turns_per_second,
+                random.Random(rng.random())) for index in range(clients)]
+    stop = asyncio.Event()
+    tasks = [asyncio.ensure_future(bot.run(host, port, stop)) for bot in bots]
+
+    await asyncio.wait_for(asyncio.gather(*(bot.welcomed.wait() for bot in bots)), 30)
+    await asyncio.sleep(WARMUP)
+
+    for bot in bots:
+        bot.reset()
+
+    started = time.perf_counter()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - started
+    results = summarize(bots, rooms, per_room, elapsed, tick_rate)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return results
+
+
+def summarize(bots, rooms, per_room, elapsed, tick_rate):
+    # A room ticked as often as the fastest of its bots saw it tick
+    room_ticks = {}
+
+    for bot in bots:
+        if bot.first_tick is not None:
+            room_ticks[bot.room] = max(room_ticks.get(bot.room, 0), bot.last_tick - bot.first_tick)
+
+    latencies = [latency for bot in bots for latency in bot.latencies]
+    delta_bytes = sum(bot.delta_bytes for bot in bots)
+    full_bytes = sum(bot.full_bytes for bot in bots)
+    deltas = sum(bot.deltas for bot in bots)
+
+    return {
+        "clients": len(bots),
+        "rooms": rooms,
+        "server_ticks_per_sec": sum(room_ticks.values()) / elapsed,
+        "target_ticks_per_sec": rooms * tick_rate,
+        "kb_per_sec_per_client": statistics.mean(bot.bytes for bot in bots) / elapsed / 1024,
+        "delta_bytes_mean": delta_bytes / deltas if deltas else 0.0,
+        "full_snapshot_bytes_mean": full_bytes / deltas if deltas else 0.0,
+        "compression": full_bytes / delta_bytes if delta_bytes else 0.0,
+        "resyncs": sum(bot.keyframes for bot in bots),
+        "latency_ms_p50": percentile(latencies, 0.5) * 1000,
+        "latency_ms_p95": percentile(latencies, 0.95) * 1000,
+        "latency_ms_p99": percentile(latencies, 0.99) * 1000,
+        "latency_ms_max": max(latencies, default=0.0) * 1000,
+        "turns": len(latencies),
+    }
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind((server.HOST, 0))
+        return probe.getsockname()[1]
+
+
+def start_server(port, per_room, tick_rate):
+    process = subprocess.Popen([sys.executable, "server.py", "--port", str(port), "--slots", str(per_room),
+                                "--tick-rate", str(tick_rate)], stdout=subprocess.PIPE, text=True,
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # The server prints one line once it listens
+    process.stdout.readline()
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the multiplayer server")
+    parser.add_argument("--clients", type=int, default=CLIENTS)
+    parser.add_argument("--per-room", type=int, default=PER_ROOM)
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds measured after the warmup")
+    parser.add_argument("--tick-rate", type=int, default=server.TICK_RATE)
+    parser.add_argument("--turns", type=float, default=TURNS_PER_SECOND, help="turns per second of every bot")
+    parser.add_argument("--host", help="load a running server instead of starting one")
+    parser.add_argument("--port", type=int, default=server.PORT)
+    parser.add_argument("--quick", action="store_true", help="100 clients for 3 seconds")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.clients = min(args.clients, 100)
+        args.duration = 3.0
+
+    process = None
+    host = args.host
+    port = args.port
+
+    if host is None:
+        host = server.HOST
+        port = free_port()
+        process = start_server(port, args.per_room, args.tick_rate)
+
+    started = time.perf_counter()
+
+    try:
+        result = asyncio.run(load(host, port, args.clients, args.per_room, args.duration, args.tick_rate,
+                                  args.turns))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if process is not None:
+        # CPU time of the whole server run against its wall time, 100 is one core busy
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        result["server_cpu_percent"] = (usage.ru_utime + usage.ru_stime) / (time.perf_counter() - started) * 100
+
+    values = ", ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                       for key, value in result.items())
+    print(f"netload/{args.clients}x{args.per_room}: {values}")
+
+
+if __name__ == "__main__":
+    main()
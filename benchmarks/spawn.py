@@ -0,0 +1,60 @@
+import random
+import time
+
+from body import SnakeBody
+from spawn import FreeCells, spawn_region
+
+# Usage: python -m benchmarks.spawn
+
+WIDTH = 1280
+HEIGHT = 720
+MARGIN = 60
+FILLS = [0.5, 0.9, 0.99, 0.999, 0.9999]
+SAMPLES = 20000
+
+
+def bench(fill, rng):
+    body = SnakeBody(WIDTH // 10, HEIGHT // 10)
+    left, top, right, bottom = spawn_region(WIDTH, HEIGHT, 10, MARGIN)
+    free = FreeCells(body, left, top, right, bottom)
+    region = list(free.cells)
+    occupied = bytearray(body.grid_size)
+
+    for cell in rng.sample(region, int(len(region) * fill)):
+        free.remove(cell)
+        occupied[cell] = 1
+
+    start = time.perf_counter()
+
+    for _ in range(SAMPLES):
+        free.sample(rng)
+
+    indexed = (time.perf_counter() - start) / SAMPLES
+
+    # Rejection sampling with the old spawn formula
+    start = time.perf_counter()
+    rejection_samples = max(1, SAMPLES // 100)
+
+    for _ in range(rejection_samples):
+        while True:
+            x = round(rng.randrange(MARGIN, WIDTH - MARGIN) / 10)
+            y = round(rng.randrange(MARGIN, HEIGHT - MARGIN) / 10)
+
+            if not occupied[body.cell(x, y)]:
+                break
+
+    rejection = (time.perf_counter() - start) / rejection_samples
+    return len(free), indexed, rejection
+
+
+def main():
+    rng = random.Random(1)
+    print(f"{'fill':>8} {'free cells':>11} {'free-cell index':>16} {'rejection':>14}")
+
+    for fill in FILLS:
+        free, indexed, rejection = bench(fill, rng)
+        print(f"{fill:>8.2%} {free:>11} {indexed * 1e6:>13.2f} us {rejection * 1e6:>11.2f} us")
+
+
+if __name__ == "__main__":
+    main()
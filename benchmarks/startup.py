@@ -0,0 +1,60 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from profiler import STARTUP_BUDGET
+
+# Usage: python -m benchmarks.startup [--runs N] [--check]
+# Cold starts of the game in fresh processes, up to its first drawn menu frame
+
+RUNS = 10
+STARTUP_LINE = re.compile(r"Startup ([0-9.]+) ms")
+
+
+def cold_start():
+    environment = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy",
+                       PYGAME_HIDE_SUPPORT_PROMPT="1")
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "main.py", "--startup-report", "--startup-only"],
+                            env=environment, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    match = STARTUP_LINE.search(result.stdout)
+
+    if match is None:
+        raise RuntimeError(f"No startup report in the output of main.py:\n{result.stdout}{result.stderr}")
+
+    return float(match.group(1)) / 1000, wall, result.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold startup time of the game")
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET, help="seconds to the first menu frame")
+    parser.add_argument("--check", action="store_true", help="fail when the median is over the budget")
+    args = parser.parse_args()
+
+    in_game = []
+    wall = []
+    report = ""
+
+    for _ in range(args.runs):
+        seconds, process_seconds, report = cold_start()
+        in_game.append(seconds)
+        wall.append(process_seconds)
+
+    print(report.rstrip())
+    print(f"First menu frame: median {statistics.median(in_game) * 1000:.1f} ms, "
+          f"max {max(in_game) * 1000:.1f} ms over {args.runs} runs")
+    print(f"Whole process including the interpreter and exit: median {statistics.median(wall) * 1000:.1f} ms")
+
+    if args.check and statistics.median(in_game) > args.budget:
+        print(f"Over the budget of {args.budget * 1000:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+from array import array
+
+
+class SnakeBody:
+    # Segments are flat cell indices in a preallocated ring buffer, ordered from tail to head.
+    # The grid is padded by one cell on every side, because in the classic mode the head spends
+    # one tick outside the field before wrapping around.
+    #
+    # Every cell of the occupancy grid holds the sequence number of the last segment that entered
+    # it, so a cell is occupied while that number has not been dropped from the tail yet. This makes
+    # moving, dropping the tail, collision lookups and cutting off many tail segments constant-time.
+    def __init__(self, cols, rows):
+        self.cols = cols
+        self.rows = rows
+        self.grid_width = cols + 2
+        self.grid_size = self.grid_width * (rows + 2)
+        self.capacity = self.grid_size + 2
+        self.ring = array("l", [0]) * self.capacity
+        self.stamps = array("q", [-1]) * self.grid_size
+        self.head_seq = 0
+        self.tail_seq = 0
+
+    def __len__(self):
+        return self.head_seq - self.tail_seq
+
+    def __iter__(self):
+        for seq in range(self.tail_seq, self.head_seq):
+            yield self.position(self.ring[seq % self.capacity])
+
+    def cell(self, x, y):
+        return (y + 1) * self.grid_width + x + 1
+
+    def position(self, cell):
+        y, x = divmod(cell, self.grid_width)
+        return x - 1, y - 1
+
+    def head(self):
+        return self.position(self.ring[(self.head_seq - 1) % self.capacity])
+
+    def tail(self):
+        return self.position(self.ring[self.tail_seq % self.capacity])
+
+    def occupied(self, x, y):
+        return self.stamps[(y + 1) * self.grid_width + x + 1] >= self.tail_seq
+
+    def push_head(self, x, y):
+        cell = (y + 1) * self.grid_width + x + 1
+        self.ring[self.head_seq % self.capacity] = cell
+        self.stamps[cell] = self.head_seq
+        self.head_seq += 1
+        return cell
+
+    def pop_tail(self):
+        cell = self.ring[self.tail_seq % self.capacity]
+        self.tail_seq += 1
+        return cell
+
+    def truncate(self, count):
+        self.tail_seq += min(count, self.head_seq - self.tail_seq)
+
+    def segments(self, start_seq, stop_seq):
+        # Positions of segments start_seq..stop_seq - 1, including dropped ones the ring has not reused yet
+        return [self.position(self.ring[seq % self.capacity]) for seq in range(start_seq, stop_seq)]
+
+
+# Side of the square chunks ChunkedBody stores its occupancy grid in, in cells
+CHUNK_SIZE = 32
+INITIAL_CAPACITY = 1024
+
+
+class ChunkedStamps:
+    # The stamps grid of ChunkedBody: the same flat cell indices, but only chunks the snake has been in
+    # are allocated, and a chunk is dropped once the tail has left all of it
+    def __init__(self, grid_width, size=CHUNK_SIZE):
+        self.grid_width = grid_width
+        self.size = size
+        self.across = -(-grid_width // size)
+        self.chunks = {}
+        self.latest = {}
+
+    def _locate(self, cell):
+        y, x = divmod(cell, self.grid_width)
+        size = self.size
+        return (y // size) * self.across + x // size, (y % size) * size + x % size
+
+    def __getitem__(self, cell):
+        key, offset = self._locate(cell)
+        chunk = self.chunks.get(key)
+        return -1 if chunk is None else chunk[offset]
+
+    def __setitem__(self, cell, seq):
+        key, offset = self._locate(cell)
+        chunk = self.chunks.get(key)
+
+        if chunk is None:
+            chunk = self.chunks[key] = array("q", [-1]) * (self.size * self.size)
+
+        chunk[offset] = seq
+        self.latest[key] = max(self.latest.get(key, -1), seq)
+
+    def release(self, cell, tail_seq):
+        key = self._locate(cell)[0]
+
+        if self.latest.get(key, tail_seq) < tail_seq:
+            del self.chunks[key]
+            del self.latest[key]
+
+
+class ChunkedBody(SnakeBody):
+    # SnakeBody for worlds far larger than the screen: a flat grid of 2000x2000 cells would take tens
+    # of megabytes per array, so the occupancy grid is kept in chunks (see ChunkedStamps) and the ring
+    # buffer grows with the snake instead of holding the whole board. Memory follows the length of
+    # the snake, not the size of the world.
+    def __init__(self, cols, rows, capacity=INITIAL_CAPACITY):
+        self.cols = cols
+        self.rows = rows
+        self.grid_width = cols + 2
+        self.grid_size = self.grid_width * (rows + 2)
+        self.capacity = capacity
+        self.ring = array("l", [0]) * capacity
+        self.stamps = ChunkedStamps(self.grid_width)
+        self.head_seq = 0
+        self.tail_seq = 0
+
+    def push_head(self, x, y):
+        if self.head_seq - self.tail_seq >= self.capacity - 1:
+            self._grow()
+
+        return super().push_head(x, y)
+
+    def pop_tail(self):
+        cell = super().pop_tail()
+        self.stamps.release(cell, self.tail_seq)
+        return cell
+
+    def truncate(self, count):
+        dropped_seq = self.tail_seq
+        super().truncate(count)
+
+        for seq in range(dropped_seq, self.tail_seq):
+            self.stamps.release(self.ring[seq % self.capacity], self.tail_seq)
+
+    def _grow(self):
+        # Dropped segments the old ring still held are copied too, segments() may ask for them
+        ring = self.ring
+        capacity = self.capacity
+        self.capacity *= 2
+        self.ring = array("l", [0]) * self.capacity
+
+        for seq in range(max(0, self.head_seq - capacity), self.head_seq):
+            self.ring[seq % self.capacity] = ring[seq % capacity]
@@ -0,0 +1,72 @@
+import time
+from collections import deque
+
+import pygame
+
+import engine
+
+# Only these events reach the queue, the rest are dropped by SDL. Mouse motion is let through only
+# while a menu is shown (MenuScene allows it on entering and blocks it on leaving), so it never wakes
+# the pause screen or queues up during a game.
+ALLOWED_EVENTS = [pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, pygame.VIDEOEXPOSE, pygame.VIDEORESIZE]
+
+# The snake can be controlled both by the arrows and by using the WASD and numpad keys
+KEY_DIRECTIONS = {
+    pygame.K_LEFT: engine.LEFT, pygame.K_a: engine.LEFT, pygame.K_KP4: engine.LEFT,
+    pygame.K_RIGHT: engine.RIGHT, pygame.K_d: engine.RIGHT, pygame.K_KP6: engine.RIGHT,
+    pygame.K_UP: engine.UP, pygame.K_w: engine.UP, pygame.K_KP8: engine.UP,
+    pygame.K_DOWN: engine.DOWN, pygame.K_s: engine.DOWN, pygame.K_KP2: engine.DOWN,
+}
+
+QUEUE_SIZE = 3
+LATENCY_SAMPLES = 100
+
+
+def restrict_events():
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(ALLOWED_EVENTS)
+
+
+class DirectionQueue:
+    # Direction keys pressed between two logic ticks are kept in order and applied one per tick,
+    # so a quick double turn is not lost and cannot reverse the snake into itself in one tick.
+    # Every press is timestamped, the time from the press to the tick that applies it is kept.
+    def __init__(self, size=QUEUE_SIZE):
+        self.size = size
+        self.pending = deque()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def push(self, direction, state, timestamp=None):
+        # Repeats and reversals of the direction the snake will have by then are dropped right away
+        last = self.pending[-1][0] if self.pending else (state.dx, state.dy)
+
+        if direction == last or (direction[0] == -last[0] and direction[1] == -last[1]):
+            return False
+
+        if len(self.pending) >= self.size:
+            return False
+
+        self.pending.append((direction, time.perf_counter() if timestamp is None else timestamp))
+        return True
+
+    def apply(self, state):
+        # Called right before a logic tick
+        while self.pending:
+            direction, timestamp = self.pending.popleft()
+
+            if engine.turn(state, direction):
+                self.latencies.append(time.perf_counter() - timestamp)
+                return direction
+
+        return None
+
+    def clear(self):
+        self.pending.clear()
+
+    def latency(self):
+        # Median and worst key-to-move time of the recent presses, in seconds
+        if not self.latencies:
+            return 0.0, 0.0
+
+        ordered = sorted(self.latencies)
+        return ordered[len(ordered) // 2], ordered[-1]
@@ -0,0 +1,283 @@
+import math
+import random
+
+from body import ChunkedBody, SnakeBody
+from spawn import FreeCells, SparseFreeCells, spawn_region
+
+# --- Game Settings ---
+SNAKE_BLOCK = 10
+INITIAL_SPEED = 5
+MAX_HEARTS = 3
+
+CLASSIC = "C"
+MODERN = "M"
+
+# --- Directions (in cells) ---
+LEFT = (-1, 0)
+RIGHT = (1, 0)
+UP = (0, -1)
+DOWN = (0, 1)
+
+# --- Events returned by step() ---
+EAT = "eat"
+BONUS = "bonus"
+BORDER = "border"
+CRASH = "crash"
+
+NO_EVENTS = ()
+
+# --- Rules ---
+FOOD_MARGIN = 60
+FIRST_FOOD_MARGIN = 40
+BONUS_THRESHOLD = 5
+BONUS_RADIUS = int(SNAKE_BLOCK * 1.25)
+BONUS_REDUCTION_CE = 3
+MAX_BORDER_CROSSINGS = 3
+SPEED_STEP_CE = 0.75
+SPEED_STEP_MH = 2
+MAX_SPEED_CE = 60
+MAX_SPEED_MH = 600
+GROWTH_INCREMENT_MH = 2
+
+# --- Worlds ---
+# Boards of more cells than this (a screen has at most 128x72) keep the body in chunks
+DENSE_CELLS = 256 * 256
+WORLD_CELLS = 2000
+
+
+def _bonus_hit_offsets():
+    # Head cells (relative to the bonus cell) whose centre is closer to the bonus centre
+    # than bonus_radius + SNAKE_BLOCK // 2
+    reach = BONUS_RADIUS * 2 // SNAKE_BLOCK + 1
+    offsets = set()
+
+    for dx in range(-reach, reach + 1):
+        for dy in range(-reach, reach + 1):
+            distance = math.hypot(dx * SNAKE_BLOCK + SNAKE_BLOCK // 2 - BONUS_RADIUS,
+                                  dy * SNAKE_BLOCK + SNAKE_BLOCK // 2 - BONUS_RADIUS)
+
+            if distance < BONUS_RADIUS + SNAKE_BLOCK // 2:
+                offsets.add((dx, dy))
+
+    return frozenset(offsets)
+
+
+BONUS_HIT_OFFSETS = _bonus_hit_offsets()
+
+
+class Rules:
+    # The numbers the game is balanced with. Games are played with DEFAULT_RULES, tournament.py plays
+    # other values of them to tune them.
+    def __init__(self, initial_speed=INITIAL_SPEED, speed_step_ce=SPEED_STEP_CE, speed_step_mh=SPEED_STEP_MH,
+                 bonus_threshold=BONUS_THRESHOLD, growth_increment_mh=GROWTH_INCREMENT_MH):
+        self.initial_speed = initial_speed
+        self.speed_step_ce = speed_step_ce
+        self.speed_step_mh = speed_step_mh
+        self.bonus_threshold = bonus_threshold
+        self.growth_increment_mh = growth_increment_mh
+
+
+DEFAULT_RULES = Rules()
+
+
+class GameState:
+    def __init__(self, mode, width, height, seed=None, speed=None, hearts=MAX_HEARTS, rules=DEFAULT_RULES):
+        self.mode = mode
+        self.rules = rules
+        self.width = width
+        self.height = height
+        self.cols = width // SNAKE_BLOCK
+        self.rows = height // SNAKE_BLOCK
+        self.rng = random.Random(seed)
+
+        self.x = width // 2 // SNAKE_BLOCK
+        self.y = height // 2 // SNAKE_BLOCK
+        self.dx = 0
+        self.dy = 0
+        self.body, self.free = new_board(width, height)
+        self.length = 1
+        self.growth_step = 1
+
+        # The first food keeps its wider range, only the starting cell of the snake is excluded
+        self.bonus = None
+        self.food = random_cell(self, FIRST_FOOD_MARGIN)
+
+        while self.food == (self.x, self.y):
+            self.food = random_cell(self, FIRST_FOOD_MARGIN)
+
+        _take(self, self.food)
+        self.bonus_counter = 0
+
+        self.score = 0
+        self.speed = rules.initial_speed if speed is None else speed
+        self.hearts = hearts
+        self.border_counter = 0
+        self.alive = True
+        self.ticks = 0
+
+
+def new_board(width, height):
+    cols = width // SNAKE_BLOCK
+    rows = height // SNAKE_BLOCK
+    region = spawn_region(width, height, SNAKE_BLOCK, FOOD_MARGIN)
+
+    if cols * rows <= DENSE_CELLS:
+        body = SnakeBody(cols, rows)
+        return body, FreeCells(body, *region)
+
+    body = ChunkedBody(cols, rows)
+    return body, SparseFreeCells(body, *region)
+
+
+def random_cell(state, margin):
+    x = round(state.rng.randrange(margin, state.width - margin) / SNAKE_BLOCK)
+    y = round(state.rng.randrange(margin, state.height - margin) / SNAKE_BLOCK)
+    return x, y
+
+
+def spawn_cell(state):
+    # Food and the bonus never land on the snake or on each other
+    cell = state.free.sample(state.rng)
+
+    if cell is None:
+        return random_cell(state, FOOD_MARGIN)
+
+    return state.body.position(cell)
+
+
+def _take(state, position):
+    state.free.remove(state.body.cell(*position))
+
+
+def _release(state, cell):
+    # A cell left by the tail or the bonus is free again unless something else still covers it
+    body = state.body
+
+    if body.stamps[cell] >= body.tail_seq:
+        return
+
+    position = body.position(cell)
+
+    if position != state.food and position != state.bonus:
+        state.free.add(cell)
+
+
+def turn(state, direction):
+    # A snake cannot reverse into itself, any other turn replaces the current direction
+    dx, dy = direction
+
+    if dx == -state.dx and dy == -state.dy and (dx or dy):
+        return False
+
+    state.dx = dx
+    state.dy = dy
+    return True
+
+
+def _crash(state, events):
+    state.alive = False
+    events.append(CRASH)
+
+
+def step(state, action=None):
+    if not state.alive:
+        return state, NO_EVENTS
+
+    if action is not None:
+        turn(state, action)
+
+    events = []
+    cols = state.cols
+    rows = state.rows
+    x = state.x
+    y = state.y
+
+    # The head wraps around only after it has been outside the field for one tick
+    if x >= cols:
+        x = 0
+    elif x < 0:
+        x = cols - 1
+
+    if y >= rows:
+        y = 0
+    elif y < 0:
+        y = rows - 1
+
+    x += state.dx
+    y += state.dy
+    state.x = x
+    state.y = y
+    state.ticks += 1
+
+    if x >= cols or x < 0 or y >= rows or y < 0:
+        if state.mode == CLASSIC:
+            # In this mode you cannot cross the border more than 3 times
+            state.border_counter += 1
+            state.hearts -= 1
+            events.append(BORDER)
+
+            if state.hearts <= 0 or state.border_counter >= MAX_BORDER_CROSSINGS:
+                _crash(state, events)
+        else:
+            _crash(state, events)
+
+    # The tail leaves its cell before the head enters, so the head may follow it closely
+    body = state.body
+
+    free = state.free
+
+    # Food and the bonus are never under the tail: the head picks them up when it enters their cell
+    if len(body) >= state.length:
+        free.add(body.pop_tail())
+
+    if body.occupied(x, y) and state.alive:
+        _crash(state, events)
+
+    free.remove(body.push_head(x, y))
+
+    if (x, y) == state.food:
+        state.food = spawn_cell(state)
+        _take(state, state.food)
+        state.length += state.growth_step
+        state.score += state.growth_step
+        state.bonus_counter += 1
+        events.append(EAT)
+
+        rules = state.rules
+
+        if state.bonus_counter >= rules.bonus_threshold and state.bonus is None:
+            state.bonus = spawn_cell(state)
+            _take(state, state.bonus)
+            state.bonus_counter = 0
+
+        if state.mode == MODERN:
+            # In this mode the score counter increases in an arithmetic progression
+            state.growth_step += rules.growth_increment_mh
+
+        # The snake speed increases with every eaten food
+        if state.speed < MAX_SPEED_CE and state.mode == CLASSIC:
+            state.speed += rules.speed_step_ce
+        elif state.speed < MAX_SPEED_MH and state.mode == MODERN:
+            state.speed += rules.speed_step_mh
+
+    if state.bonus is not None and (x - state.bonus[0], y - state.bonus[1]) in BONUS_HIT_OFFSETS:
+        bonus_cell = body.cell(*state.bonus)
+        state.bonus = None
+        _release(state, bonus_cell)
+        events.append(BONUS)
+
+        if state.mode == CLASSIC:
+            reduction = BONUS_REDUCTION_CE
+            state.length = max(1, state.length - reduction)
+        else:
+            new_length = max(1, state.length // 2)
+            reduction = state.length - new_length
+            state.length = new_length
+
+        dropped_seq = body.tail_seq
+        body.truncate(reduction)
+
+        for seq in range(dropped_seq, body.tail_seq):
+            _release(state, body.ring[seq % body.capacity])
+
+    return state, events
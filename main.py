@@ -1,8 +1,36 @@
-import math
-import random
+import argparse
+import atexit
+import socket
+import sys
+import time
 import pygame
 
-pygame.init()
+import engine
+import protocol
+from arena import DIRECTIONS, NO_OWNER, Arena
+from assets import AssetCache, TextCache, SCREEN_SIZE, resolve_font
+from audio import AudioManager, pre_init_mixer
+from autopilot import Autopilot
+from controls import KEY_DIRECTIONS, DirectionQueue, restrict_events
+from profiler import STARTUP_BUDGET, profiler, startup
+from render import ChunkedLayer, DirtyRects, Display, SnakeLayer
+from replay import Replay, ReplayPlayer, ReplayRecorder, color_rng, new_seed, save_best_replay, save_replay
+from scenes import Scene, SceneManager
+from scores import ScoreStore
+from engine import SNAKE_BLOCK, INITIAL_SPEED, MAX_HEARTS, WORLD_CELLS
+
+# Only the modules the game uses, pygame.init() would also start joysticks and the rest
+pre_init_mixer()
+pygame.display.init()
+pygame.font.init()
+restrict_events()
+
+try:
+    pygame.mixer.init()
+except pygame.error:
+    pass
+
+startup.mark("pygame")
 
 # --- Colors ---
 WHITE = (255, 255, 255)
@@ -15,19 +43,36 @@ AQUA = (0, 255, 255)
 PURPLE = (255, 0, 255)
 
 # --- Screen Settings ---
+# Everything is drawn at this logical size, the window only changes how large it is shown
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+display = Display((SCREEN_WIDTH, SCREEN_HEIGHT))
+screen = display.set_window((SCREEN_WIDTH, SCREEN_HEIGHT))
+startup.mark("window")
 
 # --- Game Settings ---
-SNAKE_BLOCK = 10
-INITIAL_SPEED = 5
-MAX_HEARTS = 3
-
 snake_speed = INITIAL_SPEED
 hearts_remaining = MAX_HEARTS
 
+# The game logic ticks at snake_speed, frames are drawn at most RENDER_FPS times per second
+RENDER_FPS = 60
+MAX_STEPS_PER_FRAME = 20
+INTERPOLATE = False
+MAX_REPLAY_SPEED = 16
+
+# The arena: the player (white) against computer snakes on the screen-sized board, at a fixed speed
+ARENA_SNAKES = 24
+ARENA_SPEED = 10
+ARENA_COLORS = [RED, BLUE, YELLOW, AQUA, PURPLE, (255, 128, 0)]
+NETWORK_TIMEOUT = 5
+
+# How far from the screen edge the marker of food outside the screen is drawn
+FOOD_MARKER_INSET = 15
+
+# Push only the changed parts of the screen to the display instead of the whole surface
+DIRTY_RECTS = True
+
 # --- Button Settings ---
 BUTTON_WIDTH = 300
 BUTTON_HEIGHT = 50
@@ -36,22 +81,64 @@ BUTTON_HOVER_COLOR = (100, 150, 200)
 BUTTON_TEXT_COLOR = WHITE
 
 # --- Graphics ---
-heart_image = pygame.transform.scale(pygame.image.load("images/heart.png"), (25, 25))
+IMAGES = {
+    "grass": ("images/grass.jpg", False, SCREEN_SIZE),
+    "heart": ("images/heart.png", True, (25, 25)),
+    "pause": ("images/pause.png", True, None),
+}
+
+# The menus use none of the images, they are loaded when the first game starts
+assets = AssetCache(IMAGES, (SCREEN_WIDTH, SCREEN_HEIGHT))
+profiler.watch("images", assets)
 snake_icon = pygame.image.load("images/snake.ico")
 
 pygame.display.set_caption("Snake")
 pygame.display.set_icon(snake_icon)
 
 # --- Fonts ---
-font_style = pygame.font.SysFont("TDAText", 15)
-score_font = pygame.font.SysFont("TDAText", 25)
-menu_font = pygame.font.SysFont("TDAText", 30)
+font_path = resolve_font("TDAText")
+font_style = pygame.font.Font(font_path, 15)
+score_font = pygame.font.Font(font_path, 25)
+menu_font = pygame.font.Font(font_path, 30)
+startup.mark("fonts")
+
+# --- Text cache ---
+AUTHOR_TEXT = "2024-2025. Владислав Клименко (Limdizz)."
+
+MENU_LABELS = {
+    "ru": ["Змейка", "Начать игру", "Настройки", "Выйти из игры", "Выберите режим игры", "Классический",
+           "Современный", "Другие режимы", "Огромный мир", "Арена", "Назад", "Разрешение", "Язык",
+           "Русский", "English", "640x480", "800x600", "1280x720", "Полный экран", "Вы проиграли",
+           "Начать заново", "Выйти в меню"],
+    "en": ["Snake: The Game", "Start the Game", "Settings", "Exit to Desktop", "Select the game mode",
+           "Classic Easy", "Modern Hard", "Other Modes", "Huge World", "Arena", "Back", "Resolution",
+           "Language", "Русский", "English", "640x480", "800x600", "1280x720", "Fullscreen", "You lost",
+           "Restart", "Exit to Menu"],
+}
+
+text_cache = TextCache()
+profiler.watch("text", text_cache)
+
+# --- Scores ---
+scores = ScoreStore()
+atexit.register(scores.close)
+startup.mark("scores")
 
 # --- Audio: sounds ---
-snake_start_sound = pygame.mixer.Sound('audio/snake_start.mp3')
-snake_end_sound = pygame.mixer.Sound('audio/snake_end.mp3')
-snake_hiss_ce_sound = pygame.mixer.Sound('audio/snake_hiss_ce.ogg')
-snake_hiss_mh_sound = pygame.mixer.Sound('audio/snake_hiss_mh.ogg')
+SOUNDS = {
+    "start": ('audio/snake_start.mp3', "menu"),
+    "end": ('audio/snake_end.mp3', "game"),
+    "hiss_ce": ('audio/snake_hiss_ce.ogg', "eat"),
+    "hiss_mh": ('audio/snake_hiss_mh.ogg', "eat"),
+}
+
+# Channels reserved for every group of sounds, eating can overlap a few times at high speed
+VOICES = {"menu": 1, "game": 1, "eat": 3}
+
+sounds = AudioManager(SOUNDS, VOICES)
+sounds.start()
+atexit.register(sounds.close)
+startup.mark("audio")
 
 # --- Audio: music ---
 music_ce = 'audio/music_ce.ogg'
@@ -70,7 +157,7 @@ class Button:
         pygame.draw.rect(surface, color, self.rect, border_radius=10)
         pygame.draw.rect(surface, WHITE, self.rect, 2, border_radius=10)
 
-        text_surf = menu_font.render(self.text, True, BUTTON_TEXT_COLOR)
+        text_surf = text_cache.render(menu_font, self.text, True, BUTTON_TEXT_COLOR)
         text_rect = text_surf.get_rect(center=self.rect.center)
         surface.blit(text_surf, text_rect)
 
@@ -81,80 +168,90 @@ class Button:
     def handle_event(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and self.is_hovered:
             if self.action:
-                snake_start_sound.play()
+                sounds.play("start")
                 self.action()
 
 
-def draw_boundaries():
-    pygame.draw.rect(screen, GREEN, [0, 0, SCREEN_WIDTH, SNAKE_BLOCK])  # Top
-    pygame.draw.rect(screen, GREEN, [0, SCREEN_HEIGHT - SNAKE_BLOCK, SCREEN_WIDTH, SNAKE_BLOCK])  # Bottom
-    pygame.draw.rect(screen, GREEN, [0, 0, SNAKE_BLOCK, SCREEN_HEIGHT])  # Left
-    pygame.draw.rect(screen, GREEN, [SCREEN_WIDTH - SNAKE_BLOCK, 0, SNAKE_BLOCK, SCREEN_HEIGHT])  # Right
+def draw_boundaries(surface):
+    pygame.draw.rect(surface, GREEN, [0, 0, SCREEN_WIDTH, SNAKE_BLOCK])  # Top
+    pygame.draw.rect(surface, GREEN, [0, SCREEN_HEIGHT - SNAKE_BLOCK, SCREEN_WIDTH, SNAKE_BLOCK])  # Bottom
+    pygame.draw.rect(surface, GREEN, [0, 0, SNAKE_BLOCK, SCREEN_HEIGHT])  # Left
+    pygame.draw.rect(surface, GREEN, [SCREEN_WIDTH - SNAKE_BLOCK, 0, SNAKE_BLOCK, SCREEN_HEIGHT])  # Right
 
 
-def draw_hearts():
+def draw_hearts(surface, hearts):
+    heart_image = assets.get("heart")
     heart_spacing = 5
-    total_width = hearts_remaining * (heart_image.get_width() + heart_spacing) - heart_spacing
+    total_width = hearts * (heart_image.get_width() + heart_spacing) - heart_spacing
     start_x = (SCREEN_WIDTH - total_width) // 2
     y_pos = SCREEN_HEIGHT - 50
 
-    for i in range(hearts_remaining):
-        screen.blit(heart_image, (start_x + i * (heart_image.get_width() + heart_spacing), y_pos))
+    for i in range(hearts):
+        surface.blit(heart_image, (start_x + i * (heart_image.get_width() + heart_spacing), y_pos))
 
+    return pygame.Rect(start_x, y_pos, max(total_width, 0), heart_image.get_height())
 
-def draw_snake(block_size, segments):
-    for segment in segments:
-        pygame.draw.rect(screen, WHITE, [segment[0], segment[1], block_size, block_size])
 
+# --- Background layers ---
+background_layers = {}
 
-def load_high_score(mode):
-    if mode == "M":
-        record_file = "saves/highscore_mh.txt"
-    else:
-        record_file = "saves/highscore_ce.txt"
 
-    try:
-        with open(record_file) as file:
-            return int(file.read())
-    except (FileNotFoundError, ValueError):
-        return 0
+def background_layer(mode, hearts):
+    # The static part of the game screen (black and hearts, or grass and border) is composited once
+    # per mode, resolution and number of hearts and then drawn with a single blit
+    key = (mode, SCREEN_WIDTH, SCREEN_HEIGHT, hearts if mode == "C" else None)
+    layer = background_layers.get(key)
+
+    if layer is None:
+        if mode == "C":
+            layer = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+            layer.fill(BLACK)
+            hearts_rect = draw_hearts(layer, hearts)
+        else:
+            layer = assets.get("grass").copy()
+            draw_boundaries(layer)
+            hearts_rect = None
 
+        background_layers[key] = layer, hearts_rect
 
-def save_high_score(score, mode):
-    if mode == "M":
-        record_file = "saves/highscore_mh.txt"
-    else:
-        record_file = "saves/highscore_ce.txt"
+    return background_layers[key]
 
-    with open(record_file, "w") as file:
-        file.write(str(score))
+
+def world_pattern(mode):
+    # Worlds are tiled with what fills the screen-sized board: black, or the grass picture
+    if mode == "C":
+        pattern = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+        pattern.fill(BLACK)
+        return pattern
+
+    return assets.get("grass")
 
 
 def display_current_score(score, lang):
     if lang == "ru":
-        value = score_font.render("Счёт: " + str(score), True, WHITE)
-        screen.blit(value, [25, 10])
+        value = text_cache.render(score_font, "Счёт: " + str(score), True, WHITE)
+        return screen.blit(value, [25, 10])
 
     elif lang == "en":
-        value = score_font.render("Your score: " + str(score), True, WHITE)
-        screen.blit(value, [25, 10])
+        value = text_cache.render(score_font, "Your score: " + str(score), True, WHITE)
+        return screen.blit(value, [25, 10])
 
 
 def display_high_score(high_score, lang):
     if lang == "ru":
-        value = score_font.render("Рекорд: " + str(high_score), True, WHITE)
-        screen.blit(value, [SCREEN_WIDTH - 220, 10])
+        value = text_cache.render(score_font, "Рекорд: " + str(high_score), True, WHITE)
+        return screen.blit(value, [SCREEN_WIDTH - 220, 10])
 
     elif lang == "en":
-        value = score_font.render("High score: " + str(high_score), True, WHITE)
-        screen.blit(value, [SCREEN_WIDTH - 220, 10])
+        value = text_cache.render(score_font, "High score: " + str(high_score), True, WHITE)
+        return screen.blit(value, [SCREEN_WIDTH - 220, 10])
 
 
 def show_message(text, font_size, color, x_offset=0, y_offset=0):
     if font_size == 15:
-        message = font_style.render(text, True, color)
+        message = text_cache.render(font_style, text, True, color)
     elif font_size == 25:
-        message = score_font.render(text, True, color)
+        message = text_cache.render(score_font, text, True, color)
     else:
         raise ValueError(f"Unsupported font size: {font_size}")
 
@@ -163,465 +260,554 @@ def show_message(text, font_size, color, x_offset=0, y_offset=0):
     screen.blit(message, message_rect)
 
 
-def pause_game():
-    paused = True
+class PauseScene(Scene):
+    idle = True
+
+    def enter(self):
+        # Only keys and clicks leave the pause, so the pointer moving over it does not wake it up
+        pygame.event.set_blocked(pygame.MOUSEMOTION)
+        sounds.pause_music()
+
+    def exit(self):
+        sounds.unpause_music()
+
+    def handle_event(self, event):
+        if event.type == pygame.QUIT:
+            exit_game()
+
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_SPACE or event.key == pygame.K_ESCAPE:
+                scene_manager.pop()
+
+            elif event.key == pygame.K_q:
+                exit_game()
 
-    while paused:
-        pygame.mixer.music.pause()
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            scene_manager.pop()
 
-        pause_button = pygame.image.load('images/pause.png')
+    def draw(self):
+        # Drawn over the last frame of the game
+        pause_button = assets.get("pause")
         pause_rect = pause_button.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
         screen.blit(pause_button, pause_rect)
-        pygame.display.update()
+        profiler.lap("background")
+        profiler.draw_overlay(screen, font_style)
+        display.present()
+
+
+class MenuScene(Scene):
+    idle = True
+
+    def __init__(self, title_text, buttons, can_go_back=False):
+        self.title_text = title_text
+        self.buttons = buttons
+        self.can_go_back = can_go_back
 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                quit()
+    def enter(self):
+        # From here on the hover states follow the motion events, which only a menu lets through
+        pygame.event.set_allowed(pygame.MOUSEMOTION)
+        self.hover(display.to_logical(pygame.mouse.get_pos()))
 
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE or event.key == pygame.K_ESCAPE:
-                    paused = False
-                    pygame.mixer.music.unpause()
+    def exit(self):
+        # The scene after a menu is a game or another menu, a menu allows motion again on entering
+        pygame.event.set_blocked(pygame.MOUSEMOTION)
+        pygame.event.clear(pygame.MOUSEMOTION)
 
-                elif event.key == pygame.K_q:
-                    pygame.quit()
-                    quit()
+    def resume(self):
+        self.enter()
 
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                paused = False
-                pygame.mixer.music.unpause()
+    def hover(self, position):
+        # True when a button changed its hover state, then the menu has to be drawn again
+        changed = False
 
-        clock.tick(15)
+        for button in self.buttons:
+            hovered = button.is_hovered
+            changed |= button.check_hover(position) != hovered
 
+        return changed
 
-def create_menu(title_text, buttons, back_function=None):
-    while True:
-        mouse_pos = pygame.mouse.get_pos()
+    def handle_event(self, event):
+        if event.type == pygame.QUIT:
+            exit_game()
+
+        if event.type == pygame.MOUSEMOTION and self.hover(display.to_logical(event.pos)):
+            self.redraw = True
+
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            self.hover(display.to_logical(event.pos))
+
+            for button in self.buttons:
+                button.handle_event(event)
+
+            # A click may have changed the menu or the window, and drawing once more is cheap
+            self.redraw = True
+
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_ESCAPE and self.can_go_back:
+                scene_manager.pop()
+
+            elif event.key == pygame.K_q:
+                exit_game()
+
+    def draw(self):
         screen.fill(BLACK)
 
-        title = menu_font.render(title_text, True, WHITE)
+        title = text_cache.render(menu_font, self.title_text, True, WHITE)
         screen.blit(title, (SCREEN_WIDTH // 2 - title.get_width() // 2, 100))
 
-        if back_function is None:
-            author = font_style.render("2024-2025. Владислав Клименко (Limdizz).", True, WHITE)
+        if not self.can_go_back:
+            author = text_cache.render(font_style, AUTHOR_TEXT, True, WHITE)
             screen.blit(author, (SCREEN_WIDTH // 2 - author.get_width() // 2, SCREEN_HEIGHT - 50))
 
-        for button in buttons:
-            button.check_hover(mouse_pos)
+        profiler.lap("background")
+
+        for button in self.buttons:
             button.draw(screen)
 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                quit()
+        profiler.lap("hud")
+        profiler.draw_overlay(screen, font_style)
+        display.present()
 
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                for button in buttons:
-                    button.handle_event(event)
 
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE and back_function:
-                    back_function()
-                    return
+def menu_button(row, text, action):
+    return Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200 + row * 70, BUTTON_WIDTH, BUTTON_HEIGHT, text, action)
+
 
-                if event.key == pygame.K_q:
-                    pygame.quit()
-                    quit()
+def prewarm_labels(lang):
+    text_cache.prewarm(menu_font, MENU_LABELS[lang], True, WHITE)
+    text_cache.prewarm(font_style, [AUTHOR_TEXT], True, WHITE)
 
-        pygame.display.update()
-        clock.tick(15)
 
+def main_menu(lang):
+    prewarm_labels(lang)
 
-def run_main_menu(lang):
     if lang == "ru":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Начать игру", lambda: select_mode_menu("ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Настройки", lambda: run_settings_menu("ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Выйти из игры", lambda: exit_game())
+            menu_button(0, "Начать игру", lambda: scene_manager.push(select_mode_menu("ru"))),
+            menu_button(1, "Настройки", lambda: scene_manager.push(settings_menu("ru"))),
+            menu_button(2, "Выйти из игры", lambda: exit_game())
         ]
 
-        create_menu("Змейка", buttons)
+        return MenuScene("Змейка", buttons)
 
     elif lang == "en":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Start the Game", lambda: select_mode_menu("en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Settings", lambda: run_settings_menu("en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Exit to Desktop", lambda: exit_game())
+            menu_button(0, "Start the Game", lambda: scene_manager.push(select_mode_menu("en"))),
+            menu_button(1, "Settings", lambda: scene_manager.push(settings_menu("en"))),
+            menu_button(2, "Exit to Desktop", lambda: exit_game())
         ]
 
-        create_menu("Snake: The Game", buttons)
+        return MenuScene("Snake: The Game", buttons)
 
 
 def select_mode_menu(lang):
     if lang == "ru":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Классический", lambda: run_game_loop("C", "ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Современный", lambda: run_game_loop("M", "ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Назад", lambda: run_main_menu("ru"))
+            menu_button(0, "Классический", lambda: start_game("C", "ru")),
+            menu_button(1, "Современный", lambda: start_game("M", "ru")),
+            menu_button(2, "Другие режимы", lambda: scene_manager.push(other_modes_menu("ru"))),
+            menu_button(3, "Назад", lambda: scene_manager.pop())
+        ]
+
+        return MenuScene("Выберите режим игры", buttons, can_go_back=True)
+
+    elif lang == "en":
+        buttons = [
+            menu_button(0, "Classic Easy", lambda: start_game("C", "en")),
+            menu_button(1, "Modern Hard", lambda: start_game("M", "en")),
+            menu_button(2, "Other Modes", lambda: scene_manager.push(other_modes_menu("en"))),
+            menu_button(3, "Back", lambda: scene_manager.pop())
+        ]
+
+        return MenuScene("Select the game mode", buttons, can_go_back=True)
+
+
+def other_modes_menu(lang):
+    # Both play by the classic rules
+    if lang == "ru":
+        buttons = [
+            menu_button(0, "Огромный мир", lambda: start_game("C", "ru", "world")),
+            menu_button(1, "Арена", lambda: start_game("C", "ru", "arena")),
+            menu_button(2, "Назад", lambda: scene_manager.pop())
         ]
 
-        create_menu("Выберите режим игры", buttons, lambda: run_main_menu("ru"))
+        return MenuScene("Другие режимы", buttons, can_go_back=True)
 
     elif lang == "en":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Classic Easy", lambda: run_game_loop("C", "en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Modern Hard", lambda: run_game_loop("M", "en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Back", lambda: run_main_menu("en"))
+            menu_button(0, "Huge World", lambda: start_game("C", "en", "world")),
+            menu_button(1, "Arena", lambda: start_game("C", "en", "arena")),
+            menu_button(2, "Back", lambda: scene_manager.pop())
         ]
 
-        create_menu("Select the game mode", buttons, lambda: run_main_menu("en"))
+        return MenuScene("Other Modes", buttons, can_go_back=True)
 
 
-def run_settings_menu(lang):
+def settings_menu(lang):
     if lang == "ru":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Разрешение", lambda: run_resolution_menu("ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Язык", lambda: run_language_menu("ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Назад", lambda: run_main_menu("ru"))
+            menu_button(0, "Разрешение", lambda: scene_manager.push(resolution_menu("ru"))),
+            menu_button(1, "Язык", lambda: scene_manager.push(language_menu("ru"))),
+            menu_button(2, "Назад", lambda: scene_manager.pop())
         ]
 
-        create_menu("Настройки", buttons, lambda: run_main_menu("ru"))
+        return MenuScene("Настройки", buttons, can_go_back=True)
 
     elif lang == "en":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Resolution", lambda: run_resolution_menu("en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Language", lambda: run_language_menu("en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Back", lambda: run_main_menu("en"))
+            menu_button(0, "Resolution", lambda: scene_manager.push(resolution_menu("en"))),
+            menu_button(1, "Language", lambda: scene_manager.push(language_menu("en"))),
+            menu_button(2, "Back", lambda: scene_manager.pop())
         ]
 
-        create_menu("Settings", buttons, lambda: run_main_menu("en"))
+        return MenuScene("Settings", buttons, can_go_back=True)
 
 
-def change_resolution(width, height, menu_callback):
+def set_logical_size(width, height):
+    # Only for boards of another size, a replay or a server room: the layouts and cached pictures
+    # depend on it, so they are built again
     global SCREEN_HEIGHT, SCREEN_WIDTH, screen
     SCREEN_WIDTH = width
     SCREEN_HEIGHT = height
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    screen = display.set_logical_size((SCREEN_WIDTH, SCREEN_HEIGHT))
+    assets.rebuild((SCREEN_WIDTH, SCREEN_HEIGHT))
+    background_layers.clear()
+
+
+def set_window_size(width, height, fullscreen=False):
+    # Nothing drawn depends on the window, so this is all a resolution switch does
+    global screen
+    screen = display.set_window((width, height), fullscreen)
 
-    pygame.display.update()
-    clock.tick(15)
-    menu_callback()
 
+def window_resized():
+    # A window resized by hand may need another surface to draw on
+    global screen
+    screen = display.layout()
 
-def run_resolution_menu(lang):
+
+def change_resolution(width, height, fullscreen=False):
+    set_window_size(width, height, fullscreen)
+    # The new window starts out black, and the menu is idle until something tells it to draw
+    scene_manager.top.redraw = True
+
+
+def resolution_menu(lang):
     if lang == "ru":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "640x480", lambda: change_resolution(640, 480, lambda: run_resolution_menu("ru"))),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "800x600", lambda: change_resolution(800, 600, lambda: run_resolution_menu("ru"))),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "1280x720", lambda: change_resolution(1280, 720, lambda: run_resolution_menu("ru"))),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 410, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Назад", lambda: run_settings_menu("ru"))
+            menu_button(0, "640x480", lambda: change_resolution(640, 480)),
+            menu_button(1, "800x600", lambda: change_resolution(800, 600)),
+            menu_button(2, "1280x720", lambda: change_resolution(1280, 720)),
+            menu_button(3, "Полный экран", lambda: change_resolution(SCREEN_WIDTH, SCREEN_HEIGHT, True)),
+            menu_button(4, "Назад", lambda: scene_manager.pop())
         ]
 
-        create_menu("Разрешение", buttons, lambda: run_settings_menu("ru"))
+        return MenuScene("Разрешение", buttons, can_go_back=True)
 
     elif lang == "en":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "640x480", lambda: change_resolution(640, 480, lambda: run_resolution_menu("en"))),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "800x600", lambda: change_resolution(800, 600, lambda: run_resolution_menu("en"))),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "1280x720", lambda: change_resolution(1280, 720, lambda: run_resolution_menu("en"))),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 410, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Back", lambda: run_settings_menu("en"))
+            menu_button(0, "640x480", lambda: change_resolution(640, 480)),
+            menu_button(1, "800x600", lambda: change_resolution(800, 600)),
+            menu_button(2, "1280x720", lambda: change_resolution(1280, 720)),
+            menu_button(3, "Fullscreen", lambda: change_resolution(SCREEN_WIDTH, SCREEN_HEIGHT, True)),
+            menu_button(4, "Back", lambda: scene_manager.pop())
         ]
 
-        create_menu("Resolution", buttons, lambda: run_settings_menu("en"))
+        return MenuScene("Resolution", buttons, can_go_back=True)
 
 
-def run_language_menu(lang):
+def change_language(lang):
+    scene_manager.reset(main_menu(lang), settings_menu(lang), language_menu(lang))
+
+
+def language_menu(lang):
     if lang == "ru":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Русский", lambda: run_language_menu("ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "English", lambda: run_language_menu("en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Назад", lambda: run_settings_menu("ru"))
+            menu_button(0, "Русский", lambda: change_language("ru")),
+            menu_button(1, "English", lambda: change_language("en")),
+            menu_button(2, "Назад", lambda: scene_manager.pop())
         ]
 
-        create_menu("Язык", buttons, lambda: run_settings_menu("ru"))
+        return MenuScene("Язык", buttons, can_go_back=True)
 
     elif lang == "en":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Русский", lambda: run_language_menu("ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "English", lambda: run_language_menu("en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Back", lambda: run_settings_menu("en"))
+            menu_button(0, "Русский", lambda: change_language("ru")),
+            menu_button(1, "English", lambda: change_language("en")),
+            menu_button(2, "Back", lambda: scene_manager.pop())
         ]
 
-        create_menu("Language", buttons, lambda: run_settings_menu("en"))
+        return MenuScene("Language", buttons, can_go_back=True)
 
 
-def lose_game_menu(mode, lang):
+def lose_game_menu(mode, lang, variant=None):
     if lang == "ru":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT, "Начать заново",
-                   lambda: restart_game(mode, "ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT, "Выйти в меню",
-                   lambda: run_main_menu("ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Выйти из игры", lambda: exit_game())
+            menu_button(0, "Начать заново", lambda: restart_game(mode, "ru", variant)),
+            menu_button(1, "Выйти в меню", lambda: scene_manager.reset(main_menu("ru"))),
+            menu_button(2, "Выйти из игры", lambda: exit_game())
         ]
 
-        create_menu("Вы проиграли", buttons)
+        return MenuScene("Вы проиграли", buttons)
 
     elif lang == "en":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT, "Restart",
-                   lambda: restart_game(mode, "en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT, "Exit to Menu",
-                   lambda: run_main_menu("en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Exit to Desktop", lambda: exit_game())
+            menu_button(0, "Restart", lambda: restart_game(mode, "en", variant)),
+            menu_button(1, "Exit to Menu", lambda: scene_manager.reset(main_menu("en"))),
+            menu_button(2, "Exit to Desktop", lambda: exit_game())
         ]
 
-        create_menu("You lost", buttons)
+        return MenuScene("You lost", buttons)
 
 
-def new_high_score_menu(mode, score=0, lang="ru"):
+def new_high_score_menu(mode, score=0, lang="ru", variant=None):
     if lang == "ru":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT, "Начать заново",
-                   lambda: restart_game(mode, "ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT, "Выйти в меню",
-                   lambda: run_main_menu("ru")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Выйти из игры", lambda: exit_game())
+            menu_button(0, "Начать заново", lambda: restart_game(mode, "ru", variant)),
+            menu_button(1, "Выйти в меню", lambda: scene_manager.reset(main_menu("ru"))),
+            menu_button(2, "Выйти из игры", lambda: exit_game())
         ]
 
-        create_menu(f"Новый рекорд: {score}", buttons)
+        return MenuScene(f"Новый рекорд: {score}", buttons)
 
     elif lang == "en":
         buttons = [
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 200, BUTTON_WIDTH, BUTTON_HEIGHT, "Restart",
-                   lambda: restart_game(mode, "en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 270, BUTTON_WIDTH, BUTTON_HEIGHT, "Exit to Menu",
-                   lambda: run_main_menu("en")),
-            Button(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, 340, BUTTON_WIDTH, BUTTON_HEIGHT,
-                   "Exit to Desktop", lambda: exit_game())
+            menu_button(0, "Restart", lambda: restart_game(mode, "en", variant)),
+            menu_button(1, "Exit to Menu", lambda: scene_manager.reset(main_menu("en"))),
+            menu_button(2, "Exit to Desktop", lambda: exit_game())
         ]
 
-        create_menu(f"New High Score: {score}", buttons)
+        return MenuScene(f"New High Score: {score}", buttons)
+
 
+def new_game(mode, lang, variant):
+    # variant: None for the usual board, "world" or "arena"
+    if variant == "arena":
+        return ArenaScene(mode, lang)
 
-def restart_game(mode, lang="ru"):
+    return GameScene(mode, lang, world=variant == "world")
+
+
+def start_game(mode, lang="ru", variant=None):
+    assets.preload()
+    scene_manager.reset(new_game(mode, lang, variant))
+
+
+def restart_game(mode, lang="ru", variant=None):
     global snake_speed, hearts_remaining
 
     snake_speed = INITIAL_SPEED
     hearts_remaining = MAX_HEARTS
 
-    if lang == "ru":
-        run_game_loop(mode, "ru")
-    elif lang == "en":
-        run_game_loop(mode, "en")
+    scene_manager.reset(new_game(mode, lang, variant))
 
 
 def exit_game():
+    sounds.close()
     pygame.quit()
     quit()
 
 
-def run_game_loop(mode, lang="ru"):
-    game_over = False
-    game_close = False
-    new_high_score = False
-    border_counter = 0
-    growth_step = 1
+class GameScene(Scene):
+    frame_rate = RENDER_FPS
+    # Replays play a game back without counting it again
+    records_scores = True
+
+    def __init__(self, mode, lang="ru", state=None, seed=None, world=False):
+        self.mode = mode
+        self.lang = lang
+        self.new_high_score = False
+
+        # Every game has its own seeded random streams, so it can be replayed exactly
+        if state is None:
+            seed = new_seed()
+            width, height = (WORLD_CELLS * SNAKE_BLOCK,) * 2 if world else (SCREEN_WIDTH, SCREEN_HEIGHT)
+            state = engine.GameState(mode, width, height, seed=seed, speed=snake_speed, hearts=hearts_remaining)
+
+        # A world larger than the screen is seen through a camera following the head, and has its own
+        # high scores
+        self.world = state.width > SCREEN_WIDTH or state.height > SCREEN_HEIGHT
+        self.variant = "world" if self.world else None
+        self.board = mode + "W" if self.world else mode
+        self.world_layer = None
+
+        if self.world:
+            self.world_layer = ChunkedLayer(SNAKE_BLOCK, WHITE, world_pattern(mode), state.cols, state.rows,
+                                            GREEN if mode == "M" else None)
+
+        self.state = state
+        self.seed = seed
+        self.recorder = ReplayRecorder(state, seed)
+        self.controls = DirectionQueue()
+        self.autopilot = None
+        self.color_rng = color_rng(seed)
+        self.color_list = [WHITE, RED, GREEN, BLUE, AQUA, PURPLE, YELLOW]
+        self.time_scale = 1
+        self.tick_limit = float("inf")
+
+        self.high_score = scores.high_score(self.board)
+        self.accumulator = 0.0
+        self.game_time = 0.0
+        self.previous_time = time.perf_counter()
+
+        self.dirty = DirtyRects(display)
+        self.snake_layer = SnakeLayer(SNAKE_BLOCK, WHITE)
+        self.drawn_head_seq = 0
+        self.drawn_tail_seq = 0
+        self.shown_hud = None
+        self.shown_hud_rects = []
+
+    def enter(self):
+        if self.mode == "C":
+            sounds.play_music(music_ce, 0.5)
+        else:
+            sounds.play_music(music_mh, 0.5)
 
-    snake_list = []
-    length_of_snake = 1
-    x1 = SCREEN_WIDTH / 2
-    y1 = SCREEN_HEIGHT / 2
-    x1_change = 0
-    y1_change = 0
-    global snake_speed, hearts_remaining
+        self.previous_time = time.perf_counter()
 
-    food_x = round(random.randrange(40, SCREEN_WIDTH - 40) / 10.0) * 10.0
-    food_y = round(random.randrange(40, SCREEN_HEIGHT - 40) / 10.0) * 10.0
-    color_list = [WHITE, RED, GREEN, BLUE, AQUA, PURPLE, YELLOW]
+    def exit(self):
+        sounds.stop_music()
 
-    bonus_ball_counter = 0
-    bonus_active = False
-    bonus_x = None
-    bonus_y = None
-    bonus_threshold = 5
-    bonus_radius = int(SNAKE_BLOCK * 1.25)
+    def resume(self):
+        # Time spent in the pause screen is not caught up, and the pause image has to be drawn over
+        self.previous_time = time.perf_counter()
+        self.dirty.invalidate()
 
-    current_score = 0
-    high_score = load_high_score(mode)
+    def handle_event(self, event):
+        state = self.state
 
-    if mode == "C":
-        pygame.mixer.music.load(music_ce)
-        pygame.mixer.music.set_volume(0.5)
-        pygame.mixer.music.play(-1)
-    else:
-        pygame.mixer.music.load(music_mh)
-        pygame.mixer.music.set_volume(0.5)
-        pygame.mixer.music.play(-1)
+        if event.type == pygame.QUIT:
+            exit_game()
 
-    while not game_over:
-        while game_close:
-            screen.fill(BLACK)
+        # Direction keys are queued and applied one per logic tick
+        if event.type == pygame.KEYDOWN:
+            direction = KEY_DIRECTIONS.get(event.key)
 
-            pygame.mixer.music.stop()
+            if direction is not None:
+                self.controls.push(direction, state)
 
-            if new_high_score:
-                screen.fill(BLACK)
+            if event.key == pygame.K_SPACE or event.key == pygame.K_ESCAPE:
+                scene_manager.push(PauseScene())
 
-                if mode == "C" and lang == "en":
-                    new_high_score_menu("C", high_score, "en")
-                elif mode == "C" and lang == "ru":
-                    new_high_score_menu("C", high_score, "ru")
+            # P hands the snake over to the autopilot and back, its search grids cover the whole board
+            # and are only built for screen-sized ones
+            if event.key == pygame.K_p and not self.world:
+                self.autopilot = Autopilot(state) if self.autopilot is None else None
+                self.controls.clear()
 
-                if mode == "M" and lang == "en":
-                    new_high_score_menu("M", high_score, "en")
-                elif mode == "M" and lang == "ru":
-                    new_high_score_menu("M", high_score, "ru")
+            if event.key == pygame.K_q:
+                exit_game()
 
-            else:
-                if mode == "C" and lang == "en":
-                    lose_game_menu("C", "en")
-                elif mode == "C" and lang == "ru":
-                    lose_game_menu("C", "ru")
-
-                if mode == "M" and lang == "en":
-                    lose_game_menu("M", "en")
-                elif mode == "M" and lang == "ru":
-                    lose_game_menu("M", "ru")
-
-            display_current_score(current_score, "ru")
-            display_high_score(high_score, "ru")
-
-            pygame.display.update()
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    game_over = True
-                    game_close = False
-
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_q:
-                        game_over = True
-                        game_close = False
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                game_over = True
-
-            # The snake can be controlled both by the arrows and by using the WASD and numpad keys
-            if event.type == pygame.KEYDOWN:
-                if ((event.key == pygame.K_LEFT or event.key == pygame.K_a or event.key == pygame.K_KP4)
-                        and x1_change != SNAKE_BLOCK):
-                    x1_change = -SNAKE_BLOCK
-                    y1_change = 0
-
-                if ((event.key == pygame.K_RIGHT or event.key == pygame.K_d or event.key == pygame.K_KP6)
-                        and x1_change != -SNAKE_BLOCK):
-                    x1_change = SNAKE_BLOCK
-                    y1_change = 0
-
-                if ((event.key == pygame.K_UP or event.key == pygame.K_w or event.key == pygame.K_KP8)
-                        and y1_change != SNAKE_BLOCK):
-                    x1_change = 0
-                    y1_change = -SNAKE_BLOCK
-
-                if ((event.key == pygame.K_DOWN or event.key == pygame.K_s or event.key == pygame.K_KP2)
-                        and y1_change != -SNAKE_BLOCK):
-                    x1_change = 0
-                    y1_change = SNAKE_BLOCK
-
-                if event.key == pygame.K_SPACE or event.key == pygame.K_ESCAPE:
-                    pause_game()
-
-                if event.key == pygame.K_q:
-                    pygame.quit()
-                    quit()
-
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                pause_game()
-
-        if x1 >= SCREEN_WIDTH:
-            x1 = 0
-        elif x1 < 0:
-            x1 = SCREEN_WIDTH - SNAKE_BLOCK
-
-        if y1 >= SCREEN_HEIGHT:
-            y1 = 0
-        elif y1 < 0:
-            y1 = SCREEN_HEIGHT - SNAKE_BLOCK
-
-        x1 += x1_change
-        y1 += y1_change
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            scene_manager.push(PauseScene())
 
-        if mode == "C":
-            screen.fill(BLACK)
-            draw_hearts()
+    def update(self):
+        global snake_speed, hearts_remaining
+        state = self.state
+
+        # Catch up with as many logic ticks as the elapsed time requires, but drop the backlog
+        # instead of spiralling when even that cannot keep up
+        now = time.perf_counter()
+        self.accumulator += now - self.previous_time
+        self.previous_time = now
+        steps = 0
+
+        while state.alive and state.ticks < self.tick_limit:
+            tick_time = 1 / (state.speed * self.time_scale)
+
+            if self.accumulator < tick_time:
+                break
+
+            self.accumulator -= tick_time
+            self.game_time += 1 / state.speed
+            self.before_step(state)
+            state, events = engine.step(state)
+            steps += 1
+
+            if engine.CRASH in events:
+                sounds.play("end")
 
-            # In this mode you cannot cross the border more than 3 times
-            if x1 >= SCREEN_WIDTH or x1 < 0 or y1 >= SCREEN_HEIGHT or y1 < 0:
-                border_counter += 1
-                hearts_remaining -= 1
+            if engine.EAT in events:
+                if self.mode == "M":
+                    sounds.play("hiss_mh")
+                else:
+                    sounds.play("hiss_ce")
 
-                if hearts_remaining <= 0 or border_counter >= 3:
-                    game_close = True
-                    snake_end_sound.play()
+            if steps >= MAX_STEPS_PER_FRAME:
+                self.accumulator = 0.0
 
-            pygame.draw.circle(
+        profiler.add_ticks(steps, state.speed * self.time_scale)
+        profiler.set_input_latency(*self.controls.latency())
+        snake_speed = state.speed
+        hearts_remaining = state.hearts
+
+        if self.records_scores and state.score > self.high_score:
+            self.high_score = state.score
+            scores.record_high_score(self.board, self.high_score)
+            self.new_high_score = True
+
+        if not state.alive or state.ticks >= self.tick_limit:
+            self.finish()
+
+    def before_step(self, state):
+        if self.autopilot is None:
+            self.controls.apply(state)
+        else:
+            direction = self.autopilot.decide(state)
+
+            if direction is not None:
+                engine.turn(state, direction)
+
+        self.recorder.before_step(state)
+
+    def finish(self):
+        state = self.state
+        scores.submit(self.board, state.score, len(state.body), self.game_time)
+
+        recorded = self.recorder.finish(state)
+        save_replay(recorded)
+
+        if self.new_high_score:
+            save_best_replay(recorded, self.board)
+            scene_manager.replace(new_high_score_menu(self.mode, self.high_score, self.lang, self.variant))
+        else:
+            scene_manager.replace(lose_game_menu(self.mode, self.lang, self.variant))
+
+    def draw_items(self, camera_x=0, camera_y=0):
+        # Food and the bonus, the camera is the top-left corner of the visible part of a world
+        state = self.state
+        bonus_radius = engine.BONUS_RADIUS
+        food_x = state.food[0] * SNAKE_BLOCK - camera_x
+        food_y = state.food[1] * SNAKE_BLOCK - camera_y
+        item_rects = []
+
+        if self.mode == "C":
+            item_rects.append(pygame.draw.circle(
                 screen,
                 WHITE,
                 (food_x + SNAKE_BLOCK // 2, food_y + SNAKE_BLOCK // 2),
-                SNAKE_BLOCK // 2)
+                SNAKE_BLOCK // 2))
 
-            if bonus_active:
-                pygame.draw.circle(
+            if state.bonus is not None:
+                bonus_x = state.bonus[0] * SNAKE_BLOCK - camera_x
+                bonus_y = state.bonus[1] * SNAKE_BLOCK - camera_y
+                item_rects.append(pygame.draw.circle(
                     screen,
-                    random.choice(color_list),
+                    self.color_rng.choice(self.color_list),
                     (int(bonus_x + SNAKE_BLOCK // 2), int(bonus_y + SNAKE_BLOCK // 2)),
                     bonus_radius
-                )
+                ))
         else:
-            bg = pygame.image.load("images/grass.jpg")
-            screen.blit(bg, (0, 0))
-            draw_boundaries()
-
-            if x1 >= SCREEN_WIDTH or x1 < 0 or y1 >= SCREEN_HEIGHT or y1 < 0:
-                game_close = True
-                snake_end_sound.play()
-
-            pygame.draw.circle(
+            item_rects.append(pygame.draw.circle(
                 screen,
-                random.choice(color_list),
+                self.color_rng.choice(self.color_list),
                 (food_x + SNAKE_BLOCK // 2, food_y + SNAKE_BLOCK // 2),
                 SNAKE_BLOCK // 1.5
-            )
+            ))
 
-            if bonus_active:
+            if state.bonus is not None:
+                bonus_x = state.bonus[0] * SNAKE_BLOCK - camera_x
+                bonus_y = state.bonus[1] * SNAKE_BLOCK - camera_y
                 size = bonus_radius * 2
                 points = [
                     (bonus_x, bonus_y + size // 2),
@@ -629,91 +815,497 @@ def run_game_loop(mode, lang="ru"):
                     (bonus_x + size, bonus_y + size // 2),
                     (bonus_x + size // 2, bonus_y + size)
                 ]
-                pygame.draw.polygon(screen, random.choice(color_list), points)
+                item_rects.append(pygame.draw.polygon(screen, self.color_rng.choice(self.color_list), points))
 
-        snake_head = [x1, y1]
-        snake_list.append(snake_head)
+        return item_rects
 
-        if len(snake_list) > length_of_snake:
-            del snake_list[0]
+    def draw_world(self):
+        state = self.state
+        body = state.body
 
-        for segment in snake_list[:-1]:
-            if segment == snake_head:
-                game_close = True
-                snake_end_sound.play()
+        # The camera keeps the head in the middle of the screen until it reaches the edge of the world
+        head_x, head_y = body.head() if len(body) else (state.x, state.y)
+        camera_x = min(max(head_x * SNAKE_BLOCK + SNAKE_BLOCK // 2 - SCREEN_WIDTH // 2, 0),
+                       state.width - SCREEN_WIDTH)
+        camera_y = min(max(head_y * SNAKE_BLOCK + SNAKE_BLOCK // 2 - SCREEN_HEIGHT // 2, 0),
+                       state.height - SCREEN_HEIGHT)
 
-        draw_snake(SNAKE_BLOCK, snake_list)
+        self.world_layer.update(body)
+        profiler.lap("snake")
 
-        if lang == "ru":
-            display_current_score(current_score, "ru")
-            display_high_score(high_score, "ru")
-        elif lang == "en":
-            display_current_score(current_score, "en")
-            display_high_score(high_score, "en")
+        self.world_layer.draw(screen, camera_x, camera_y, body)
+        self.draw_items(camera_x, camera_y)
+        self.draw_food_marker(camera_x, camera_y)
+        profiler.lap("background")
 
-        if x1 == food_x and y1 == food_y:
-            food_x = round(random.randrange(60, SCREEN_WIDTH - 60) / 10.0) * 10.0
-            food_y = round(random.randrange(60, SCREEN_HEIGHT - 60) / 10.0) * 10.0
+        if self.lang == "ru":
+            display_current_score(state.score, "ru")
+            display_high_score(self.high_score, "ru")
+        elif self.lang == "en":
+            display_current_score(state.score, "en")
+            display_high_score(self.high_score, "en")
 
-            length_of_snake += growth_step
-            current_score += growth_step
-            bonus_ball_counter += 1
+        if self.mode == "C":
+            draw_hearts(screen, state.hearts)
 
-            if bonus_ball_counter >= bonus_threshold and not bonus_active:
-                bonus_x = round(random.randrange(60, SCREEN_WIDTH - 60) / 10.0) * 10.0
-                bonus_y = round(random.randrange(60, SCREEN_HEIGHT - 60) / 10.0) * 10.0
-                bonus_active = True
-                bonus_ball_counter = 0
+        profiler.lap("hud")
+        profiler.draw_overlay(screen, font_style)
 
-            if mode == "M":
-                # In this mode the score counter increases in an arithmetic progression
-                growth_step += 2
-                snake_hiss_mh_sound.play()
+        # The picture moves with the camera, so the whole screen is pushed
+        display.present()
 
-            if mode == "C":
-                snake_hiss_ce_sound.play()
+    def draw_food_marker(self, camera_x, camera_y):
+        # Food outside the screen is shown by a marker on the edge of the screen in its direction
+        food_x = self.state.food[0] * SNAKE_BLOCK + SNAKE_BLOCK // 2 - camera_x
+        food_y = self.state.food[1] * SNAKE_BLOCK + SNAKE_BLOCK // 2 - camera_y
 
-            # The snake speed increases with every eaten food
-            if snake_speed < 60 and mode == "C":
-                snake_speed += 0.75
-            elif snake_speed < 600 and mode == "M":
-                snake_speed += 2
+        if 0 <= food_x < SCREEN_WIDTH and 0 <= food_y < SCREEN_HEIGHT:
+            return
 
-        if bonus_active:
-            bonus_center_x = bonus_x + bonus_radius
-            bonus_center_y = bonus_y + bonus_radius
+        marker_x = min(max(food_x, FOOD_MARKER_INSET), SCREEN_WIDTH - FOOD_MARKER_INSET)
+        marker_y = min(max(food_y, FOOD_MARKER_INSET), SCREEN_HEIGHT - FOOD_MARKER_INSET)
+        pygame.draw.circle(screen, YELLOW, (marker_x, marker_y), SNAKE_BLOCK // 2)
 
-            snake_center_x = x1 + SNAKE_BLOCK // 2
-            snake_center_y = y1 + SNAKE_BLOCK // 2
+    def draw(self):
+        state = self.state
+        dirty = self.dirty
 
-            distance = math.hypot(snake_center_x - bonus_center_x, snake_center_y - bonus_center_y)
+        if self.world:
+            self.draw_world()
+            return
 
-            if distance < bonus_radius + SNAKE_BLOCK // 2:
-                bonus_active = False
+        # Cells the head entered and the tail left since the previous frame
+        body = state.body
 
-                if mode == "C":
-                    bonus_reduction_ce = 3
-                    length_of_snake = max(1, length_of_snake - bonus_reduction_ce)
-                    del snake_list[:min(bonus_reduction_ce, len(snake_list))]
+        if body.head_seq - self.drawn_tail_seq > body.capacity:
+            dirty.invalidate()
+        else:
+            dirty.add_cells(body.segments(self.drawn_head_seq, body.head_seq), SNAKE_BLOCK)
+            dirty.add_cells(body.segments(self.drawn_tail_seq, body.tail_seq), SNAKE_BLOCK)
 
-                elif mode == "M":
-                    new_length = max(1, length_of_snake // 2)
-                    bonus_reduction_mh = length_of_snake - new_length
-                    length_of_snake = new_length
-                    del snake_list[:min(bonus_reduction_mh, len(snake_list))]
+        self.drawn_head_seq = body.head_seq
+        self.drawn_tail_seq = body.tail_seq
 
-        if current_score > high_score:
-            high_score = current_score
-            save_high_score(high_score, mode)
-            new_high_score = True
+        background, hearts_rect = background_layer(self.mode, state.hearts)
+        playfield = self.snake_layer.update(background, body)
+        profiler.lap("snake")
 
-        pygame.display.update()
-        clock.tick(snake_speed)
+        screen.blit(playfield, (0, 0))
+        item_rects = self.draw_items()
 
-    pygame.quit()
-    quit()
+        # The snake stays on top of the items drawn over the layer
+        for rect in item_rects:
+            dirty.track(rect)
+            self.snake_layer.repaint(screen, rect, body)
+
+        profiler.lap("background")
+
+        if INTERPOLATE and state.alive and len(body):
+            progress = min(self.accumulator * state.speed * self.time_scale, 1.0)
+            head_x, head_y = body.head()
+            dirty.track(pygame.draw.rect(screen, WHITE, [
+                head_x * SNAKE_BLOCK + round(state.dx * SNAKE_BLOCK * progress),
+                head_y * SNAKE_BLOCK + round(state.dy * SNAKE_BLOCK * progress),
+                SNAKE_BLOCK, SNAKE_BLOCK
+            ]))
+            profiler.lap("snake")
+
+        if self.lang == "ru":
+            hud_rects = [display_current_score(state.score, "ru"), display_high_score(self.high_score, "ru")]
+        elif self.lang == "en":
+            hud_rects = [display_current_score(state.score, "en"), display_high_score(self.high_score, "en")]
+
+        if hearts_rect:
+            hud_rects.append(hearts_rect)
+
+        # The score texts and hearts are pushed only when they change
+        hud = (state.score, self.high_score, state.hearts)
+
+        if hud != self.shown_hud:
+            for rect in self.shown_hud_rects + hud_rects:
+                dirty.add(rect)
+
+            self.shown_hud = hud
+            self.shown_hud_rects = hud_rects
+
+        profiler.lap("hud")
+        overlay_rect = profiler.draw_overlay(screen, font_style)
+
+        if overlay_rect:
+            dirty.track(overlay_rect)
+
+        if DIRTY_RECTS:
+            dirty.present()
+        else:
+            display.present()
+
+
+class ReplayScene(GameScene):
+    # Plays a recorded game back at 1x-16x speed, [ and ] change the speed
+    records_scores = False
+
+    def __init__(self, recorded, lang="ru", time_scale=1):
+        super().__init__(recorded.mode, lang, recorded.new_state(), recorded.seed)
+        self.player = ReplayPlayer(recorded)
+        self.time_scale = time_scale
+        self.tick_limit = recorded.ticks
+
+    def handle_event(self, event):
+        if event.type == pygame.QUIT:
+            exit_game()
+
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_RIGHTBRACKET:
+                self.time_scale = min(self.time_scale * 2, MAX_REPLAY_SPEED)
+
+            elif event.key == pygame.K_LEFTBRACKET:
+                self.time_scale = max(self.time_scale // 2, 1)
+
+            elif event.key == pygame.K_SPACE or event.key == pygame.K_ESCAPE:
+                scene_manager.push(PauseScene())
+
+            elif event.key == pygame.K_q:
+                exit_game()
+
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            scene_manager.push(PauseScene())
+
+    def before_step(self, state):
+        self.player.before_step(state)
+
+    def finish(self):
+        scene_manager.pop()
+
+
+class ArenaScene(Scene):
+    frame_rate = RENDER_FPS
+
+    def __init__(self, mode, lang="ru"):
+        self.mode = mode
+        self.lang = lang
+        self.board = mode + "A"
+        self.new_high_score = False
+        self.arena = Arena(mode, SCREEN_WIDTH, SCREEN_HEIGHT, ARENA_SNAKES, players=1, seed=new_seed())
+        self.player = self.arena.snakes[0]
+        self.controls = DirectionQueue()
+
+        self.high_score = scores.high_score(self.board)
+        self.accumulator = 0.0
+        self.game_time = 0.0
+        self.previous_time = time.perf_counter()
+
+        # Bodies are painted on a layer cell by cell as the arena reports the changes
+        if mode == "C":
+            self.background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+            self.background.fill(BLACK)
+        else:
+            self.background = background_layer(mode, None)[0]
+
+        self.layer = self.background.copy()
+        self.tiles = []
+
+        for snake in self.arena.snakes:
+            tile = pygame.Surface((SNAKE_BLOCK, SNAKE_BLOCK)).convert()
+            tile.fill(WHITE if snake.player else ARENA_COLORS[snake.index % len(ARENA_COLORS)])
+            self.tiles.append(tile)
+
+    def enter(self):
+        sounds.play_music(music_ce if self.mode == "C" else music_mh, 0.5)
+        self.previous_time = time.perf_counter()
+
+    def exit(self):
+        sounds.stop_music()
+
+    def resume(self):
+        self.previous_time = time.perf_counter()
+
+    def handle_event(self, event):
+        if event.type == pygame.QUIT:
+            exit_game()
+
+        if event.type == pygame.KEYDOWN:
+            direction = KEY_DIRECTIONS.get(event.key)
+
+            if direction is not None:
+                self.controls.push(direction, self.player)
+
+            if event.key == pygame.K_SPACE or event.key == pygame.K_ESCAPE:
+                scene_manager.push(PauseScene())
+
+            if event.key == pygame.K_q:
+                exit_game()
+
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            scene_manager.push(PauseScene())
+
+    def update(self):
+        player = self.player
+        now = time.perf_counter()
+        self.accumulator += now - self.previous_time
+        self.previous_time = now
+        steps = 0
+
+        while player.alive and self.accumulator >= 1 / ARENA_SPEED:
+            self.accumulator -= 1 / ARENA_SPEED
+            self.game_time += 1 / ARENA_SPEED
+            self.controls.apply(player)
+            steps += 1
+
+            for snake, event in self.arena.step():
+                if snake is not player:
+                    continue
+
+                if event == engine.CRASH:
+                    sounds.play("end")
+                elif event == engine.EAT:
+                    sounds.play("hiss_ce" if self.mode == "C" else "hiss_mh")
+
+            if steps >= MAX_STEPS_PER_FRAME:
+                self.accumulator = 0.0
+
+        profiler.add_ticks(steps, ARENA_SPEED)
+
+        if player.score > self.high_score:
+            self.high_score = player.score
+            scores.record_high_score(self.board, self.high_score)
+            self.new_high_score = True
+
+        if not player.alive:
+            self.finish()
+
+    def finish(self):
+        scores.submit(self.board, self.player.score, self.player.length, self.game_time)
+
+        if self.new_high_score:
+            scene_manager.replace(new_high_score_menu(self.mode, self.high_score, self.lang, "arena"))
+        else:
+            scene_manager.replace(lose_game_menu(self.mode, self.lang, "arena"))
+
+    def draw(self):
+        changes = self.arena.changes
+        blits = []
+
+        for x, y, owner in changes:
+            position = (x * SNAKE_BLOCK, y * SNAKE_BLOCK)
+
+            if owner == NO_OWNER:
+                blits.append((self.background, position, (position, (SNAKE_BLOCK, SNAKE_BLOCK))))
+            else:
+                blits.append((self.tiles[owner], position))
+
+        changes.clear()
+        self.arena.item_changes.clear()
+        self.layer.blits(blits, doreturn=False)
+        profiler.lap("snake")
+
+        screen.blit(self.layer, (0, 0))
+
+        for food_x, food_y in self.arena.foods:
+            pygame.draw.circle(screen, WHITE, (food_x * SNAKE_BLOCK + SNAKE_BLOCK // 2,
+                                               food_y * SNAKE_BLOCK + SNAKE_BLOCK // 2), SNAKE_BLOCK // 2)
+
+        for bonus_x, bonus_y in self.arena.bonuses:
+            pygame.draw.circle(screen, YELLOW, (bonus_x * SNAKE_BLOCK + SNAKE_BLOCK // 2,
+                                                bonus_y * SNAKE_BLOCK + SNAKE_BLOCK // 2), engine.BONUS_RADIUS)
+
+        profiler.lap("background")
+
+        if self.lang == "ru":
+            display_current_score(self.player.score, "ru")
+            display_high_score(self.high_score, "ru")
+        elif self.lang == "en":
+            display_current_score(self.player.score, "en")
+            display_high_score(self.high_score, "en")
+
+        if self.mode == "C":
+            draw_hearts(screen, self.player.hearts)
+
+        profiler.lap("hud")
+        profiler.draw_overlay(screen, font_style)
+        display.present()
+
+
+class NetworkScene(ArenaScene):
+    # A room of the multiplayer server. The server runs the rules, the scene only sends the turns and
+    # paints the cells it is told about, so there is no high score to keep and death just waits for
+    # the respawn
+    def __init__(self, host, port, room, mode, lang="ru"):
+        # A server that cannot be reached, times out or hangs up before the welcome raises OSError
+        self.lang = lang
+        self.connection = socket.create_connection((host, port), timeout=NETWORK_TIMEOUT)
+        self.frames = protocol.FrameReader()
+        self.seq = 0
+
+        welcome = []
+
+        try:
+            self.connection.sendall(protocol.frame(protocol.JOIN, mode.encode() + room.encode()))
+
+            while not welcome:
+                data = self.connection.recv(65536)
+
+                if not data:
+                    raise ConnectionError("the server closed the connection")
+
+                welcome = self.frames.feed(data)
+        except OSError:
+            self.connection.close()
+            raise
+
+        index, cols, rows, mode, _, slots = protocol.WELCOME_BODY.unpack(welcome[0][1])
+        self.mode = mode.decode()
+        self.connection.setblocking(False)
+
+        if (cols * SNAKE_BLOCK, rows * SNAKE_BLOCK) != (SCREEN_WIDTH, SCREEN_HEIGHT):
+            set_logical_size(cols * SNAKE_BLOCK, rows * SNAKE_BLOCK)
+
+        self.arena = protocol.Mirror()
+        self.player = self.arena.snake(index)
+        self.high_score = 0
+
+        for kind, payload in welcome[1:]:
+            self.arena.apply(kind, payload)
+
+        if self.mode == "C":
+            self.background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+            self.background.fill(BLACK)
+        else:
+            self.background = background_layer(self.mode, None)[0]
+
+        self.layer = self.background.copy()
+        self.tiles = []
+
+        for snake_index in range(slots):
+            tile = pygame.Surface((SNAKE_BLOCK, SNAKE_BLOCK)).convert()
+            tile.fill(WHITE if snake_index == index else ARENA_COLORS[snake_index % len(ARENA_COLORS)])
+            self.tiles.append(tile)
+
+    def exit(self):
+        sounds.stop_music()
+        self.connection.close()
+
+    def resume(self):
+        pass
+
+    def handle_event(self, event):
+        if event.type == pygame.QUIT:
+            exit_game()
+
+        if event.type == pygame.KEYDOWN:
+            direction = KEY_DIRECTIONS.get(event.key)
+
+            if direction is not None:
+                self.seq += 1
+                self.send(protocol.frame(protocol.TURN, protocol.TURN_BODY.pack(self.seq, DIRECTIONS.index(direction))))
+
+            if event.key == pygame.K_SPACE or event.key == pygame.K_ESCAPE:
+                scene_manager.push(PauseScene())
+
+            if event.key == pygame.K_q:
+                exit_game()
+
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            scene_manager.push(PauseScene())
+
+    def send(self, message):
+        # A lost connection is noticed by the next update
+        try:
+            self.connection.sendall(message)
+        except OSError:
+            pass
+
+    def update(self):
+        score = self.player.score
+        data = b""
+
+        try:
+            while True:
+                chunk = self.connection.recv(65536)
+
+                if not chunk:
+                    scene_manager.reset(main_menu(self.lang))
+                    return
+
+                data += chunk
+        except BlockingIOError:
+            pass
+        except OSError:
+            scene_manager.reset(main_menu(self.lang))
+            return
+
+        for kind, payload in self.frames.feed(data):
+            self.arena.apply(kind, payload)
+
+        if self.arena.reset:
+            # A keyframe lists every cell again, they are painted on a clean layer
+            self.arena.reset = False
+            self.layer = self.background.copy()
+
+        if self.player.score > score:
+            sounds.play("hiss_ce" if self.mode == "C" else "hiss_mh")
+
+        self.high_score = max(self.high_score, self.player.score)
+
+
+scene_manager = SceneManager()
+scene_manager.on_resize = window_resized
 
 
 if __name__ == "__main__":
-    clock = pygame.time.Clock()
-    run_main_menu("ru")
+    parser = argparse.ArgumentParser(description="Snake")
+    parser.add_argument("--replay", help="play back a replay file from saves/replays")
+    parser.add_argument("--replay-speed", type=int, default=1, choices=[1, 2, 4, 8, 16])
+    parser.add_argument("--profile-csv", help="write per-frame phase timings to this CSV file, F3 shows them")
+    parser.add_argument("--connect", metavar="HOST:PORT", help="play in a room of a multiplayer server")
+    parser.add_argument("--room", default="lobby", help="room to join with --connect")
+    parser.add_argument("--mode", default="C", choices=["C", "M"], help="rules of the room with --connect")
+    parser.add_argument("--startup-report", action="store_true", help="print the startup timeline")
+    parser.add_argument("--startup-only", action="store_true",
+                        help="quit after the first frame, the exit code tells whether startup fit the budget")
+    args = parser.parse_args()
+
+    if args.startup_report or args.startup_only:
+        def report_startup():
+            if args.startup_report:
+                print(startup.report())
+
+            if args.startup_only:
+                scene_manager.quit()
+
+        startup.on_finish = report_startup
+
+    if args.profile_csv:
+        profiler.enable(args.profile_csv)
+        atexit.register(profiler.close)
+
+    if args.connect:
+        host, _, port = args.connect.rpartition(":")
+
+        if not host or not port.isdigit():
+            parser.error(f"--connect takes HOST:PORT, not {args.connect!r}")
+
+        try:
+            network_scene = NetworkScene(host, int(port), args.room, args.mode, "ru")
+        except OSError as error:
+            sys.exit(f"Could not join {args.connect}: {error}")
+
+        scene_manager.push(main_menu("ru"))
+        scene_manager.push(network_scene)
+    elif args.replay:
+        recorded_game = Replay.load(args.replay)
+
+        # A world replay is seen through the camera like the game was, only a screen-sized board
+        # of another size than this one changes the drawing surface
+        if max(recorded_game.width, recorded_game.height) < WORLD_CELLS * SNAKE_BLOCK:
+            set_logical_size(recorded_game.width, recorded_game.height)
+
+        scene_manager.push(main_menu("ru"))
+        scene_manager.push(ReplayScene(recorded_game, "ru", args.replay_speed))
+    else:
+        scene_manager.push(main_menu("ru"))
+
+    startup.mark("menus")
+    scene_manager.run()
+
+    if args.startup_only:
+        sys.exit(1 if startup.total() > STARTUP_BUDGET else 0)
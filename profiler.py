@@ -0,0 +1,235 @@
+import csv
+import time
+from collections import deque
+
+import pygame
+
+# Phases of a frame in the order SceneManager.run and the scenes go through them
+PHASES = ["events", "logic", "background", "snake", "hud", "display", "wait"]
+
+STARTUP_BUDGET = 0.5
+
+HISTORY = 60
+OVERLAY_REFRESH = 0.5
+OVERLAY_COLOR = (255, 255, 0)
+OVERLAY_BACKGROUND = (0, 0, 0, 170)
+
+
+class FrameProfiler:
+    # Splits every frame into phases: each lap() charges the time since the previous lap to a phase.
+    # While disabled lap() and the other hooks return right after one attribute check.
+    def __init__(self):
+        self.enabled = False
+        self.overlay = False
+        self.history = deque(maxlen=HISTORY)
+        self.frame = dict.fromkeys(PHASES, 0.0)
+        self.frame_start = 0.0
+        self.last = 0.0
+        self.scene_name = ""
+        self.ticks = 0
+        self.target_hz = 0.0
+        self.input_latency = (0.0, 0.0)
+        self.pixels = 0
+        self.frame_index = 0
+
+        # name -> cache with a stats() of hits and misses, counted per frame
+        self.caches = {}
+        self.cache_start = {}
+
+        self.csv_file = None
+        self.csv_writer = None
+
+        self.overlay_surface = None
+        self.overlay_time = 0.0
+
+    def watch(self, name, cache):
+        # Has to come before enable() for the cache to get its columns in the CSV dump
+        self.caches[name] = cache
+
+    def enable(self, csv_path=None):
+        self.enabled = True
+
+        if csv_path and self.csv_file is None:
+            self.csv_file = open(csv_path, "w", newline="")
+            self.csv_writer = csv.writer(self.csv_file)
+            self.csv_writer.writerow(["frame", "scene", "ticks", "target_hz"]
+                                     + [phase + "_ms" for phase in PHASES] + ["total_ms", "pixels"]
+                                     + [f"{name}_{kind}" for name in self.caches for kind in ("hits", "misses")])
+
+    def close(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+            self.csv_writer = None
+
+    def toggle_overlay(self):
+        # The overlay needs timings, but a CSV dump keeps the profiler on after the overlay is hidden
+        self.overlay = not self.overlay
+        self.enabled = self.overlay or self.csv_writer is not None
+        self.overlay_surface = None
+        self.history.clear()
+
+        # The frame in progress started while the profiler may have been off
+        self.frame = dict.fromkeys(PHASES, 0.0)
+        self.frame_start = self.last = time.perf_counter()
+
+    def begin_frame(self, scene):
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        self.frame = dict.fromkeys(PHASES, 0.0)
+        self.frame_start = now
+        self.last = now
+        self.scene_name = type(scene).__name__
+        self.ticks = 0
+        self.pixels = 0
+        self.cache_start = {name: cache.stats() for name, cache in self.caches.items()}
+
+    def lap(self, phase):
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        self.frame[phase] += now - self.last
+        self.last = now
+
+    def add_ticks(self, count, target_hz):
+        if not self.enabled:
+            return
+
+        self.ticks += count
+        self.target_hz = target_hz
+
+    def add_pixels(self, count):
+        # Pixels pushed to the display during the frame
+        if not self.enabled:
+            return
+
+        self.pixels += count
+
+    def set_input_latency(self, median, worst):
+        if not self.enabled:
+            return
+
+        self.input_latency = (median, worst)
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+
+        total = time.perf_counter() - self.frame_start
+        lookups = {}
+
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            start = self.cache_start.get(name, stats)
+            lookups[name] = (stats["hits"] - start["hits"], stats["misses"] - start["misses"])
+
+        self.history.append((total, self.ticks, self.frame, self.pixels, lookups))
+        self.frame_index += 1
+
+        if self.csv_writer is not None:
+            self.csv_writer.writerow([self.frame_index, self.scene_name, self.ticks, self.target_hz]
+                                     + [round(self.frame[phase] * 1000, 4) for phase in PHASES]
+                                     + [round(total * 1000, 4), self.pixels]
+                                     + [count for name in self.caches for count in lookups.get(name, (0, 0))])
+
+    def summary(self):
+        # FPS, logic ticks per second, average milliseconds per phase and average pixels pushed per
+        # frame over the recent frames
+        elapsed = sum(total for total, _, _, _, _ in self.history)
+
+        if not elapsed:
+            return 0.0, 0.0, dict.fromkeys(PHASES, 0.0), 0.0
+
+        frames = len(self.history)
+        ticks = sum(frame_ticks for _, frame_ticks, _, _, _ in self.history)
+        phases = {phase: sum(frame[phase] for _, _, frame, _, _ in self.history) * 1000 / frames
+                  for phase in PHASES}
+        pixels = sum(frame_pixels for _, _, _, frame_pixels, _ in self.history) / frames
+        return frames / elapsed, ticks / elapsed, phases, pixels
+
+    def cache_summary(self):
+        # Hit rate and misses of every watched cache over the recent frames
+        result = {}
+
+        for name in self.caches:
+            hits = sum(lookups.get(name, (0, 0))[0] for _, _, _, _, lookups in self.history)
+            misses = sum(lookups.get(name, (0, 0))[1] for _, _, _, _, lookups in self.history)
+            result[name] = (hits / (hits + misses) if hits + misses else 1.0, misses)
+
+        return result
+
+    def draw_overlay(self, surface, font):
+        # The text changes every frame, so it is rendered at most every OVERLAY_REFRESH seconds
+        if not self.overlay:
+            return None
+
+        now = time.perf_counter()
+
+        if self.overlay_surface is None or now - self.overlay_time >= OVERLAY_REFRESH:
+            fps, logic_hz, phases, pixels = self.summary()
+            last_pixels = self.history[-1][3] if self.history else 0
+            lines = [f"FPS {fps:.1f}", f"logic {logic_hz:.1f} Hz / speed {self.target_hz:g}",
+                     f"key to move {self.input_latency[0] * 1000:.1f} ms, max {self.input_latency[1] * 1000:.1f} ms",
+                     f"pushed {last_pixels} px, average {pixels:.0f} px/frame"]
+            lines += [f"{phase} {phases[phase]:.2f} ms" for phase in PHASES]
+            lines += [f"{name} cache {rate:.1%} hits, {misses} misses"
+                      for name, (rate, misses) in self.cache_summary().items()]
+
+            rendered = [font.render(line, True, OVERLAY_COLOR) for line in lines]
+            width = max(text.get_width() for text in rendered) + 10
+            height = sum(text.get_height() for text in rendered) + 10
+
+            self.overlay_surface = pygame.Surface((width, height), pygame.SRCALPHA)
+            self.overlay_surface.fill(OVERLAY_BACKGROUND)
+            y = 5
+
+            for text in rendered:
+                self.overlay_surface.blit(text, (5, y))
+                y += text.get_height()
+
+            self.overlay_time = now
+
+        return surface.blit(self.overlay_surface, (10, 50))
+
+
+class StartupTimeline:
+    # Seconds from the import of this module to every startup step, up to the first drawn frame
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+        self.done = False
+        self.on_finish = None
+
+    def mark(self, name):
+        if not self.done:
+            self.marks.append((name, time.perf_counter() - self.start))
+
+    def finish(self):
+        if not self.done:
+            self.mark("first frame")
+            self.done = True
+
+            if self.on_finish is not None:
+                self.on_finish()
+
+    def total(self):
+        return self.marks[-1][1] if self.marks else 0.0
+
+    def report(self, budget=STARTUP_BUDGET):
+        lines = []
+        previous = 0.0
+
+        for name, at in self.marks:
+            lines.append(f"{at * 1000:8.1f} ms  +{(at - previous) * 1000:7.1f} ms  {name}")
+            previous = at
+
+        verdict = "within" if self.total() <= budget else "OVER"
+        lines.append(f"Startup {self.total() * 1000:.1f} ms, {verdict} the budget of {budget * 1000:.0f} ms")
+        return "\n".join(lines)
+
+
+profiler = FrameProfiler()
+startup = StartupTimeline()
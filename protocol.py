@@ -0,0 +1,151 @@
+import struct
+
+# Messages between the game server and its clients: a frame is a HEADER (payload length, type)
+# followed by the payload, all little-endian.
+
+# --- Client messages ---
+JOIN = 1  # mode (1 byte), room name (utf-8)
+TURN = 2  # input sequence number, direction index
+LEAVE = 3
+
+# --- Server messages ---
+WELCOME = 10  # player index, cols, rows, mode, tick rate, players per room
+KEYFRAME = 11  # tick, acknowledged input, then a body with the whole room
+DELTA = 12  # tick, acknowledged input, then a body with what changed during the tick
+
+HEADER = struct.Struct("<IB")
+TURN_BODY = struct.Struct("<IB")
+WELCOME_BODY = struct.Struct("<HHHcHH")
+TICK_HEAD = struct.Struct("<II")
+
+# A body is three counted lists: cells (x, y, owner or -1 when freed), items (kind, x, y, present)
+# and snakes (index, score, hearts, alive)
+COUNT = struct.Struct("<I")
+CELL = struct.Struct("<hhh")
+ITEM = struct.Struct("<Bhh?")
+SNAKE = struct.Struct("<HIB?")
+
+MAX_PAYLOAD = 1 << 24
+
+
+def frame(kind, payload=b""):
+    return HEADER.pack(len(payload), kind) + payload
+
+
+def encode_body(cells, items, snakes):
+    parts = [COUNT.pack(len(cells))]
+    parts.extend(CELL.pack(*cell) for cell in cells)
+    parts.append(COUNT.pack(len(items)))
+    parts.extend(ITEM.pack(*item) for item in items)
+    parts.append(COUNT.pack(len(snakes)))
+    parts.extend(SNAKE.pack(*snake) for snake in snakes)
+    return b"".join(parts)
+
+
+def decode_body(payload, offset=0):
+    lists = []
+
+    for record in (CELL, ITEM, SNAKE):
+        count, = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        end = offset + count * record.size
+        lists.append(list(record.iter_unpack(payload[offset:end])))
+        offset = end
+
+    return lists
+
+
+class FrameReader:
+    # Splits a byte stream into (type, payload) frames, for clients reading a socket in pieces
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        offset = 0
+
+        while len(self.buffer) - offset >= HEADER.size:
+            length, kind = HEADER.unpack_from(self.buffer, offset)
+
+            if length > MAX_PAYLOAD:
+                raise ValueError(f"Frame of {length} bytes")
+
+            if len(self.buffer) - offset - HEADER.size < length:
+                break
+
+            start = offset + HEADER.size
+            frames.append((kind, bytes(self.buffer[start:start + length])))
+            offset = start + length
+
+        del self.buffer[:offset]
+        return frames
+
+
+class RemoteSnake:
+    def __init__(self):
+        self.score = 0
+        self.hearts = 0
+        self.alive = False
+
+
+class Mirror:
+    # A client's copy of a room, built from a keyframe and kept up to date by the deltas. Like
+    # Arena.changes, changes collects the cells to repaint, and reset tells that the picture has
+    # to be built again from cells after a keyframe.
+    def __init__(self):
+        self.cells = {}
+        self.foods = set()
+        self.bonuses = set()
+        self.snakes = {}
+        self.changes = []
+        self.item_changes = []
+        self.reset = False
+        self.tick = 0
+        self.acked = 0
+
+    def apply(self, kind, payload):
+        self.tick, self.acked = TICK_HEAD.unpack_from(payload)
+        cells, items, snakes = decode_body(payload, TICK_HEAD.size)
+
+        if kind == KEYFRAME:
+            self.cells.clear()
+            self.foods.clear()
+            self.bonuses.clear()
+            self.changes.clear()
+            self.item_changes.clear()
+            self.reset = True
+
+        for x, y, owner in cells:
+            if owner < 0:
+                self.cells.pop((x, y), None)
+            else:
+                self.cells[x, y] = owner
+
+        self.changes.extend(cells)
+        self.item_changes.extend(items)
+
+        for item_kind, x, y, present in items:
+            items_set = self.foods if item_kind == 0 else self.bonuses
+
+            if present:
+                items_set.add((x, y))
+            else:
+                items_set.discard((x, y))
+
+        for index, score, hearts, alive in snakes:
+            snake = self.snake(index)
+            snake.score = score
+            snake.hearts = hearts
+            snake.alive = alive
+
+    def snake(self, index):
+        if index not in self.snakes:
+            self.snakes[index] = RemoteSnake()
+
+        return self.snakes[index]
+
+    def full_size(self):
+        # Bytes a full snapshot of the room would take, to compare the deltas with
+        return (HEADER.size + TICK_HEAD.size + 3 * COUNT.size + len(self.cells) * CELL.size +
+                (len(self.foods) + len(self.bonuses)) * ITEM.size + len(self.snakes) * SNAKE.size)
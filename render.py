@@ -0,0 +1,342 @@
+from collections import OrderedDict
+
+import pygame
+
+from profiler import profiler
+
+# More changed cells than this in one frame are cheaper to push as a single full update
+MAX_DIRTY_CELLS = 256
+
+# Worlds are drawn in square chunks of this many cells, the most recently seen ones stay built
+CHUNK_CELLS = 16
+MAX_CHUNKS = 128
+
+
+class Display:
+    # The game draws on surface, which keeps one logical size whatever the window is. In a window of
+    # that size the surface is the window itself and changed rects go straight to the display. In a
+    # window of any other size, or fullscreen, the surface is scaled in one pass into the largest rect
+    # of its proportions that fits, with black bars around it, so drawing costs the same in any window.
+    def __init__(self, logical_size):
+        self.logical_size = logical_size
+        self.window = None
+        self.surface = None
+        self.target = None
+        self.scaled = None
+        self.fullscreen = False
+        self.full = True
+        self.frames = 0
+        self.pixels = 0
+        self.total_pixels = 0
+
+    def set_window(self, size, fullscreen=False):
+        # Fullscreen takes the size of the desktop
+        self.fullscreen = fullscreen
+
+        if fullscreen:
+            self.window = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+        else:
+            self.window = pygame.display.set_mode(size, pygame.RESIZABLE)
+
+            # Right after fullscreen SDL may keep the desktop size for the first call
+            if self.window.get_size() != tuple(size):
+                self.window = pygame.display.set_mode(size, pygame.RESIZABLE)
+
+        return self.layout()
+
+    def set_logical_size(self, size):
+        self.logical_size = size
+        return self.layout()
+
+    def layout(self):
+        # Also called when the window was resized, the window surface then already has its new size.
+        # Returns the surface to draw on, which may be another one than before.
+        width, height = self.window.get_size()
+        logical_width, logical_height = self.logical_size
+        self.full = True
+
+        if (width, height) == self.logical_size:
+            self.surface = self.window
+            self.target = self.window.get_rect()
+            self.scaled = None
+            return self.surface
+
+        if self.surface is None or self.surface is self.window or self.surface.get_size() != self.logical_size:
+            self.surface = pygame.Surface(self.logical_size).convert()
+
+        scale = min(width / logical_width, height / logical_height)
+        self.target = pygame.Rect(0, 0, round(logical_width * scale), round(logical_height * scale))
+        self.target.center = (width // 2, height // 2)
+        self.window.fill((0, 0, 0))
+        self.scaled = self.window.subsurface(self.target)
+        return self.surface
+
+    def present(self, rects=None):
+        # rects None pushes the whole surface. Returns the window rects that went to the display, which
+        # are counted as the pixels pushed: in a scaled window that is always the whole target.
+        if self.scaled is not None:
+            pygame.transform.scale(self.surface, self.target.size, self.scaled)
+            rects = None if self.full else [self.target]
+        elif self.full:
+            rects = None
+
+        if rects is None:
+            pygame.display.update()
+            rects = [self.window.get_rect()]
+        else:
+            pygame.display.update(rects)
+
+        self.pixels = sum(rect.width * rect.height for rect in rects)
+        self.total_pixels += self.pixels
+        self.frames += 1
+        profiler.add_pixels(self.pixels)
+        self.full = False
+        return rects
+
+    def stats(self):
+        average = self.total_pixels / self.frames if self.frames else 0
+        window_pixels = self.window.get_width() * self.window.get_height() if self.window else 0
+        return {"frames": self.frames, "pixels": self.pixels, "total_pixels": self.total_pixels,
+                "average_pixels": average, "window_pixels": window_pixels}
+
+    def to_logical(self, position):
+        # Window coordinates, of the mouse for example, on the logical surface
+        x, y = position
+        return ((x - self.target.x) * self.logical_size[0] // self.target.width,
+                (y - self.target.y) * self.logical_size[1] // self.target.height)
+
+
+class DirtyRects:
+    # Collects the screen regions that changed during a frame and pushes only those to the display.
+    # Tracked rects (objects that may move or disappear) are pushed again on the next frame, so their
+    # old position is refreshed as well.
+    def __init__(self, display):
+        self.display = display
+        self.screen_rect = pygame.Rect((0, 0), display.logical_size)
+        self.rects = []
+        self.tracked = []
+        self.previous = []
+        self.full = True
+
+    def invalidate(self):
+        self.full = True
+
+    def add(self, rect):
+        self.rects.append(pygame.Rect(rect))
+
+    def track(self, rect):
+        self.tracked.append(pygame.Rect(rect))
+
+    def add_cells(self, cells, block_size):
+        if len(cells) > MAX_DIRTY_CELLS:
+            self.full = True
+            return
+
+        for x, y in cells:
+            self.rects.append(pygame.Rect(x * block_size, y * block_size, block_size, block_size))
+
+    def present(self):
+        # The pixels pushed are counted by the display, which may push more than these rects
+        if self.full:
+            self.display.present()
+        else:
+            rects = []
+
+            for rect in self.rects + self.tracked + self.previous:
+                rect = rect.clip(self.screen_rect)
+
+                if rect.width and rect.height:
+                    rects.append(rect)
+
+            self.display.present(rects)
+
+        self.previous = self.tracked
+        self.tracked = []
+        self.rects = []
+        self.full = False
+
+
+class SnakeLayer:
+    # The static background with the snake painted on it. Every frame only the cells the head entered
+    # get a segment tile and the cells the tail left get their background back, so drawing the snake
+    # costs the same for any length. The layer is repainted whole when the background changes.
+    def __init__(self, block_size, color):
+        self.block_size = block_size
+        self.tile = pygame.Surface((block_size, block_size)).convert()
+        self.tile.fill(color)
+        self.background = None
+        self.surface = None
+        self.head_seq = 0
+        self.tail_seq = 0
+
+    def update(self, background, body):
+        block = self.block_size
+
+        if background is not self.background or body.head_seq - self.tail_seq > body.capacity:
+            self.background = background
+            self.surface = background.copy()
+            self.surface.blits([(self.tile, (x * block, y * block)) for x, y in body], doreturn=False)
+        else:
+            # A left cell may already be occupied again, by a segment the body has wrapped onto
+            restored = [(background, (x * block, y * block), (x * block, y * block, block, block))
+                        for x, y in body.segments(self.tail_seq, body.tail_seq) if not body.occupied(x, y)]
+            painted = [(self.tile, (x * block, y * block))
+                       for x, y in body.segments(max(self.head_seq, body.tail_seq), body.head_seq)]
+            self.surface.blits(restored + painted, doreturn=False)
+
+        self.head_seq = body.head_seq
+        self.tail_seq = body.tail_seq
+        return self.surface
+
+    def repaint(self, surface, rect, body):
+        # Draws the segments under rect again, over anything that was drawn on top of the layer there
+        block = self.block_size
+        rect = rect.clip(surface.get_rect())
+        segments = []
+
+        if not rect.width or not rect.height:
+            return
+
+        for y in range(rect.top // block, (rect.bottom - 1) // block + 1):
+            for x in range(rect.left // block, (rect.right - 1) // block + 1):
+                if body.occupied(x, y):
+                    segments.append((self.tile, (x * block, y * block)))
+
+        surface.blits(segments, doreturn=False)
+
+
+class ChunkedLayer:
+    # SnakeLayer for a world larger than the screen. The world is cut into square chunks, and only the
+    # chunks the camera sees are built (background pattern, border and the segments in them) and kept
+    # in a least recently used cache of a fixed size. Cells the head entered and the tail left are
+    # updated in the chunks that are built, the rest are built with the current body when they come
+    # into view. A frame blits a screenful of chunks, whatever the size of the world.
+    def __init__(self, block_size, color, pattern, cols, rows, border_color=None, chunk_cells=CHUNK_CELLS,
+                 max_chunks=MAX_CHUNKS):
+        self.block_size = block_size
+        self.tile = pygame.Surface((block_size, block_size)).convert()
+        self.tile.fill(color)
+        self.pattern = pattern
+        self.cols = cols
+        self.rows = rows
+        self.border_color = border_color
+        self.chunk_cells = chunk_cells
+        self.chunk_pixels = chunk_cells * block_size
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()
+        self.builds = 0
+        self.head_seq = 0
+        self.tail_seq = 0
+
+    def update(self, body):
+        if body.head_seq - self.tail_seq > body.capacity:
+            self.chunks.clear()
+        else:
+            for x, y in body.segments(self.tail_seq, body.tail_seq):
+                if not body.occupied(x, y):
+                    self._paint_cell(x, y, None)
+
+            for x, y in body.segments(max(self.head_seq, body.tail_seq), body.head_seq):
+                self._paint_cell(x, y, self.tile)
+
+        self.head_seq = body.head_seq
+        self.tail_seq = body.tail_seq
+
+    def draw(self, surface, camera_x, camera_y, body):
+        chunk_pixels = self.chunk_pixels
+        width, height = surface.get_size()
+        blits = []
+
+        for chunk_y in range(max(0, camera_y // chunk_pixels),
+                             min(self._chunks_down(), (camera_y + height - 1) // chunk_pixels + 1)):
+            for chunk_x in range(max(0, camera_x // chunk_pixels),
+                                 min(self._chunks_across(), (camera_x + width - 1) // chunk_pixels + 1)):
+                chunk = self._chunk(chunk_x, chunk_y, body)
+                blits.append((chunk, (chunk_x * chunk_pixels - camera_x, chunk_y * chunk_pixels - camera_y)))
+
+        surface.blits(blits, doreturn=False)
+
+    def _chunks_across(self):
+        return -(-self.cols // self.chunk_cells)
+
+    def _chunks_down(self):
+        return -(-self.rows // self.chunk_cells)
+
+    def _chunk(self, chunk_x, chunk_y, body):
+        key = (chunk_x, chunk_y)
+        chunk = self.chunks.get(key)
+
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            return chunk
+
+        self.builds += 1
+        cells = self.chunk_cells
+        block = self.block_size
+        chunk = pygame.Surface((self.chunk_pixels, self.chunk_pixels)).convert()
+        self._background(chunk, chunk.get_rect(), chunk_x * self.chunk_pixels, chunk_y * self.chunk_pixels)
+
+        left = chunk_x * cells
+        top = chunk_y * cells
+        chunk.blits([(self.tile, ((x - left) * block, (y - top) * block))
+                     for y in range(top, min(top + cells, self.rows))
+                     for x in range(left, min(left + cells, self.cols)) if body.occupied(x, y)], doreturn=False)
+
+        self.chunks[key] = chunk
+
+        if len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+
+        return chunk
+
+    def _paint_cell(self, x, y, tile):
+        # tile None puts the background back
+        cells = self.chunk_cells
+        chunk = self.chunks.get((x // cells, y // cells))
+
+        if chunk is None or x < 0 or y < 0:
+            return
+
+        block = self.block_size
+        position = ((x % cells) * block, (y % cells) * block)
+
+        if tile is None:
+            self._background(chunk, pygame.Rect(position, (block, block)), x * block, y * block)
+        else:
+            chunk.blit(tile, position)
+
+    def _background(self, target, rect, world_x, world_y):
+        # Fills rect of target with the pattern repeated over the world from its top-left corner,
+        # world_x and world_y being the world position of the rect
+        pattern_width, pattern_height = self.pattern.get_size()
+        offset_y = world_y % pattern_height
+        y = rect.top
+
+        while y < rect.bottom:
+            height = min(pattern_height - offset_y, rect.bottom - y)
+            offset_x = world_x % pattern_width
+            x = rect.left
+
+            while x < rect.right:
+                width = min(pattern_width - offset_x, rect.right - x)
+                target.blit(self.pattern, (x, y), (offset_x, offset_y, width, height))
+                x += width
+                offset_x = 0
+
+            y += height
+            offset_y = 0
+
+        if self.border_color is not None:
+            # The world border, one cell wide, over the outermost cells as on the screen-sized board
+            block = self.block_size
+            world_width = self.cols * block
+            world_height = self.rows * block
+            origin_x = world_x - rect.left
+            origin_y = world_y - rect.top
+
+            for border in [(0, 0, world_width, block), (0, world_height - block, world_width, block),
+                           (0, 0, block, world_height), (world_width - block, 0, block, world_height)]:
+                clipped = pygame.Rect(border).move(-origin_x, -origin_y).clip(rect)
+
+                if clipped.width and clipped.height:
+                    target.fill(self.border_color, clipped)
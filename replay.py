@@ -0,0 +1,182 @@
+import os
+import random
+import struct
+import sys
+import time
+
+import engine
+
+# Layout: header, then one (ticks since the previous change as a varint, direction code) pair
+# for every tick on which the snake changed direction
+MAGIC = b"SNKR"
+VERSION = 1
+HEADER = struct.Struct("<4sBcHHQdhII")
+
+DIRECTIONS = [engine.LEFT, engine.RIGHT, engine.UP, engine.DOWN]
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+
+REPLAY_DIR = "saves/replays"
+MAX_REPLAYS = 50
+
+
+def new_seed():
+    return random.SystemRandom().getrandbits(63)
+
+
+def color_rng(seed):
+    # Cosmetic randomness has its own stream, so the number of drawn frames cannot change the game
+    return random.Random(f"{seed}:colors")
+
+
+class Replay:
+    def __init__(self, mode, width, height, seed, speed, hearts, ticks=0, score=0, changes=b""):
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.speed = speed
+        self.hearts = hearts
+        self.ticks = ticks
+        self.score = score
+        self.changes = bytes(changes)
+
+    def new_state(self):
+        return engine.GameState(self.mode, self.width, self.height, seed=self.seed, speed=self.speed,
+                                hearts=self.hearts)
+
+    def direction_changes(self):
+        # Yields (tick, direction): the direction is set right before the step that makes `tick` ticks
+        tick = 0
+        position = 0
+
+        while position < len(self.changes):
+            gap = 0
+            shift = 0
+
+            while True:
+                byte = self.changes[position]
+                position += 1
+                gap |= (byte & 0x7F) << shift
+                shift += 7
+
+                if byte < 0x80:
+                    break
+
+            tick += gap
+            yield tick, DIRECTIONS[self.changes[position]]
+            position += 1
+
+    def to_bytes(self):
+        header = HEADER.pack(MAGIC, VERSION, self.mode.encode(), self.width, self.height, self.seed, self.speed,
+                             self.hearts, self.ticks, self.score)
+        return header + self.changes
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, mode, width, height, seed, speed, hearts, ticks, score = HEADER.unpack_from(data)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a replay file or an unsupported version")
+
+        return cls(mode.decode(), width, height, seed, speed, hearts, ticks, score, data[HEADER.size:])
+
+    def save(self, path):
+        data = self.to_bytes()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        with open(path, "wb") as file:
+            file.write(data)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            return cls.from_bytes(file.read())
+
+
+class ReplayRecorder:
+    def __init__(self, state, seed):
+        self.replay = Replay(state.mode, state.width, state.height, seed, state.speed, state.hearts)
+        self.changes = bytearray()
+        self.direction = (state.dx, state.dy)
+        self.last_tick = 0
+
+    def before_step(self, state):
+        direction = (state.dx, state.dy)
+
+        if direction == self.direction:
+            return
+
+        gap = state.ticks - self.last_tick
+
+        while gap >= 0x80:
+            self.changes.append(gap & 0x7F | 0x80)
+            gap >>= 7
+
+        self.changes.append(gap)
+        self.changes.append(DIRECTION_CODES[direction])
+        self.direction = direction
+        self.last_tick = state.ticks
+
+    def finish(self, state):
+        self.replay.ticks = state.ticks
+        self.replay.score = state.score
+        self.replay.changes = bytes(self.changes)
+        return self.replay
+
+
+class ReplayPlayer:
+    def __init__(self, replay):
+        self.changes = replay.direction_changes()
+        self.next_change = next(self.changes, None)
+
+    def before_step(self, state):
+        # Directions are set as recorded, the reversal rule was already applied while recording
+        while self.next_change is not None and self.next_change[0] <= state.ticks:
+            state.dx, state.dy = self.next_change[1]
+            self.next_change = next(self.changes, None)
+
+
+def simulate(replay):
+    state = replay.new_state()
+    player = ReplayPlayer(replay)
+
+    while state.alive and state.ticks < replay.ticks:
+        player.before_step(state)
+        engine.step(state)
+
+    return state
+
+
+def save_replay(replay, directory=REPLAY_DIR, keep=MAX_REPLAYS):
+    name = f"{int(time.time() * 1000)}-{replay.mode}-{replay.score}.snkr"
+    path = os.path.join(directory, name)
+    replay.save(path)
+
+    # Only the newest replays are kept, the best one of every board is saved separately
+    replays = sorted(entry for entry in os.listdir(directory) if entry.endswith(".snkr")
+                     and not entry.startswith("best-"))
+
+    for old in replays[:-keep]:
+        os.remove(os.path.join(directory, old))
+
+    return path
+
+
+def save_best_replay(replay, board, directory=REPLAY_DIR):
+    # One per board (C, M, CW, MW), like the high scores, so a world record does not replace a
+    # record of the screen-sized board of its mode
+    path = os.path.join(directory, f"best-{board}.snkr")
+    replay.save(path)
+    return path
+
+
+if __name__ == "__main__":
+    # Usage: python replay.py FILE... re-simulates replays headlessly and checks their scores
+    for replay_path in sys.argv[1:]:
+        recorded = Replay.load(replay_path)
+        started = time.perf_counter()
+        result = simulate(recorded)
+        elapsed = time.perf_counter() - started
+        verdict = "ok" if result.score == recorded.score and result.ticks == recorded.ticks else "MISMATCH"
+        print(f"{replay_path}: {verdict}, score {result.score} (recorded {recorded.score}), "
+              f"{result.ticks} ticks in {elapsed:.3f} s")
@@ -0,0 +1,139 @@
+import pygame
+
+from profiler import profiler, startup
+
+# Idle scenes look at the scene again after this many milliseconds without events
+IDLE_TIMEOUT = 500
+
+
+class Scene:
+    # A screen of the game driven by SceneManager.run: every event goes to handle_event,
+    # then update and draw run once per frame, at most frame_rate frames per second.
+    #
+    # Idle scenes (menus, the pause screen) instead sleep until an event comes and are drawn only
+    # when redraw is set: on entering and resuming, and whenever handle_event finds a change.
+    frame_rate = 15
+    idle = False
+    redraw = True
+
+    def enter(self):
+        pass
+
+    def exit(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def handle_event(self, event):
+        pass
+
+    def update(self):
+        pass
+
+    def draw(self):
+        pass
+
+
+class SceneManager:
+    # Menus, the game and the pause screen live on one explicit stack instead of calling each other,
+    # so the number of Python frames and live scenes stays the same however long the session is
+    def __init__(self):
+        self.stack = []
+        self.clock = pygame.time.Clock()
+        self.running = False
+        self.on_resize = None
+        # Times an idle scene was woken up by an event, for benchmarks.game
+        self.wakeups = 0
+
+    @property
+    def top(self):
+        return self.stack[-1] if self.stack else None
+
+    def push(self, scene):
+        self.stack.append(scene)
+        scene.redraw = True
+        scene.enter()
+
+    def pop(self):
+        scene = self.stack.pop()
+        scene.exit()
+
+        if self.stack:
+            self.stack[-1].redraw = True
+            self.stack[-1].resume()
+
+        return scene
+
+    def replace(self, scene):
+        self.stack.pop().exit()
+        self.push(scene)
+
+    def reset(self, *scenes):
+        while self.stack:
+            self.stack.pop().exit()
+
+        for scene in scenes:
+            self.push(scene)
+
+    def quit(self):
+        self.running = False
+
+    def run(self):
+        self.running = True
+
+        while self.running and self.stack:
+            profiler.begin_frame(self.top)
+
+            # The overlay shows live timings, so it keeps an idle scene drawing every frame
+            idle = self.top.idle and not profiler.overlay
+
+            if idle and not self.top.redraw:
+                event = pygame.event.wait(IDLE_TIMEOUT)
+
+                if event.type == pygame.NOEVENT:
+                    events = []
+                else:
+                    self.wakeups += 1
+                    events = [event] + pygame.event.get()
+
+                profiler.lap("wait")
+            else:
+                events = pygame.event.get()
+
+            for event in events:
+                # F3 shows the performance overlay in every scene
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    profiler.toggle_overlay()
+                    self.top.redraw = True
+                    continue
+
+                # A resized window only changes where the picture is scaled to
+                if event.type == pygame.VIDEORESIZE and self.on_resize is not None:
+                    self.on_resize()
+                    self.top.redraw = True
+                    continue
+
+                if event.type == pygame.VIDEOEXPOSE:
+                    self.top.redraw = True
+
+                self.top.handle_event(event)
+
+                if not self.running or not self.stack:
+                    return
+
+            profiler.lap("events")
+            scene = self.top
+            scene.update()
+            profiler.lap("logic")
+
+            # update() may have switched to another scene, which then draws on the next frame
+            if scene is self.top and (scene.redraw or not idle):
+                scene.redraw = False
+                scene.draw()
+                startup.finish()
+
+            profiler.lap("display")
+            self.clock.tick(scene.frame_rate)
+            profiler.lap("wait")
+            profiler.end_frame()
@@ -0,0 +1,129 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+SCORES_FILE = "saves/scores.json"
+LEGACY_FILES = {"C": "saves/highscore_ce.txt", "M": "saves/highscore_mh.txt"}
+LEADERBOARD_SIZE = 10
+FLUSH_INTERVAL = 30.0
+
+
+class ScoreStore:
+    # Keeps high scores and per-mode leaderboards in memory. A background thread writes them to one
+    # compact JSON file when asked to (game over) or every flush_interval seconds if something changed.
+    # The file is replaced atomically, so a crash mid-write leaves the previous version in place.
+    #
+    # Leaderboard entries are [score, length, duration in seconds, unix timestamp], best first.
+    def __init__(self, path=SCORES_FILE, legacy_files=LEGACY_FILES, size=LEADERBOARD_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.size = size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.changed = False
+        self.closed = False
+        self.writes = 0
+        self.modes = self._load(legacy_files)
+
+        self.thread = threading.Thread(target=self._run, name="score-writer", daemon=True)
+        self.thread.start()
+
+    def _mode(self, mode):
+        return self.modes.setdefault(mode, {"high": 0, "top": []})
+
+    def high_score(self, mode):
+        with self.lock:
+            return self._mode(mode)["high"]
+
+    def leaderboard(self, mode):
+        with self.lock:
+            return [list(entry) for entry in self._mode(mode)["top"]]
+
+    def record_high_score(self, mode, score):
+        # Cheap enough for the game loop: only memory is touched, the writer thread saves it later
+        with self.lock:
+            record = self._mode(mode)
+
+            if score > record["high"]:
+                record["high"] = score
+                self.changed = True
+
+    def submit(self, mode, score, length, duration):
+        with self.lock:
+            record = self._mode(mode)
+            record["high"] = max(record["high"], score)
+            record["top"].append([score, length, round(duration, 2), int(time.time())])
+            record["top"].sort(key=lambda entry: (-entry[0], entry[3]))
+            del record["top"][self.size:]
+            self.changed = True
+
+        self.flush()
+
+    def flush(self):
+        self.wake.set()
+
+    def close(self):
+        self.closed = True
+        self.wake.set()
+        self.thread.join()
+
+    def _load(self, legacy_files):
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return json.load(file)["modes"]
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            pass
+
+        # Scores saved by older versions of the game: one bare number per mode
+        modes = {}
+
+        for mode, record_file in legacy_files.items():
+            try:
+                with open(record_file) as file:
+                    high = int(file.read())
+            except (FileNotFoundError, ValueError):
+                high = 0
+
+            modes[mode] = {"high": high, "top": []}
+
+        return modes
+
+    def _write(self):
+        with self.lock:
+            if not self.changed:
+                return
+
+            data = json.dumps({"version": 1, "modes": self.modes}, ensure_ascii=False, separators=(",", ":"))
+            self.changed = False
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(prefix=".scores-", dir=directory)
+
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.replace(temp_path, self.path)
+            self.writes += 1
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+            with self.lock:
+                self.changed = True
+
+    def _run(self):
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self._write()
+
+        self._write()
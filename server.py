@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import time
+from collections import deque
+
+import engine
+import protocol
+from arena import BONUS_ITEM, DIRECTIONS, FOOD, Arena
+
+# Usage: python server.py [--port 5555] [--tick-rate 10] [--slots 16] [--size 800x600]
+# Every room is an arena of player snakes only, run by the server at a fixed tick rate. Clients get
+# a keyframe with the whole room when they join and then one delta per tick with the cells that
+# changed, the items placed and taken and the snakes whose score, hearts or life changed.
+
+HOST = "127.0.0.1"
+PORT = 5555
+TICK_RATE = 10
+SLOTS = 16
+WIDTH = 800
+HEIGHT = 600
+
+# Inputs waiting beyond this are dropped, one input is applied per tick
+INPUT_QUEUE = 3
+
+# A client whose socket buffer holds more than this gets no deltas until it has drained, then a
+# keyframe brings it back, so a slow client never makes the server buffer without limit
+MAX_BUFFERED = 64 * 1024
+
+FOODS_PER_SLOT = 0.5
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.room = None
+        self.snake = None
+        self.inputs = deque()
+        self.acked = 0
+        self.needs_keyframe = True
+        self.stalls = 0
+
+
+class Room:
+    def __init__(self, server, name, mode):
+        self.server = server
+        self.name = name
+        self.mode = mode
+        self.arena = Arena(mode, server.width, server.height, 0, respawn=True,
+                           foods=max(1, round(server.slots * FOODS_PER_SLOT)))
+        self.clients = []
+        self.sent_snakes = {}
+        self.task = None
+
+    def full(self):
+        return len(self.clients) >= self.server.slots
+
+    def join(self, client):
+        client.room = self
+        client.snake = self.arena.add_snake()
+        client.needs_keyframe = True
+        self.clients.append(client)
+
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    def leave(self, client):
+        self.clients.remove(client)
+        self.arena.remove_snake(client.snake)
+
+    async def run(self):
+        # Ticks that are late are not caught up, the room just keeps to the rate from then on
+        interval = 1 / self.server.tick_rate
+        next_tick = time.perf_counter()
+
+        while self.clients:
+            next_tick += interval
+            self.tick()
+            delay = next_tick - time.perf_counter()
+
+            if delay < 0:
+                self.server.late_ticks += 1
+                next_tick = time.perf_counter()
+                delay = 0
+
+            await asyncio.sleep(delay)
+
+        self.server.rooms.pop(self.name, None)
+
+    def tick(self):
+        for client in self.clients:
+            while client.inputs:
+                seq, direction = client.inputs.popleft()
+                client.acked = seq
+
+                if engine.turn(client.snake, direction):
+                    break
+
+        self.arena.step()
+        self.server.ticks += 1
+
+        # The body of a delta is the same for every client of the room, only the tick header differs
+        arena = self.arena
+        delta = protocol.encode_body(arena.changes, arena.item_changes, self._changed_snakes())
+        arena.changes.clear()
+        arena.item_changes.clear()
+        keyframe = None
+
+        for client in self.clients:
+            writer = client.writer
+
+            if writer.is_closing():
+                continue
+
+            if writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+                if not client.needs_keyframe:
+                    client.stalls += 1
+                    self.server.stalls += 1
+
+                client.needs_keyframe = True
+                continue
+
+            if client.needs_keyframe:
+                if keyframe is None:
+                    keyframe = self._keyframe()
+
+                kind, body = protocol.KEYFRAME, keyframe
+                client.needs_keyframe = False
+            else:
+                kind, body = protocol.DELTA, delta
+
+            head = protocol.TICK_HEAD.pack(arena.ticks, client.acked)
+            message = protocol.HEADER.pack(len(head) + len(body), kind) + head + body
+            writer.write(message)
+            self.server.bytes_sent += len(message)
+
+    def _snake_record(self, snake):
+        return snake.index, snake.score, max(0, snake.hearts), snake.alive and snake.active
+
+    def _changed_snakes(self):
+        changed = []
+
+        for snake in self.arena.snakes:
+            record = self._snake_record(snake)
+
+            if self.sent_snakes.get(snake.index) != record:
+                self.sent_snakes[snake.index] = record
+                changed.append(record)
+
+        return changed
+
+    def _keyframe(self):
+        arena = self.arena
+        cells = []
+
+        for snake in arena.snakes:
+            for cell in snake.body:
+                if arena.owner[cell] == snake.index:
+                    y, x = divmod(cell, arena.grid_width)
+                    cells.append((x - 1, y - 1, snake.index))
+
+        items = [(FOOD, x, y, True) for x, y in arena.foods]
+        items.extend((BONUS_ITEM, x, y, True) for x, y in arena.bonuses)
+        return protocol.encode_body(cells, items, [self._snake_record(snake) for snake in arena.snakes])
+
+
+class Server:
+    def __init__(self, tick_rate=TICK_RATE, slots=SLOTS, width=WIDTH, height=HEIGHT):
+        self.tick_rate = tick_rate
+        self.slots = slots
+        self.width = width
+        self.height = height
+        self.rooms = {}
+        self.ticks = 0
+        self.late_ticks = 0
+        self.stalls = 0
+        self.bytes_sent = 0
+
+    def room_for(self, name, mode):
+        # A full room is continued under a numbered name, so any number of clients can ask for one room
+        number = 0
+        key = name
+
+        while key in self.rooms and (self.rooms[key].full() or self.rooms[key].mode != mode):
+            number += 1
+            key = f"{name}#{number}"
+
+        if key not in self.rooms:
+            self.rooms[key] = Room(self, key, mode)
+
+        return self.rooms[key]
+
+    async def handle(self, reader, writer):
+        client = Client(reader, writer)
+
+        try:
+            while True:
+                header = await reader.readexactly(protocol.HEADER.size)
+                length, kind = protocol.HEADER.unpack(header)
+
+                if length > protocol.MAX_PAYLOAD:
+                    break
+
+                payload = await reader.readexactly(length)
+
+                if kind == protocol.TURN and client.snake is not None:
+                    seq, index = protocol.TURN_BODY.unpack(payload)
+
+                    if index < len(DIRECTIONS) and len(client.inputs) < INPUT_QUEUE:
+                        client.inputs.append((seq, DIRECTIONS[index]))
+                    else:
+                        client.acked = seq
+                elif kind == protocol.JOIN and client.room is None:
+                    mode = payload[:1].decode()
+
+                    if mode not in (engine.CLASSIC, engine.MODERN):
+                        break
+
+                    room = self.room_for(payload[1:].decode(errors="replace"), mode)
+                    room.join(client)
+                    arena = room.arena
+                    writer.write(protocol.frame(protocol.WELCOME, protocol.WELCOME_BODY.pack(
+                        client.snake.index, arena.cols, arena.rows, mode.encode(), self.tick_rate, self.slots)))
+                elif kind == protocol.LEAVE:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if client.room is not None:
+                client.room.leave(client)
+
+            writer.close()
+
+    def stats(self):
+        return {"rooms": len(self.rooms), "clients": sum(len(room.clients) for room in self.rooms.values()),
+                "ticks": self.ticks, "late_ticks": self.late_ticks, "stalls": self.stalls,
+                "bytes_sent": self.bytes_sent}
+
+
+async def serve(host, port, server, report=0):
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"Serving on {host}:{port}, {server.tick_rate} ticks/s, {server.slots} players per room", flush=True)
+
+    async with listener:
+        if not report:
+            await listener.serve_forever()
+
+        previous = server.stats()
+
+        while True:
+            await asyncio.sleep(report)
+            stats = server.stats()
+            print(f"rooms={stats['rooms']} clients={stats['clients']} "
+                  f"ticks/s={(stats['ticks'] - previous['ticks']) / report:.1f} "
+                  f"kB/s={(stats['bytes_sent'] - previous['bytes_sent']) / report / 1024:.1f} "
+                  f"late={stats['late_ticks']} stalls={stats['stalls']}", flush=True)
+            previous = stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snake multiplayer server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE)
+    parser.add_argument("--slots", type=int, default=SLOTS, help="players per room")
+    parser.add_argument("--size", default=f"{WIDTH}x{HEIGHT}", help="board size in pixels")
+    parser.add_argument("--report", type=float, default=0, help="print the load every this many seconds")
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.size.split("x"))
+    server = Server(args.tick_rate, args.slots, width, height)
+
+    try:
+        asyncio.run(serve(args.host, args.port, server, args.report))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
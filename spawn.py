@@ -0,0 +1,107 @@
+from array import array
+
+SAMPLE_ATTEMPTS = 64
+
+
+class FreeCells:
+    # Unoccupied cells of the spawn region of a SnakeBody grid. The free cells are kept densely in one
+    # array and every cell remembers its position there, so taking a cell, giving it back and picking
+    # a uniformly random free cell are all constant-time, however full the board is.
+    def __init__(self, body, left, top, right, bottom):
+        self.body = body
+        self.cells = array("l")
+        self.index = array("l", [-1]) * body.grid_size
+        self.region = bytearray(body.grid_size)
+
+        width = right - left + 1
+
+        for y in range(top, bottom + 1):
+            start = body.cell(left, y)
+            self.region[start:start + width] = b"\x01" * width
+            self.index[start:start + width] = array("l", range(len(self.cells), len(self.cells) + width))
+            self.cells.extend(range(start, start + width))
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, cell):
+        return self.index[cell] >= 0
+
+    def add(self, cell):
+        if self.region[cell] and self.index[cell] < 0:
+            self.index[cell] = len(self.cells)
+            self.cells.append(cell)
+
+    def remove(self, cell):
+        position = self.index[cell]
+
+        if position < 0:
+            return
+
+        last = self.cells.pop()
+
+        if last != cell:
+            self.cells[position] = last
+            self.index[last] = position
+
+        self.index[cell] = -1
+
+    def sample(self, rng):
+        if not self.cells:
+            return None
+
+        return self.cells[int(rng.random() * len(self.cells))]
+
+
+class SparseFreeCells:
+    # FreeCells for worlds too large to list every cell: only the taken cells are stored, and a free
+    # cell is found by drawing random cells of the region until one is not taken. The snake covers a
+    # tiny share of such a world, so that takes one or two draws.
+    def __init__(self, body, left, top, right, bottom, attempts=SAMPLE_ATTEMPTS):
+        self.body = body
+        self.left = left
+        self.top = top
+        self.width = right - left + 1
+        self.height = bottom - top + 1
+        self.attempts = attempts
+        self.taken = set()
+        self.taken_in_region = 0
+
+    def __len__(self):
+        return self.width * self.height - self.taken_in_region
+
+    def __contains__(self, cell):
+        return self._in_region(cell) and cell not in self.taken
+
+    def _in_region(self, cell):
+        y, x = divmod(cell, self.body.grid_width)
+        return 0 <= x - 1 - self.left < self.width and 0 <= y - 1 - self.top < self.height
+
+    def add(self, cell):
+        if cell in self.taken:
+            self.taken.remove(cell)
+            self.taken_in_region -= self._in_region(cell)
+
+    def remove(self, cell):
+        if cell not in self.taken:
+            self.taken.add(cell)
+            self.taken_in_region += self._in_region(cell)
+
+    def sample(self, rng):
+        for _ in range(self.attempts):
+            cell = self.body.cell(self.left + int(rng.random() * self.width),
+                                  self.top + int(rng.random() * self.height))
+
+            if cell not in self.taken:
+                return cell
+
+        return None
+
+
+def spawn_region(width, height, block_size, margin):
+    # Cells reachable by round(randrange(margin, size - margin) / block_size), the old spawn formula
+    left = round(margin / block_size)
+    top = round(margin / block_size)
+    right = round((width - margin - 1) / block_size)
+    bottom = round((height - margin - 1) / block_size)
+    return left, top, right, bottom
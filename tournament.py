@@ -0,0 +1,424 @@
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+
+import engine
+from autopilot import Autopilot
+
+# Usage: python tournament.py [--games 100] [--grid bonus_threshold=3,5,8 ...] [--bots autopilot,greedy,random]
+#                             [--modes C,M] [--workers N] [--output saves/tournament.bin]
+#        python tournament.py --report saves/tournament.bin
+# Headless games of bots for every combination of the rule values in the grid, played by a pool of
+# processes. Every game is written to the output file as it finishes and counted in the summaries,
+# which keep bucketed distributions instead of the results. Every configuration plays the same seeds,
+# so differences between configurations are not differences of luck.
+
+RESOLUTION = "640x480"
+GAMES = 100
+MAX_TICKS = 20000
+BATCH_GAMES = 10
+OUTPUT = "saves/tournament.bin"
+
+# Columns of the output file with their array type codes
+COLUMNS = [("config", "H"), ("bot", "B"), ("mode", "B"), ("seed", "I"), ("score", "I"), ("length", "I"),
+           ("ticks", "I"), ("seconds", "f"), ("eaten", "I"), ("bonuses", "I"), ("limit", "B")]
+MODES = [engine.CLASSIC, engine.MODERN]
+
+# Layout: MAGIC, VERSION, the length of a JSON header and the header, then blocks of up to BLOCK_ROWS
+# rows, every block being its row count followed by its columns one after the other, little-endian
+MAGIC = b"SNKT"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sBI")
+BLOCK_HEADER = struct.Struct("<I")
+BLOCK_ROWS = 4096
+
+# Quantiles are kept to within this ratio of the true value
+BUCKET_GROWTH = 1.05
+
+# The random bot keeps its direction this often when it can
+STRAIGHT = 0.8
+
+
+# --- Bots ---
+def next_cell(state, direction):
+    # Where the head goes with this direction, with the wrapping of engine.step
+    x = 0 if state.x >= state.cols else state.cols - 1 if state.x < 0 else state.x
+    y = 0 if state.y >= state.rows else state.rows - 1 if state.y < 0 else state.y
+    return x + direction[0], y + direction[1]
+
+
+def safe_moves(state):
+    # Directions into free cells inside the field, or across the border in the classic mode when
+    # nothing inside is free
+    inside = []
+    across = []
+
+    for direction in (engine.LEFT, engine.RIGHT, engine.UP, engine.DOWN):
+        if direction[0] == -state.dx and direction[1] == -state.dy:
+            continue
+
+        x, y = next_cell(state, direction)
+
+        if state.body.occupied(x, y):
+            continue
+
+        if 0 <= x < state.cols and 0 <= y < state.rows:
+            inside.append(direction)
+        elif state.mode == engine.CLASSIC:
+            across.append(direction)
+
+    return inside or across
+
+
+def autopilot_bot(state, rng):
+    return Autopilot(state).decide
+
+
+def greedy_bot(state, rng):
+    # The safe move that brings the head closest to the food
+    def decide(state):
+        moves = safe_moves(state)
+
+        if not moves:
+            return None
+
+        def distance(move):
+            x, y = next_cell(state, move)
+            return abs(x - state.food[0]) + abs(y - state.food[1])
+
+        return min(moves, key=distance)
+
+    return decide
+
+
+def random_bot(state, rng):
+    def decide(state):
+        moves = safe_moves(state)
+
+        if not moves:
+            return None
+
+        if (state.dx, state.dy) in moves and rng.random() < STRAIGHT:
+            return state.dx, state.dy
+
+        return rng.choice(moves)
+
+    return decide
+
+
+BOTS = {"autopilot": autopilot_bot, "greedy": greedy_bot, "random": random_bot}
+
+
+# --- Games ---
+def play_game(mode, bot, rules, seed, width, height, max_ticks):
+    state = engine.GameState(mode, width, height, seed=seed, rules=rules)
+    decide = BOTS[bot](state, random.Random(f"{seed}:bot"))
+    seconds = 0.0
+    eaten = 0
+    bonuses = 0
+
+    while state.alive and state.ticks < max_ticks:
+        direction = decide(state)
+
+        if direction is not None:
+            engine.turn(state, direction)
+
+        seconds += 1 / state.speed
+
+        for event in engine.step(state)[1]:
+            if event == engine.EAT:
+                eaten += 1
+            elif event == engine.BONUS:
+                bonuses += 1
+
+    return state.score, state.length, state.ticks, seconds, eaten, bonuses, state.alive
+
+
+def play_batch(task):
+    # Runs in the pool: count games with consecutive seeds, returned as rows of the output file
+    config, rules, bot, mode, first_seed, count, width, height, max_ticks = task
+    rules = engine.Rules(**rules)
+    bot_index = list(BOTS).index(bot)
+    mode_index = MODES.index(mode)
+
+    return [(config, bot_index, mode_index, seed) + play_game(mode, bot, rules, seed, width, height, max_ticks)
+            for seed in range(first_seed, first_seed + count)]
+
+
+# --- Results file ---
+class ResultsWriter:
+    # Rows are collected into blocks of BLOCK_ROWS and every block is stored column by column, so the
+    # file is compact, a reader can take single columns, and the writer never holds more than a block
+    def __init__(self, path, metadata):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        header = json.dumps(dict(metadata, columns=COLUMNS)).encode()
+        self.file = open(path, "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, len(header)) + header)
+        self.rows = []
+
+    def write(self, rows):
+        self.rows.extend(rows)
+
+        if len(self.rows) >= BLOCK_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+
+        self.file.write(BLOCK_HEADER.pack(len(self.rows)))
+
+        for index, (_, code) in enumerate(COLUMNS):
+            column = array(code, (row[index] for row in self.rows))
+
+            if sys.byteorder == "big":
+                column.byteswap()
+
+            column.tofile(self.file)
+
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def read_results(path):
+    # Returns the header and an iterator of blocks, a block being a dict of column arrays
+    file = open(path, "rb")
+    magic, version, length = FILE_HEADER.unpack(file.read(FILE_HEADER.size))
+
+    if magic != MAGIC or version != VERSION:
+        file.close()
+        raise ValueError("Not a tournament results file or an unsupported version")
+
+    metadata = json.loads(file.read(length))
+
+    def blocks():
+        with file:
+            while True:
+                data = file.read(BLOCK_HEADER.size)
+
+                if not data:
+                    return
+
+                rows, = BLOCK_HEADER.unpack(data)
+                block = {}
+
+                for name, code in metadata["columns"]:
+                    column = array(code)
+                    column.fromfile(file, rows)
+
+                    if sys.byteorder == "big":
+                        column.byteswap()
+
+                    block[name] = column
+
+                yield block
+
+    return metadata, blocks()
+
+
+# --- Summaries ---
+class Distribution:
+    # Count, mean, spread and quantiles of a stream of non-negative values. Values are counted in
+    # buckets growing by BUCKET_GROWTH, so it takes a few hundred counters whatever the number of games.
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.squares = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        difference = value - self.mean
+        self.mean += difference / self.count
+        self.squares += difference * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+        # Zero has a bucket of its own, below all others
+        key = math.floor(math.log(value, BUCKET_GROWTH)) if value > 0 else -math.inf
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def stdev(self):
+        return math.sqrt(self.squares / (self.count - 1)) if self.count > 1 else 0.0
+
+    def quantile(self, fraction):
+        rank = fraction * (self.count - 1)
+        seen = 0
+
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+
+            if seen > rank:
+                if key == -math.inf:
+                    return 0.0
+
+                return min(self.maximum, max(self.minimum, BUCKET_GROWTH ** (key + 0.5)))
+
+        return self.maximum
+
+
+class Summary:
+    # The distributions of one configuration, bot and mode
+    def __init__(self):
+        self.score = Distribution()
+        self.length = Distribution()
+        self.seconds = Distribution()
+        self.limit = 0
+
+    def add(self, score, length, seconds, limit):
+        self.score.add(score)
+        self.length.add(length)
+        self.seconds.add(seconds)
+        self.limit += limit
+
+
+def summarize_row(summaries, row):
+    config, bot, mode, _, score, length, _, seconds, _, _, limit = row
+    summary = summaries.setdefault((mode, bot, config), Summary())
+    summary.add(score, length, seconds, limit)
+
+
+def report(summaries, metadata):
+    for (mode, bot, config), summary in sorted(summaries.items()):
+        values = metadata["configs"][config]
+        name = " ".join(f"{key}={value}" for key, value in values.items()) or "defaults"
+        score = summary.score
+        seconds = summary.seconds
+        print(f"{metadata['modes'][mode]} {metadata['bots'][bot]} {name}: {score.count} games, "
+              f"score mean {score.mean:.1f} sd {score.stdev():.1f} p10/p50/p90 "
+              f"{score.quantile(0.1):.0f}/{score.quantile(0.5):.0f}/{score.quantile(0.9):.0f}, "
+              f"length p50/p90 {summary.length.quantile(0.5):.0f}/{summary.length.quantile(0.9):.0f}, "
+              f"survival p50/p90 {seconds.quantile(0.5):.1f}/{seconds.quantile(0.9):.1f} s, "
+              f"alive at the tick limit {summary.limit / score.count:.0%}")
+
+
+def report_file(path):
+    metadata, blocks = read_results(path)
+    summaries = {}
+
+    for block in blocks:
+        for row in zip(*(block[name] for name, _ in COLUMNS)):
+            summarize_row(summaries, row)
+
+    report(summaries, metadata)
+
+
+# --- Command line ---
+def parse_grid(entries):
+    # name=v1,v2,... for every rule to sweep, the others keep their defaults
+    defaults = vars(engine.DEFAULT_RULES)
+    grid = {}
+
+    for entry in entries:
+        name, _, values = entry.partition("=")
+
+        if name not in defaults:
+            raise SystemExit(f"Unknown rule {name!r}, the rules are: {', '.join(defaults)}")
+
+        try:
+            numbers = [float(value) for value in values.split(",")]
+        except ValueError:
+            raise SystemExit(f"Bad value in {entry!r}, a rule takes numbers separated by commas") from None
+
+        grid[name] = [int(value) if value.is_integer() else value for value in numbers]
+
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+
+def make_tasks(configs, bots, modes, games, width, height, max_ticks, seed):
+    tasks = []
+
+    for config, values in enumerate(configs):
+        rules = dict(vars(engine.DEFAULT_RULES), **values)
+
+        for bot in bots:
+            for mode in modes:
+                for first in range(0, games, BATCH_GAMES):
+                    tasks.append((config, rules, bot, mode, seed + first, min(BATCH_GAMES, games - first),
+                                  width, height, max_ticks))
+
+    return tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless bot tournaments over a grid of rule values")
+    parser.add_argument("--grid", action="append", default=[], metavar="RULE=V1,V2",
+                        help=f"values of a rule to sweep, one of {', '.join(vars(engine.DEFAULT_RULES))}")
+    parser.add_argument("--bots", default="autopilot,greedy", help=f"any of {','.join(BOTS)}")
+    parser.add_argument("--modes", default="C,M")
+    parser.add_argument("--games", type=int, default=GAMES, help="games per configuration, bot and mode")
+    parser.add_argument("--max-ticks", type=int, default=MAX_TICKS, help="games still running then are stopped")
+    parser.add_argument("--resolution", default=RESOLUTION)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default=OUTPUT)
+    parser.add_argument("--report", metavar="PATH", help="only summarize a results file")
+    args = parser.parse_args()
+
+    if args.report:
+        report_file(args.report)
+        return
+
+    bots = args.bots.split(",")
+    modes = args.modes.split(",")
+
+    for bot in bots:
+        if bot not in BOTS:
+            raise SystemExit(f"Unknown bot {bot!r}")
+
+    for mode in modes:
+        if mode not in MODES:
+            raise SystemExit(f"Unknown mode {mode!r}")
+
+    width, height = (int(value) for value in args.resolution.split("x"))
+    configs = parse_grid(args.grid)
+    tasks = make_tasks(configs, bots, modes, args.games, width, height, args.max_ticks, args.seed)
+    total = len(configs) * len(bots) * len(modes) * args.games
+
+    # Indices in the file are into these lists
+    metadata = {"configs": configs, "bots": list(BOTS), "modes": MODES, "resolution": args.resolution,
+                "max_ticks": args.max_ticks, "defaults": vars(engine.DEFAULT_RULES)}
+    writer = ResultsWriter(args.output, metadata)
+    summaries = {}
+    done = 0
+    started = time.perf_counter()
+    shown = started
+
+    try:
+        with multiprocessing.Pool(args.workers) as pool:
+            for rows in pool.imap_unordered(play_batch, tasks):
+                writer.write(rows)
+
+                for row in rows:
+                    summarize_row(summaries, row)
+
+                done += len(rows)
+                now = time.perf_counter()
+
+                if now - shown > 1:
+                    shown = now
+                    print(f"{done}/{total} games, {done / (now - started):.0f} games/s", file=sys.stderr)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"{done} games in {elapsed:.1f} s on {args.workers} processes ({done / elapsed:.0f} games/s), "
+          f"results in {args.output}")
+    report(summaries, metadata)
+
+
+if __name__ == "__main__":
+    main()